@@ -1,11 +1,19 @@
 import pg8000.dbapi as db
 import pandas as pd
+import matplotlib
 import matplotlib.pyplot as plt
 import seaborn as sns
 from matplotlib.backends.backend_pdf import PdfPages
 import os
+import glob
+import json
+import hashlib
+import inspect
 from config import settings
 
+CACHE_DIR = "report_cache"
+PAGE_DPI = 150  # resolution of the cached page images
+
 def get_db_config():
     """Get DB config from settings"""
     return {
@@ -43,18 +51,18 @@ def get_data(query):
     conn.close()
     return df
 
-def plot_heatmap_activity(pdf):
-    print("1. [Seaborn] Drawing Heatmap...")
-    query = """
+HEATMAP_QUERY = """
         SELECT EXTRACT(YEAR FROM concert_date)::INT as year, 
                EXTRACT(MONTH FROM concert_date)::INT as month, 
                COUNT(*) as count
         FROM Concerts
-        WHERE EXTRACT(YEAR FROM concert_date) >= 2010
+        WHERE concert_date >= DATE '2010-01-01'
         GROUP BY year, month
         ORDER BY year DESC, month ASC;
     """
-    df = get_data(query)
+
+def plot_heatmap_activity(df):
+    print("1. [Seaborn] Drawing Heatmap...")
     pivot_table = df.pivot(index="year", columns="month", values="count").fillna(0)
 
     fig, ax = plt.subplots(figsize=(12, 8))
@@ -70,13 +78,9 @@ def plot_heatmap_activity(pdf):
     ax.set_title("ACTIVITY HEATMAP (2010-2024)", color=COLORS["orange"], pad=20, fontweight="bold")
     ax.set_xlabel("Month", color=COLORS["text"])
     ax.set_ylabel("Year", color=COLORS["text"])
+    return fig
 
-    pdf.savefig(fig, facecolor=COLORS["bg"])
-    plt.close()
-
-def plot_artist_barplot(pdf):
-    print("2. [Seaborn] Drawing Top Artists (Barplot)...")
-    query = """
+ARTISTS_QUERY = """
         SELECT T2.artist_name, COUNT(T1.concert_id) as count
         FROM Concerts AS T1 
         JOIN Artists AS T2 ON T1.artist_mbid = T2.artist_mbid
@@ -84,8 +88,9 @@ def plot_artist_barplot(pdf):
         ORDER BY count DESC 
         LIMIT 10;
     """
-    df = get_data(query)
 
+def plot_artist_barplot(df):
+    print("2. [Seaborn] Drawing Top Artists (Barplot)...")
     fig, ax = plt.subplots(figsize=(12, 8))
     sns.barplot(x="count", y="artist_name", data=df,
                 palette="blend:#7000FF,#FF5E00",
@@ -95,13 +100,9 @@ def plot_artist_barplot(pdf):
     ax.set_xlabel("Show count", color=COLORS["text"])
     ax.set_ylabel("", color=COLORS["text"])
     ax.bar_label(ax.containers[0], color=COLORS["text"], padding=5)
+    return fig
 
-    pdf.savefig(fig, facecolor=COLORS["bg"])
-    plt.close()
-
-def plot_country_boxplot(pdf):
-    print("3. [Seaborn] Drawing Country Distribution (Boxplot)...")
-    query = """
+COUNTRIES_QUERY = """
         SELECT T2.country_name, EXTRACT(YEAR FROM concert_date) as year, COUNT(*) as count
         FROM Concerts AS T1
         JOIN Venues AS V ON T1.venue_id = V.venue_id
@@ -110,8 +111,9 @@ def plot_country_boxplot(pdf):
         WHERE T2.country_code IN ('DE', 'GB', 'FR', 'IT', 'ES')
         GROUP BY T2.country_name, year;
     """
-    df = get_data(query)
 
+def plot_country_boxplot(df):
+    print("3. [Seaborn] Drawing Country Distribution (Boxplot)...")
     fig, ax = plt.subplots(figsize=(12, 8))
     sns.boxplot(x="country_name", y="count", data=df,
                 palette="dark:violet",
@@ -123,20 +125,17 @@ def plot_country_boxplot(pdf):
     ax.set_title("CONCERT TOUR DENSITY (DISTRIBUTION)", color=COLORS["purple"], pad=20, fontweight="bold")
     ax.set_ylabel("Concerts per year", color=COLORS["text"])
     ax.set_xlabel("Country", color=COLORS["text"])
+    return fig
 
-    pdf.savefig(fig, facecolor=COLORS["bg"])
-    plt.close()
-
-def plot_trend_regplot(pdf):
-    print("4. [Seaborn] Drawing Trend with Regression...")
-    query = """
+TREND_QUERY = """
         SELECT EXTRACT(YEAR FROM concert_date)::INT as year, COUNT(*) as count
         FROM Concerts
         GROUP BY year
         ORDER BY year ASC;
     """
-    df = get_data(query)
 
+def plot_trend_regplot(df):
+    print("4. [Seaborn] Drawing Trend with Regression...")
     fig, ax = plt.subplots(figsize=(12, 8))
     sns.regplot(x="year", y="count", data=df,
                 scatter_kws={"color": COLORS["orange"], "s": 100},
@@ -144,30 +143,98 @@ def plot_trend_regplot(pdf):
                 ax=ax)
 
     ax.set_title("INDUSTRY GROWTH TREND (WITH REGRESSION LINE)", color=COLORS["text"], pad=20, fontweight="bold")
-
-    pdf.savefig(fig, facecolor=COLORS["bg"])
-    plt.close()
+    return fig
+
+def plot_title_page(df):
+    fig = plt.figure(figsize=(11, 8))
+    fig.text(0.5, 0.6, "ROCK DATA SCENE", ha='center', va='center', fontsize=50, fontweight='bold',
+             color=COLORS["orange"])
+    fig.text(0.5, 0.5, "ADVANCED SEABORN ANALYTICS", ha='center', va='center', fontsize=20,
+             color=COLORS["purple"])
+    return fig
+
+# (page key, query, drawing function); pages without a query never change
+REPORT_PAGES = [
+    ("title", None, plot_title_page),
+    ("heatmap", HEATMAP_QUERY, plot_heatmap_activity),
+    ("artists", ARTISTS_QUERY, plot_artist_barplot),
+    ("countries", COUNTRIES_QUERY, plot_country_boxplot),
+    ("trend", TREND_QUERY, plot_trend_regplot),
+]
+
+def style_fingerprint():
+    """Everything shared by all pages: theme code, palette and plotting library versions"""
+    return "\n".join([
+        inspect.getsource(set_seaborn_style),
+        json.dumps(COLORS, sort_keys=True),
+        matplotlib.__version__,
+        sns.__version__,
+        str(PAGE_DPI),
+    ])
+
+def page_key(key, df, draw):
+    """Hash of the page's data, drawing code and style: equal hash means an identical page"""
+    digest = hashlib.sha256(inspect.getsource(draw).encode("utf-8"))
+    digest.update(style_fingerprint().encode("utf-8"))
+    if df is not None:
+        digest.update(df.to_csv(index=False).encode("utf-8"))
+    return f"{key}-{digest.hexdigest()[:16]}"
+
+def render_page(key, query, draw):
+    """Return the path of the page image, drawing it only if its data changed since the last run"""
+    df = get_data(query) if query else None
+    cache_key = page_key(key, df, draw)
+    cache_path = os.path.join(CACHE_DIR, f"{cache_key}.png")
+
+    if os.path.exists(cache_path):
+        print(f"   [cache] {key}: data unchanged, reusing rendered page")
+        return cache_key, cache_path
+
+    fig = draw(df)
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    for stale in glob.glob(os.path.join(CACHE_DIR, f"{key}-*.png")):
+        os.remove(stale)
+    # Written under a temporary name so an interrupted run never leaves a truncated page
+    tmp_path = f"{cache_path}.tmp"
+    fig.savefig(tmp_path, format="png", dpi=PAGE_DPI, facecolor=COLORS["bg"])
+    plt.close(fig)
+    os.replace(tmp_path, cache_path)
+    return cache_key, cache_path
+
+def assemble_report(filename, image_paths):
+    """Write the rendered pages into one PDF, one image per page at its native size"""
+    with PdfPages(filename) as pdf:
+        for path in image_paths:
+            image = plt.imread(path)
+            height, width = image.shape[:2]
+            fig = plt.figure(figsize=(width / PAGE_DPI, height / PAGE_DPI), dpi=PAGE_DPI)
+            fig.figimage(image)
+            pdf.savefig(fig, dpi=PAGE_DPI)
+            plt.close(fig)
 
 def create_seaborn_report():
     set_seaborn_style()
     filename = 'rock_analytics_seaborn.pdf'
+    manifest_path = os.path.join(CACHE_DIR, "report_manifest.json")
 
     print(f"Generating advanced report: {filename}...")
 
     try:
-        with PdfPages(filename) as pdf:
-            fig = plt.figure(figsize=(11, 8))
-            fig.text(0.5, 0.6, "ROCK DATA SCENE", ha='center', va='center', fontsize=50, fontweight='bold',
-                     color=COLORS["orange"])
-            fig.text(0.5, 0.5, "ADVANCED SEABORN ANALYTICS", ha='center', va='center', fontsize=20,
-                     color=COLORS["purple"])
-            pdf.savefig(fig, facecolor=COLORS["bg"])
-            plt.close()
-
-            plot_heatmap_activity(pdf)
-            plot_artist_barplot(pdf)
-            plot_country_boxplot(pdf)
-            plot_trend_regplot(pdf)
+        pages = [render_page(key, query, draw) for key, query, draw in REPORT_PAGES]
+        page_keys = [cache_key for cache_key, _ in pages]
+
+        previous = None
+        if os.path.exists(manifest_path):
+            with open(manifest_path, "r", encoding="utf-8") as f:
+                previous = json.load(f)
+        if os.path.exists(filename) and previous == {"file": filename, "pages": page_keys}:
+            print(f"\n✅ NO CHANGES! Report is up to date: {os.path.abspath(filename)}")
+            return
+
+        assemble_report(filename, [path for _, path in pages])
+
+        with open(manifest_path, "w", encoding="utf-8") as f:
+            json.dump({"file": filename, "pages": page_keys}, f, indent=2)
 
         print(f"\n✅ DONE! Check file: {os.path.abspath(filename)}")
 
@@ -0,0 +1,285 @@
+import asyncio
+import json
+import logging
+import math
+import re
+import time
+from dataclasses import dataclass, field
+from collections import deque
+from typing import Deque, Dict, List, Optional, Pattern, Tuple
+
+from api_database import statement_timeout_ms, read_pool_size, background, EXPORT_POOL_SIZE
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class RouteLimit:
+    """Concurrency budget of one endpoint"""
+    name: str
+    pool_share: float  # fraction of its pool this endpoint may use at once
+    statement_timeout_ms: int
+    reads_replicas: bool = True  # sized to the pool reads are currently routed to (read_pool_size)
+    max_wait: float = 2.0  # seconds a request may wait for a slot
+    queue_factor: int = 2  # wait queue length as a multiple of the limit
+
+    pool_size: int = 0
+    limit: int = 0
+    queue_size: int = 0
+    active: int = 0
+    waiting: int = 0
+    counters: Dict[str, int] = field(default_factory=lambda: {
+        "accepted": 0, "shed_queue_full": 0, "shed_timeout": 0, "rate_limited": 0
+    })
+    _waiters: Deque[asyncio.Future] = field(default_factory=deque)
+
+    def configure(self, pool_size: int):
+        """Size the limits to `pool_size`; may be called again when the routable pool changes"""
+        self.pool_size = pool_size
+        self.limit = max(1, int(pool_size * self.pool_share))
+        self.queue_size = self.limit * self.queue_factor
+        self._wake()
+
+    def _wake(self):
+        # Hand free slots to waiters in arrival order (timed out ones are skipped)
+        while self._waiters and self.active < self.limit:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self.active += 1
+                waiter.set_result(None)
+
+    async def acquire(self) -> Optional[str]:
+        """Take a slot; returns the shed reason if the request must be rejected"""
+        if self.active >= self.limit and self.waiting >= self.queue_size:
+            return "shed_queue_full"
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        self._wake()
+        if waiter.done():
+            return None
+
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(waiter, timeout=self.max_wait)
+        except asyncio.TimeoutError:
+            # A slot handed over as the timeout fired is still ours
+            if not (waiter.done() and not waiter.cancelled()):
+                return "shed_timeout"
+        finally:
+            self.waiting -= 1
+        return None
+
+    def release(self):
+        self.active -= 1
+        self._wake()
+
+    def snapshot(self) -> dict:
+        return {
+            "limit": self.limit,
+            "queue_size": self.queue_size,
+            "active": self.active,
+            "waiting": self.waiting,
+            "statement_timeout_ms": self.statement_timeout_ms,
+            **self.counters
+        }
+
+
+class TokenBucket:
+    __slots__ = ("tokens", "updated")
+
+    def __init__(self, capacity: float):
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def take(self, rate: float, capacity: float) -> float:
+        """Consume one token; returns seconds to wait if the bucket is empty"""
+        now = time.monotonic()
+        self.tokens = min(capacity, self.tokens + (now - self.updated) * rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / rate
+
+
+# Each endpoint gets its own share, so one slow endpoint (nearby, similar) only
+# sheds its own requests. Read shares sum to 1.0 of the read pool (the healthy
+# replicas, or the primary's engine connections left after the background
+# budget), so admitted requests never queue on the pool itself. Exports hold an
+# asyncpg connection for the whole download and get that pool to themselves.
+# Cache misses of stats and artist routes compute on the primary's background
+# budget (api_database.background), not on the read pool.
+ROUTE_LIMITS: List[Tuple[Pattern, RouteLimit]] = [
+    (re.compile(r"/api/v1/export/"),
+     RouteLimit("export", pool_share=1.0, statement_timeout_ms=600_000, max_wait=0.5, reads_replicas=False)),
+    (re.compile(r"/api/v1/stats/top-songs/approx$"),
+     RouteLimit("stats-approx", pool_share=0.1, statement_timeout_ms=5_000)),
+    (re.compile(r"/api/v1/stats/"), RouteLimit("stats", pool_share=0.15, statement_timeout_ms=5_000)),
+    (re.compile(r"/api/v1/changes$"), RouteLimit("changes", pool_share=0.1, statement_timeout_ms=3_000)),
+    (re.compile(r"/api/v1/concerts/nearby$"),
+     RouteLimit("concerts-nearby", pool_share=0.1, statement_timeout_ms=3_000)),
+    (re.compile(r"/api/v1/concerts/[^/]+/similar$"),
+     RouteLimit("concerts-similar", pool_share=0.1, statement_timeout_ms=3_000)),
+    (re.compile(r"/api/v1/concerts/"), RouteLimit("concerts", pool_share=0.15, statement_timeout_ms=3_000)),
+    (re.compile(r"/api/v1/artists/[^/]+/transitions$"),
+     RouteLimit("artist-transitions", pool_share=0.1, statement_timeout_ms=3_000)),
+    (re.compile(r"/api/v1/artists/"), RouteLimit("artists", pool_share=0.15, statement_timeout_ms=3_000)),
+    (re.compile(r"/api/v1/"), RouteLimit("other", pool_share=0.05, statement_timeout_ms=3_000)),
+]
+
+# Long-lived streams never touch the pool per message, so they have no route
+# limit; opening one is rate limited and each client may hold only a few
+STREAM_PREFIXES = ("/api/v1/stream/",)
+STREAM_RETRY_AFTER = 30.0  # seconds; a client at its cap has to close a stream first
+
+
+@dataclass
+class StreamLimit:
+    """Open streams per client"""
+    per_client: int
+    open: Dict[str, int] = field(default_factory=dict)
+    counters: Dict[str, int] = field(default_factory=lambda: {
+        "accepted": 0, "shed_too_many_streams": 0, "rate_limited": 0
+    })
+
+    def acquire(self, client: str) -> bool:
+        if self.open.get(client, 0) >= self.per_client:
+            return False
+        self.open[client] = self.open.get(client, 0) + 1
+        return True
+
+    def release(self, client: str):
+        remaining = self.open[client] - 1
+        if remaining:
+            self.open[client] = remaining
+        else:
+            del self.open[client]
+
+    def snapshot(self) -> dict:
+        return {
+            "per_client": self.per_client,
+            "active": sum(self.open.values()),
+            "clients": len(self.open),
+            **self.counters
+        }
+
+
+STREAMS = StreamLimit(per_client=settings.stream_max_per_client)
+
+MAX_TRACKED_CLIENTS = 10_000
+
+
+class AdmissionControlMiddleware:
+    """ASGI middleware: per-client rate limits and per-route concurrency limits.
+
+    Rejected requests get 429 (client over its rate or stream count) or 503
+    (route saturated) with `Retry-After`, instead of queueing on pool acquisition.
+    """
+
+    def __init__(self, app, export_pool: int = EXPORT_POOL_SIZE,
+                 read_pool: Optional[int] = None,
+                 rate: float = settings.rate_limit_per_second,
+                 burst: int = settings.rate_limit_burst):
+        self.app = app
+        self.rate = rate
+        self.burst = burst
+        self.route_limits = ROUTE_LIMITS
+        self.streams = STREAMS
+        self.read_pool = read_pool  # None: follow the healthy replicas (read_pool_size)
+        for _, route_limit in self.route_limits:
+            if route_limit.reads_replicas:
+                route_limit.configure(read_pool if read_pool is not None else read_pool_size())
+            else:
+                route_limit.configure(export_pool)
+        self._buckets: Dict[str, TokenBucket] = {}
+
+    def _resize(self, route_limit: RouteLimit):
+        # Replicas fail over to the (usually smaller) primary pool and back
+        pool_size = read_pool_size()
+        if pool_size != route_limit.pool_size:
+            logger.info(f"Read pool is now {pool_size} connections, resizing '{route_limit.name}' limits")
+            route_limit.configure(pool_size)
+
+    def _classify(self, path: str) -> Optional[RouteLimit]:
+        for pattern, route_limit in self.route_limits:
+            if pattern.match(path):
+                return route_limit
+        return None
+
+    def _rate_limit(self, client: str) -> float:
+        bucket = self._buckets.get(client)
+        if bucket is None:
+            if len(self._buckets) >= MAX_TRACKED_CLIENTS:
+                self._buckets.clear()
+            bucket = self._buckets[client] = TokenBucket(self.burst)
+        return bucket.take(self.rate, self.burst)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        client = scope["client"][0] if scope.get("client") else "unknown"
+        if scope["path"].startswith(STREAM_PREFIXES):
+            return await self._stream(client, scope, receive, send)
+
+        route_limit = self._classify(scope["path"])
+        if route_limit is None:
+            return await self.app(scope, receive, send)
+        if route_limit.reads_replicas and self.read_pool is None:
+            self._resize(route_limit)
+
+        retry_after = self._rate_limit(client)
+        if retry_after:
+            route_limit.counters["rate_limited"] += 1
+            return await self._reject(send, 429, "Too many requests", retry_after)
+
+        reason = await route_limit.acquire()
+        if reason:
+            route_limit.counters[reason] += 1
+            return await self._reject(send, 503, "Server is busy", route_limit.max_wait)
+
+        route_limit.counters["accepted"] += 1
+        token = statement_timeout_ms.set(route_limit.statement_timeout_ms)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            statement_timeout_ms.reset(token)
+            route_limit.release()
+
+    async def _stream(self, client: str, scope, receive, send):
+        retry_after = self._rate_limit(client)
+        if retry_after:
+            self.streams.counters["rate_limited"] += 1
+            return await self._reject(send, 429, "Too many requests", retry_after)
+        if not self.streams.acquire(client):
+            self.streams.counters["shed_too_many_streams"] += 1
+            return await self._reject(send, 429, "Too many open streams", STREAM_RETRY_AFTER)
+
+        self.streams.counters["accepted"] += 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.streams.release(client)
+
+    @staticmethod
+    async def _reject(send, status: int, detail: str, retry_after: float):
+        body = json.dumps({"detail": detail}).encode("utf-8")
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(max(1, math.ceil(retry_after))).encode()),
+            ]
+        })
+        await send({"type": "http.response.body", "body": body})
+
+
+def admission_stats() -> dict:
+    stats = {route_limit.name: route_limit.snapshot() for _, route_limit in ROUTE_LIMITS}
+    stats["background"] = background.snapshot()
+    stats["streams"] = STREAMS.snapshot()
+    return stats
@@ -0,0 +1,266 @@
+import asyncio
+import json
+import logging
+import time
+from collections import Counter, OrderedDict, deque
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Hashable, Iterable, Optional
+
+import asyncpg
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from api_database import primary_session
+from config import settings, CHANGES_CHANNEL
+import changes
+
+logger = logging.getLogger(__name__)
+
+Loader = Callable[[AsyncSession], Awaitable[Any]]
+
+
+@dataclass
+class CacheEntry:
+    loader: Loader
+    artist_mbid: Optional[str] = None  # only changes of this artist affect the entry
+    min_year: Optional[int] = None  # only changes in this year or later affect the entry
+    value: Any = None
+    ready: bool = False
+    version: int = 0
+
+    def is_affected(self, artists: set, years: set) -> bool:
+        if self.artist_mbid is not None and self.artist_mbid not in artists:
+            return False
+        if self.min_year is not None and not any(year >= self.min_year for year in years):
+            return False
+        return True
+
+
+class QueryCache:
+    """In-process cache of query results, kept fresh by loader notifications.
+
+    Entries never expire on their own: the loader NOTIFYs `CHANGES_CHANNEL`
+    after each committed batch and only the entries depending on the touched
+    artists/years are recomputed. Values are computed on the primary, since
+    a lagging replica could return data from before the notified commit.
+    At most `max_entries` are kept (least recently used are evicted) and
+    empty results (unknown ids) are not cached.
+    """
+
+    def __init__(self, max_entries: int = settings.cache_max_entries):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Hashable, CacheEntry]" = OrderedDict()
+        self._pending: Dict[Hashable, asyncio.Task] = {}
+
+    async def get(self, key: Hashable, loader: Loader, artist_mbid: Optional[str] = None,
+                  min_year: Optional[int] = None) -> Any:
+        entry = self._entries.get(key)
+        if entry is None:
+            entry = CacheEntry(loader=loader, artist_mbid=artist_mbid, min_year=min_year)
+            self._entries[key] = entry
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        else:
+            self._entries.move_to_end(key)
+        if entry.ready:
+            return entry.value
+        return await self._load(key, entry)
+
+    async def _load(self, key: Hashable, entry: CacheEntry) -> Any:
+        # Concurrent misses for the same key share a single query
+        task = self._pending.get(key)
+        if task is None:
+            task = asyncio.create_task(self._compute(key, entry))
+            self._pending[key] = task
+            task.add_done_callback(
+                lambda done: self._pending.pop(key) if self._pending.get(key) is done else None
+            )
+        return await asyncio.shield(task)
+
+    async def _compute(self, key: Hashable, entry: CacheEntry) -> Any:
+        version = entry.version
+        async with primary_session() as db:
+            value = await entry.loader(db)
+        if value is None:
+            # Misses are not cached, or every unknown id would stay forever
+            if self._entries.get(key) is entry:
+                del self._entries[key]
+            return value
+        # A refresh started meanwhile: its result is newer, don't overwrite it
+        if entry.version == version:
+            entry.value = value
+            entry.ready = True
+        return value
+
+    async def refresh(self, artists: Iterable[str], years: Iterable[int]) -> int:
+        """Recompute the entries affected by a change before they are requested again"""
+        artists, years = set(artists), set(years)
+        affected = [
+            (key, entry) for key, entry in self._entries.items()
+            if entry.is_affected(artists, years)
+        ]
+        for key, entry in affected:
+            entry.ready = False
+            entry.version += 1
+            self._pending.pop(key, None)
+
+        results = await asyncio.gather(
+            *(self._load(key, entry) for key, entry in affected), return_exceptions=True
+        )
+        for (key, _), result in zip(affected, results):
+            if isinstance(result, Exception):
+                logger.error(f"Failed to refresh cache entry {key}: {result}")
+                self._entries.pop(key, None)
+        return len(affected)
+
+    def discard(self, key: Hashable):
+        """Stop caching (and refreshing) `key`, e.g. while it is served from elsewhere"""
+        self._entries.pop(key, None)
+
+    def clear(self):
+        self._entries.clear()
+        self._pending.clear()
+
+
+cache = QueryCache()
+
+
+def merge_changes(first: Optional[dict], second: dict) -> dict:
+    """Combine two change notifications (new concerts per month are added up)"""
+    if first is None:
+        first = {}
+    months: Counter = Counter()
+    for year, month, count in [*first.get("months", []), *second.get("months", [])]:
+        months[(year, month)] += count
+    merged = {
+        "artists": sorted(set(first.get("artists", [])) | set(second.get("artists", []))),
+        "years": sorted(set(first.get("years", [])) | set(second.get("years", []))),
+        "months": [[year, month, count] for (year, month), count in sorted(months.items())]
+    }
+    if first.get("resync") or second.get("resync"):
+        merged["resync"] = True
+    if "seq" in first or "seq" in second:
+        merged["seq"] = max(first.get("seq", 0), second.get("seq", 0))
+    return merged
+
+
+class ChangeListener:
+    """Dedicated LISTEN connection feeding loader notifications into the cache.
+
+    Notifications arriving within `delay` of each other, or while a refresh
+    is running, are merged into one refresh, so a long load (one NOTIFY per
+    batch) never piles up recomputes.
+
+    `latest_seq` is the newest change feed position seen, read from the
+    notifications and from the database on every (re)connect. It is compared
+    with the version of derived data (the stats snapshot) rather than clock
+    times, which differ between the loader and API hosts.
+    """
+
+    def __init__(self, query_cache: QueryCache, delay: float = settings.cache_refresh_delay):
+        self.cache = query_cache
+        self.delay = delay
+        self._connection: Optional[asyncpg.Connection] = None
+        self._tasks = set()
+        self._stopped = False
+        self._subscribers = []
+        self._queued: Optional[dict] = None
+        self._worker: Optional[asyncio.Task] = None
+        self.latest_seq = 0
+        self._seen = deque()  # (seq, monotonic time first seen) in increasing seq order
+
+    def _observe(self, seq: int):
+        if seq > self.latest_seq:
+            self.latest_seq = seq
+            self._seen.append((seq, time.monotonic()))
+
+    def stale_for(self, version: int) -> float:
+        """Seconds since this worker learned of a change newer than `version` (0.0 if none)"""
+        while self._seen and self._seen[0][0] <= version:
+            self._seen.popleft()
+        return time.monotonic() - self._seen[0][1] if self._seen else 0.0
+
+    def subscribe(self, callback):
+        """Register `async callback(change)` to run after the cache refresh of every change"""
+        self._subscribers.append(callback)
+
+    async def start(self):
+        self._stopped = False
+        self._connection = await asyncpg.connect(
+            user=settings.db_user,
+            password=settings.db_password,
+            host=settings.db_host,
+            port=settings.db_port,
+            database=settings.db_name
+        )
+        self._connection.add_termination_listener(self._on_terminated)
+        await self._connection.add_listener(CHANGES_CHANNEL, self._on_notification)
+        # Changes committed before listening (or while disconnected) are not notified
+        self._observe(await self._connection.fetchval(changes.LATEST_SEQ))
+        logger.info(f"Listening for data changes on '{CHANGES_CHANNEL}'")
+
+    async def stop(self):
+        self._stopped = True
+        if self._worker is not None:
+            self._worker.cancel()
+            self._worker = None
+        if self._connection is not None:
+            await self._connection.close()
+            self._connection = None
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _on_notification(self, connection, pid, channel, payload):
+        try:
+            change = json.loads(payload)
+        except json.JSONDecodeError:
+            logger.warning(f"Ignoring malformed change notification: {payload!r}")
+            return
+        self._observe(change.get("seq", 0))
+        self._queued = merge_changes(self._queued, change)
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.create_task(self._drain())
+
+    async def _drain(self):
+        while self._queued is not None:
+            await asyncio.sleep(self.delay)
+            change, self._queued = self._queued, None
+            try:
+                await self._refresh(change)
+            except Exception as e:
+                logger.error(f"Refresh after data change failed: {e}")
+
+    async def _refresh(self, change: dict):
+        refreshed = await self.cache.refresh(change.get("artists", []), change.get("years", []))
+        logger.info(f"Data changed ({len(change.get('artists', []))} artists, "
+                    f"years {change.get('years', [])}): refreshed {refreshed} cache entries")
+        for callback in self._subscribers:
+            try:
+                await callback(change)
+            except Exception as e:
+                logger.error(f"Change subscriber {callback.__name__} failed: {e}")
+
+    def _on_terminated(self, connection):
+        self._connection = None
+        if self._stopped:
+            return
+        logger.warning("Change listener connection lost. Reconnecting...")
+        self._spawn(self._reconnect())
+
+    async def _reconnect(self):
+        delay = 1
+        while not self._stopped:
+            try:
+                await self.start()
+                break
+            except (OSError, asyncpg.PostgresError) as e:
+                logger.error(f"Change listener reconnect failed: {e}")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 30)
+        # Notifications may have been missed while disconnected
+        self.cache.clear()
+
+
+listener = ChangeListener(cache)
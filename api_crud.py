@@ -1,8 +1,16 @@
+from datetime import date
 from typing import List, Optional
-from sqlalchemy import select, func, extract
+from sqlalchemy import select, func, extract, tuple_, literal, Integer, Float
+from sqlalchemy.dialects.postgresql import ARRAY
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.orm import selectinload
-from models import Artist, Concert, Country, City, Venue, SetlistItem
+from models import (
+    Artist, Concert, Country, City, Venue, SetlistItem,
+    ConcertSignature, SetlistBucket, SongTransition, ArtistSummary, SongSketch, ConcertChange
+)
+import similarity
+import sketches
+
+HEATMAP_FROM_YEAR = 2010
 
 
 # --- Statistics (using SQLAlchemy ORM) ---
@@ -32,6 +40,32 @@ async def get_stats_top_songs(db: AsyncSession) -> List[dict]:
     return [{"name": row.name, "count": row.count} for row in result]
 
 
+async def get_sketch_top_songs(
+    db: AsyncSession, artist_mbid: Optional[str] = None, year_from: Optional[int] = None,
+    year_to: Optional[int] = None, limit: int = 20
+) -> Optional[dict]:
+    """Approximate top songs of one slice, merged from the stored Space-Saving sketches"""
+    if artist_mbid is not None:
+        condition = SongSketch.scope == sketches.artist_scope(artist_mbid)
+    elif year_from is not None or year_to is not None:
+        # A missing bound leaves the range open on that side. Years have four
+        # digits, so "year:YYYY" scopes compare in year order.
+        condition = SongSketch.scope.startswith(sketches.YEAR_SCOPE_PREFIX)
+        if year_from is not None:
+            condition &= SongSketch.scope >= sketches.year_scope(year_from)
+        if year_to is not None:
+            condition &= SongSketch.scope <= sketches.year_scope(year_to)
+    else:
+        condition = SongSketch.scope == sketches.GLOBAL_SCOPE
+
+    rows = await db.scalars(select(SongSketch).where(condition))
+    merged = sketches.merge_all(sketches.SpaceSaving.from_row(row) for row in rows)
+    if merged is None:
+        return None
+
+    return {"total": merged.total, "error_bound": merged.error_bound, "songs": merged.top(limit)}
+
+
 async def get_stats_concerts_by_year(db: AsyncSession) -> List[dict]:
     """Concerts by year"""
     query = (
@@ -83,7 +117,7 @@ async def get_stats_heatmap(db: AsyncSession) -> List[dict]:
             extract('MONTH', Concert.concert_date).label("month"),
             func.count().label("count")
         )
-        .where(extract('YEAR', Concert.concert_date) >= 2010)
+        .where(Concert.concert_date >= date(HEATMAP_FROM_YEAR, 1, 1))
         .group_by("year", "month")
         .order_by("year", "month")
     )
@@ -93,83 +127,333 @@ async def get_stats_heatmap(db: AsyncSession) -> List[dict]:
 
 # --- Details ---
 
-async def get_artist_details(db: AsyncSession, artist_mbid: str) -> Optional[dict]:
+# Sparse fieldsets: each field maps to the column it needs, so unrequested
+# joins (venue -> city -> country) and the setlist query are skipped entirely
+ARTIST_CONCERT_FIELDS = {
+    "concert_id": Concert.concert_id,
+    "concert_date": Concert.concert_date,
+    "tour_name": Concert.tour_name,
+    "venue_name": Venue.venue_name,
+    "city_name": City.city_name,
+    "country_name": Country.country_name,
+}
+
+CONCERT_FIELDS = ("concert_id", "concert_date", "tour_name", "artist", "venue", "setlist")
+
+
+def parse_fields(fields: Optional[str], allowed) -> tuple:
+    """Validate a comma separated `fields` parameter; None means all fields"""
+    if not fields:
+        return tuple(allowed)
+
+    requested = [name.strip() for name in fields.split(",") if name.strip()]
+    unknown = [name for name in requested if name not in allowed]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+
+    # The id is always returned
+    return ("concert_id",) + tuple(name for name in allowed if name in requested and name != "concert_id")
+
+
+def _join_location(query, fields: tuple):
+    """Join only as far along venue -> city -> country as the fields require"""
+    if {"venue_name", "city_name", "country_name"} & set(fields) or "venue" in fields:
+        query = query.join(Venue, Venue.venue_id == Concert.venue_id)
+    if {"city_name", "country_name"} & set(fields) or "venue" in fields:
+        query = query.join(City, City.city_id == Venue.city_id)
+    if "country_name" in fields or "venue" in fields:
+        query = query.join(Country, Country.country_code == City.country_code)
+    return query
+
+
+async def get_artists_details(db: AsyncSession, artist_mbids: List[str],
+                              fields: tuple = tuple(ARTIST_CONCERT_FIELDS)) -> List[dict]:
+    """Artists with their concerts (newest first), projected to `fields`"""
+    result = await db.execute(
+        select(Artist.artist_mbid, Artist.artist_name).where(Artist.artist_mbid.in_(artist_mbids))
+    )
+    artists = {
+        row.artist_mbid: {
+            "artist": {"artist_mbid": row.artist_mbid, "artist_name": row.artist_name},
+            "concerts": []
+        }
+        for row in result
+    }
+    if not artists:
+        return []
+
+    query = select(Concert.artist_mbid, *(ARTIST_CONCERT_FIELDS[name] for name in fields))
+    query = (
+        _join_location(query, fields)
+        .where(Concert.artist_mbid.in_(list(artists)))
+        .order_by(Concert.concert_date.desc())
+    )
+    for row in await db.execute(query):
+        artists[row[0]]["concerts"].append(dict(zip(fields, row[1:])))
+
+    return [artists[mbid] for mbid in artist_mbids if mbid in artists]
+
+
+async def get_artist_details(db: AsyncSession, artist_mbid: str,
+                             fields: tuple = tuple(ARTIST_CONCERT_FIELDS)) -> Optional[dict]:
     """Full artist information with concerts"""
+    artists = await get_artists_details(db, [artist_mbid], fields)
+    return artists[0] if artists else None
+
+
+async def get_concerts_details(db: AsyncSession, concert_ids: List[str],
+                               fields: tuple = CONCERT_FIELDS) -> List[dict]:
+    """Concerts projected to `fields`; the setlist is only queried when requested"""
+    columns = [Concert.concert_id]
+    if "concert_date" in fields:
+        columns.append(Concert.concert_date)
+    if "tour_name" in fields:
+        columns.append(Concert.tour_name)
+    if "artist" in fields:
+        columns += [Artist.artist_mbid, Artist.artist_name]
+    if "venue" in fields:
+        columns += [Venue.venue_name, City.city_name, Country.country_name]
+
+    query = select(*columns)
+    if "artist" in fields:
+        query = query.join(Artist, Artist.artist_mbid == Concert.artist_mbid)
+    query = _join_location(query, fields).where(Concert.concert_id.in_(concert_ids))
+
+    concerts = {}
+    for row in (await db.execute(query)).mappings():
+        concert = {"concert_id": row["concert_id"]}
+        if "concert_date" in fields:
+            concert["concert_date"] = row["concert_date"]
+        if "tour_name" in fields:
+            concert["tour_name"] = row["tour_name"]
+        if "artist" in fields:
+            concert["artist"] = {"artist_mbid": row["artist_mbid"], "artist_name": row["artist_name"]}
+        if "venue" in fields:
+            concert["venue"] = {
+                "venue_name": row["venue_name"],
+                "city_name": row["city_name"],
+                "country_name": row["country_name"]
+            }
+        if "setlist" in fields:
+            concert["setlist"] = []
+        concerts[row["concert_id"]] = concert
+
+    if "setlist" in fields and concerts:
+        items = await db.execute(
+            select(SetlistItem.concert_id, SetlistItem.song_name, SetlistItem.position_in_set, SetlistItem.is_cover)
+            .where(SetlistItem.concert_id.in_(list(concerts)))
+            .order_by(SetlistItem.concert_id, SetlistItem.position_in_set)
+        )
+        for item in items:
+            concerts[item.concert_id]["setlist"].append({
+                "song_name": item.song_name,
+                "position_in_set": item.position_in_set,
+                "is_cover": item.is_cover
+            })
+
+    return [concerts[concert_id] for concert_id in concert_ids if concert_id in concerts]
+
+
+async def get_concert_details(db: AsyncSession, concert_id: str,
+                              fields: tuple = CONCERT_FIELDS) -> Optional[dict]:
+    """Concert details with setlist"""
+    concerts = await get_concerts_details(db, [concert_id], fields)
+    return concerts[0] if concerts else None
+
+
+async def get_similar_concerts(db: AsyncSession, concert_id: str, limit: int = 10) -> Optional[List[dict]]:
+    """Concerts with the most similar setlists (MinHash/LSH index)"""
+    signature_row = await db.get(ConcertSignature, concert_id)
+    if signature_row is None:
+        # Concerts without a setlist have no signature and no neighbours
+        exists = await db.scalar(select(Concert.concert_id).where(Concert.concert_id == concert_id))
+        return [] if exists else None
+
+    signature = similarity.unpack_signature(signature_row.signature)
+
+    # Concerts sharing the most bands are the likeliest matches: score those first
+    candidates = (
+        select(SetlistBucket.concert_id)
+        .where(
+            tuple_(SetlistBucket.band, SetlistBucket.bucket_hash).in_(similarity.band_hashes(signature)),
+            SetlistBucket.concert_id != concert_id
+        )
+        .group_by(SetlistBucket.concert_id)
+        .order_by(func.count().desc(), SetlistBucket.concert_id)
+        .limit(similarity.MAX_CANDIDATES)
+    )
     query = (
-        select(Artist)
-        .options(
-            selectinload(Artist.concerts)
-            .selectinload(Concert.venue)
-            .selectinload(Venue.city)
-            .selectinload(City.country)
+        select(
+            Concert.concert_id,
+            Concert.concert_date,
+            Artist.artist_name,
+            ConcertSignature.signature
         )
-        .where(Artist.artist_mbid == artist_mbid)
+        .join(Artist, Artist.artist_mbid == Concert.artist_mbid)
+        .join(ConcertSignature, ConcertSignature.concert_id == Concert.concert_id)
+        .where(Concert.concert_id.in_(candidates))
     )
-
     result = await db.execute(query)
-    artist = result.scalar_one_or_none()
 
-    if not artist:
-        return None
-
-    concerts = [
+    similar = [
         {
-            "concert_id": concert.concert_id,
-            "concert_date": concert.concert_date,
-            "tour_name": concert.tour_name,
-            "venue_name": concert.venue.venue_name,
-            "city_name": concert.venue.city.city_name,
-            "country_name": concert.venue.city.country.country_name
+            "concert_id": row.concert_id,
+            "concert_date": row.concert_date,
+            "artist_name": row.artist_name,
+            "similarity": similarity.estimate_similarity(
+                signature, similarity.unpack_signature(row.signature)
+            )
         }
-        for concert in sorted(artist.concerts, key=lambda c: c.concert_date, reverse=True)
+        for row in result
     ]
+    similar.sort(key=lambda c: c["similarity"], reverse=True)
+    return similar[:limit]
 
-    return {
-        "artist": {
-            "artist_mbid": artist.artist_mbid,
-            "artist_name": artist.artist_name
-        },
-        "concerts": concerts
-    }
 
+async def get_artist_transitions(
+    db: AsyncSession, artist_mbid: str, song_name: Optional[str] = None, k: int = 5
+) -> Optional[List[dict]]:
+    """Top-k most likely next songs per song, from the precomputed transition graph"""
+    artist = await db.scalar(select(Artist.artist_mbid).where(Artist.artist_mbid == artist_mbid))
+    if not artist:
+        return None
 
-async def get_concert_details(db: AsyncSession, concert_id: str) -> Optional[dict]:
-    """Concert details with setlist"""
-    query = (
-        select(Concert)
-        .options(
-            selectinload(Concert.artist),
-            selectinload(Concert.venue).selectinload(Venue.city).selectinload(City.country),
-            selectinload(Concert.setlist_items)
+    ranked = (
+        select(
+            SongTransition.from_song,
+            SongTransition.to_song,
+            SongTransition.count,
+            func.sum(SongTransition.count).over(partition_by=SongTransition.from_song).label("total"),
+            func.row_number().over(
+                partition_by=SongTransition.from_song,
+                order_by=(SongTransition.count.desc(), SongTransition.to_song)
+            ).label("rank")
         )
-        .where(Concert.concert_id == concert_id)
+        .where(SongTransition.artist_mbid == artist_mbid)
     )
+    if song_name is not None:
+        ranked = ranked.where(SongTransition.from_song == song_name)
+    ranked = ranked.subquery()
 
+    query = (
+        select(ranked)
+        .where(ranked.c.rank <= k)
+        .order_by(ranked.c.total.desc(), ranked.c.from_song, ranked.c.rank)
+    )
     result = await db.execute(query)
-    concert = result.scalar_one_or_none()
 
-    if not concert:
+    songs = {}
+    for row in result:
+        entry = songs.setdefault(row.from_song, {
+            "song_name": row.from_song,
+            "total": int(row.total),
+            "successors": []
+        })
+        entry["successors"].append({
+            "song_name": row.to_song,
+            "count": row.count,
+            "probability": row.count / entry["total"]
+        })
+
+    return list(songs.values())
+
+
+async def get_artist_summary(db: AsyncSession, artist_mbid: str) -> Optional[dict]:
+    """Precomputed artist summary (single-row lookup)"""
+    query = (
+        select(Artist.artist_name, ArtistSummary)
+        .join(ArtistSummary, ArtistSummary.artist_mbid == Artist.artist_mbid)
+        .where(Artist.artist_mbid == artist_mbid)
+    )
+    row = (await db.execute(query)).one_or_none()
+    if not row:
         return None
 
+    summary = row.ArtistSummary
     return {
-        "concert_id": concert.concert_id,
-        "concert_date": concert.concert_date,
-        "tour_name": concert.tour_name,
         "artist": {
-            "artist_mbid": concert.artist.artist_mbid,
-            "artist_name": concert.artist.artist_name
-        },
-        "venue": {
-            "venue_name": concert.venue.venue_name,
-            "city_name": concert.venue.city.city_name,
-            "country_name": concert.venue.city.country.country_name
+            "artist_mbid": artist_mbid,
+            "artist_name": row.artist_name
         },
-        "setlist": [
-            {
-                "song_name": item.song_name,
-                "position_in_set": item.position_in_set,
-                "is_cover": item.is_cover
-            }
-            for item in sorted(concert.setlist_items, key=lambda x: x.position_in_set)
-        ]
+        "concert_count": summary.concert_count,
+        "songs_played": summary.songs_played,
+        "distinct_songs": summary.distinct_songs,
+        "cover_ratio": summary.cover_ratio,
+        "countries": summary.countries,
+        "top_songs": summary.top_songs,
+        "first_show": summary.first_show,
+        "last_show": summary.last_show
+    }
+
+
+async def get_changes(db: AsyncSession, since: int = 0, limit: int = 500) -> dict:
+    """Change feed page after `since` (keyset pagination on change_seq)"""
+    result = await db.execute(
+        select(
+            ConcertChange.change_seq,
+            ConcertChange.concert_id,
+            ConcertChange.artist_mbid,
+            ConcertChange.operation,
+            ConcertChange.changed_at
+        )
+        .where(ConcertChange.change_seq > since)
+        .order_by(ConcertChange.change_seq)
+        .limit(limit + 1)
+    )
+    rows = result.mappings().all()
+    page = [dict(row) for row in rows[:limit]]
+
+    return {
+        "changes": page,
+        "next_token": page[-1]["change_seq"] if page else since,
+        "has_more": len(rows) > limit
     }
+
+
+async def get_nearby_concerts(
+    db: AsyncSession, venue_distances: dict, date_from: Optional[date] = None,
+    date_to: Optional[date] = None, limit: int = 100
+) -> List[dict]:
+    """Concerts at the given venues (found by the spatial index), nearest first"""
+    if not venue_distances:
+        return []
+
+    # Two array parameters however many venues are in range; sorting and
+    # limiting happen in the database
+    nearby = select(
+        func.unnest(literal(list(venue_distances), ARRAY(Integer))).label("venue_id"),
+        func.unnest(literal(list(venue_distances.values()), ARRAY(Float))).label("distance_km")
+    ).subquery()
+
+    query = (
+        select(
+            Concert.concert_id,
+            Concert.concert_date,
+            Artist.artist_name,
+            Venue.venue_name,
+            City.city_name,
+            nearby.c.distance_km
+        )
+        .join(nearby, nearby.c.venue_id == Concert.venue_id)
+        .join(Artist, Artist.artist_mbid == Concert.artist_mbid)
+        .join(Venue, Venue.venue_id == Concert.venue_id)
+        .join(City, City.city_id == Venue.city_id)
+    )
+    if date_from is not None:
+        query = query.where(Concert.concert_date >= date_from)
+    if date_to is not None:
+        query = query.where(Concert.concert_date <= date_to)
+    query = query.order_by(nearby.c.distance_km, Concert.concert_date).limit(limit)
+
+    result = await db.execute(query)
+    return [
+        {
+            "concert_id": row.concert_id,
+            "concert_date": row.concert_date,
+            "artist_name": row.artist_name,
+            "venue_name": row.venue_name,
+            "city_name": row.city_name,
+            "distance_km": round(row.distance_km, 2)
+        }
+        for row in result
+    ]
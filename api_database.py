@@ -1,19 +1,288 @@
+import asyncio
+import logging
+import time
 import asyncpg
+from collections import deque
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import Callable, List, Optional, Tuple
+from sqlalchemy import text
 from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from config import settings
 
+logger = logging.getLogger(__name__)
+
 # Initialize pool globally
 pool = None
 
+# Per-request statement timeout (ms), set by the admission middleware
+statement_timeout_ms: ContextVar[Optional[int]] = ContextVar("statement_timeout_ms", default=None)
+
+# The primary serves DB_POOL_MAX_SIZE connections in total: the asyncpg pool
+# (exports) gets EXPORT_POOL_SHARE of them and the engine the rest. Of the
+# engine's, BACKGROUND_SHARE are kept for work that runs outside admission
+# control (see primary_session); reads falling back to the primary get the others.
+EXPORT_POOL_SHARE = 0.1
+BACKGROUND_SHARE = 0.25
+
+
+def split_primary_pool(total: int) -> Tuple[int, int, int]:
+    """(asyncpg pool size, engine pool size, engine connections for background work)"""
+    if total < 3:
+        raise ValueError(f"DB_POOL_MAX_SIZE must be at least 3, got {total}")
+    export_pool = max(1, round(total * EXPORT_POOL_SHARE))
+    engine_pool = total - export_pool
+    background = min(engine_pool - 1, max(1, round(engine_pool * BACKGROUND_SHARE)))
+    return export_pool, engine_pool, background
+
+
+EXPORT_POOL_SIZE, ENGINE_POOL_SIZE, BACKGROUND_CONNECTIONS = split_primary_pool(settings.db_pool_max_size)
+
 engine = create_async_engine(
-    f"postgresql+asyncpg://{settings.db_user}:{settings.db_password}@{settings.db_host}:{settings.db_port}/{settings.db_name}"
+    f"postgresql+asyncpg://{settings.db_user}:{settings.db_password}@{settings.db_host}:{settings.db_port}/{settings.db_name}",
+    pool_size=ENGINE_POOL_SIZE,
+    max_overflow=0
 )
 
 async_session = async_sessionmaker(engine, expire_on_commit=False)
 
+
+class ConnectionBudget:
+    """Bounds how many engine connections work outside admission control holds.
+
+    Unlike admission it never sheds: the callers are cache computes and
+    notification-driven recomputes, which have to run eventually.
+    """
+
+    def __init__(self, size: int):
+        self.size = size
+        self.active = 0
+        self.waiting = 0
+        self._semaphore = asyncio.Semaphore(size)
+
+    @asynccontextmanager
+    async def slot(self):
+        self.waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        self.active += 1
+        try:
+            yield
+        finally:
+            self.active -= 1
+            self._semaphore.release()
+
+    def snapshot(self) -> dict:
+        return {"limit": self.size, "active": self.active, "waiting": self.waiting}
+
+
+background = ConnectionBudget(BACKGROUND_CONNECTIONS)
+
+async def apply_statement_timeout(session: AsyncSession):
+    """Limit statements of the current transaction to the request's timeout"""
+    timeout = statement_timeout_ms.get()
+    if timeout:
+        await session.execute(text(f"SET LOCAL statement_timeout = {int(timeout)}"))
+
+@asynccontextmanager
+async def primary_session():
+    """Session on the primary, for reads that must see the latest commit.
+
+    Recomputes triggered by loader notifications use it: a replica within the
+    allowed lag may not have replayed the batch yet, and the results are kept
+    until the next change. The connection is taken from the `background` budget.
+    """
+    async with background.slot():
+        async with async_session() as session:
+            await apply_statement_timeout(session)
+            yield session
+
 async def get_db() -> AsyncSession:
     """SQLAlchemy session dependency"""
     async with async_session() as session:
+        await apply_statement_timeout(session)
+        yield session
+
+
+# --- Read replicas ---
+
+# Replication state of a replica: whether it is one, whether its WAL receiver
+# is streaming (replay stays "caught up" with what was received while a
+# replica with a dead receiver silently falls behind) and the replayed LSN.
+# (status is only visible with pg_read_all_stats; the row exists either way)
+REPLICA_STATE_QUERY = """
+    SELECT pg_is_in_recovery(),
+           EXISTS (SELECT 1 FROM pg_stat_wal_receiver WHERE COALESCE(status, 'streaming') = 'streaming'),
+           pg_last_wal_replay_lsn()::text
+"""
+
+
+def parse_lsn(lsn: str) -> int:
+    """Byte position of a pg_lsn text value such as '16/B374D848'"""
+    high, low = lsn.split("/")
+    return (int(high, 16) << 32) + int(low, 16)
+
+
+class Replica:
+    """Read-only replica with its own independently sized engine pool"""
+
+    def __init__(self, dsn: str, pool_size: int):
+        if dsn.startswith("postgresql://"):
+            dsn = "postgresql+asyncpg://" + dsn[len("postgresql://"):]
+        self.engine = create_async_engine(dsn, pool_size=pool_size, max_overflow=0)
+        self.sessionmaker = async_sessionmaker(self.engine, expire_on_commit=False)
+        self.name = self.engine.url.render_as_string(hide_password=True)
+        self.pool_size = pool_size
+        self.healthy = False
+        self.lag: Optional[float] = None
+        self.in_flight = 0
+
+    async def check(self, max_lag: float, lag_behind: Callable[[int], Optional[float]]):
+        """`lag_behind(lsn)`: seconds since the primary wrote past `lsn` (see PrimaryPosition)"""
+        try:
+            async with self.engine.connect() as connection:
+                in_recovery, receiving, replay_lsn = (await connection.execute(text(REPLICA_STATE_QUERY))).one()
+            if not in_recovery:
+                self.lag = 0.0
+            elif not receiving or replay_lsn is None:
+                logger.warning(f"Replica {self.name} is not receiving WAL")
+                self.lag = None
+            else:
+                self.lag = lag_behind(parse_lsn(replay_lsn))
+            healthy = self.lag is not None and self.lag <= max_lag
+        except Exception as e:
+            logger.warning(f"Replica {self.name} health check failed: {e}")
+            self.lag = None
+            healthy = False
+
+        if healthy != self.healthy:
+            logger.info(f"Replica {self.name} is now {'healthy' if healthy else 'unavailable'} (lag={self.lag})")
+        self.healthy = healthy
+
+    @property
+    def load(self) -> float:
+        return self.in_flight / self.pool_size
+
+
+class PrimaryPosition:
+    """Recent WAL positions of the primary with the (local) time each was first seen.
+
+    A replica's lag is the time since the primary first got past the
+    replica's replay position. Unlike the age of the last replayed
+    transaction this stays zero while the primary is idle, and it only uses
+    this process's clock.
+    """
+
+    def __init__(self, horizon: float):
+        self.horizon = horizon
+        self._samples = deque()  # (lsn, monotonic time), increasing
+
+    def record(self, lsn: int, now: Optional[float] = None):
+        now = time.monotonic() if now is None else now
+        if not self._samples or lsn > self._samples[-1][0]:
+            self._samples.append((lsn, now))
+        # Keep one sample older than the horizon, so long lags still measure as long
+        while len(self._samples) > 1 and self._samples[1][1] < now - self.horizon:
+            self._samples.popleft()
+
+    def lag_behind(self, replay_lsn: int, now: Optional[float] = None) -> Optional[float]:
+        """None while unknown: behind the oldest sample before the horizon is covered (startup)"""
+        now = time.monotonic() if now is None else now
+        for index, (lsn, seen_at) in enumerate(self._samples):
+            if lsn > replay_lsn:
+                if index == 0 and now - seen_at < self.horizon:
+                    return None
+                return now - seen_at
+        return 0.0
+
+
+class ReplicaRouter:
+    """Routes reads to the least-loaded healthy replica, falling back to the primary"""
+
+    def __init__(self, dsns: List[str]):
+        self.replicas = [Replica(dsn, settings.db_replica_pool_size) for dsn in dsns]
+        self.primary = PrimaryPosition(
+            horizon=2 * settings.db_replica_max_lag_seconds + settings.db_replica_check_interval
+        )
+        self._monitor: Optional[asyncio.Task] = None
+
+    def pick(self) -> Optional[Replica]:
+        healthy = [replica for replica in self.replicas if replica.healthy]
+        if not healthy:
+            return None
+        return min(healthy, key=lambda replica: replica.load)
+
+    async def check_all(self):
+        try:
+            async with background.slot(), engine.connect() as connection:
+                self.primary.record(parse_lsn(await connection.scalar(text("SELECT pg_current_wal_lsn()::text"))))
+        except Exception as e:
+            # Without the primary's position lag cannot be judged; keep the previous state
+            logger.warning(f"Primary WAL position unavailable: {e}")
+            return
+        await asyncio.gather(
+            *(replica.check(settings.db_replica_max_lag_seconds, self.primary.lag_behind)
+              for replica in self.replicas)
+        )
+
+    async def _monitor_loop(self):
+        while True:
+            await asyncio.sleep(settings.db_replica_check_interval)
+            await self.check_all()
+
+    async def start(self):
+        if not self.replicas:
+            return
+        await self.check_all()
+        self._monitor = asyncio.create_task(self._monitor_loop())
+
+    async def stop(self):
+        if self._monitor:
+            self._monitor.cancel()
+            self._monitor = None
+        for replica in self.replicas:
+            await replica.engine.dispose()
+
+    def status(self) -> List[dict]:
+        return [
+            {"replica": r.name, "healthy": r.healthy, "lag": r.lag, "in_flight": r.in_flight}
+            for r in self.replicas
+        ]
+
+
+replicas = ReplicaRouter(settings.db_replica_dsns)
+
+
+def read_pool_size() -> int:
+    """Connections reads are routed to right now: the healthy replicas' pools, otherwise the primary's"""
+    healthy = sum(replica.pool_size for replica in replicas.replicas if replica.healthy)
+    return healthy or ENGINE_POOL_SIZE - BACKGROUND_CONNECTIONS
+
+
+@asynccontextmanager
+async def read_session():
+    """Session for read-only queries: a healthy replica if any, otherwise the primary"""
+    replica = replicas.pick()
+    if replica is None:
+        async with async_session() as session:
+            await apply_statement_timeout(session)
+            yield session
+        return
+
+    replica.in_flight += 1
+    try:
+        async with replica.sessionmaker() as session:
+            await apply_statement_timeout(session)
+            yield session
+    finally:
+        replica.in_flight -= 1
+
+
+async def get_read_db() -> AsyncSession:
+    """SQLAlchemy session dependency for read-only routes"""
+    async with read_session() as session:
         yield session
 
 async def get_db_pool():
@@ -27,8 +296,8 @@ async def get_db_pool():
                 host=settings.db_host,
                 port=settings.db_port,
                 database=settings.db_name,
-                min_size=5,
-                max_size=20
+                min_size=min(settings.db_pool_min_size, EXPORT_POOL_SIZE),
+                max_size=EXPORT_POOL_SIZE
             )
             print("Connection pool created successfully.")
         except Exception as e:
@@ -56,3 +325,23 @@ async def fetch_one(query: str, *args):
     db_pool = await get_db_pool()
     async with db_pool.acquire() as connection:
         return await connection.fetchrow(query, *args)
+
+
+async def stream_rows(query: str, *args, chunk_size: int = 5000):
+    """Yield lists of rows read through a server-side cursor.
+
+    The connection stays checked out until the generator is exhausted or
+    closed; the next chunk is only fetched when the consumer asks for it.
+    """
+    db_pool = await get_db_pool()
+    async with db_pool.acquire() as connection:
+        async with connection.transaction(readonly=True):
+            timeout = statement_timeout_ms.get()
+            if timeout:
+                await connection.execute(f"SET LOCAL statement_timeout = {int(timeout)}")
+            cursor = await connection.cursor(query, *args)
+            while True:
+                rows = await cursor.fetch(chunk_size)
+                if not rows:
+                    break
+                yield rows
@@ -0,0 +1,103 @@
+import asyncio
+import json
+import logging
+from typing import AsyncIterator, Optional, Set
+
+import api_crud as crud
+from api_cache import cache
+
+logger = logging.getLogger(__name__)
+
+HEARTBEAT = b": ping\n\n"
+RESYNC = b"event: resync\ndata: {}\n\n"
+
+
+class StatsBroadcaster:
+    """Per-process fan-out of stats deltas to server-sent event subscribers.
+
+    Each loader notification is turned into at most two messages, encoded
+    once and put on every subscriber's queue: no query runs per subscriber,
+    and an idle subscriber is just a queue and a suspended generator.
+    """
+
+    def __init__(self, heartbeat_interval: float = 15.0, queue_size: int = 16):
+        self.heartbeat_interval = heartbeat_interval
+        self.queue_size = queue_size
+        self._subscribers: Set[asyncio.Queue] = set()
+        self._top_artists: Optional[list] = None
+        self._event_id = 0
+        self._heartbeat: Optional[asyncio.Task] = None
+
+    async def start(self):
+        self._heartbeat = asyncio.create_task(self._send_heartbeats())
+
+    async def stop(self):
+        if self._heartbeat is not None:
+            self._heartbeat.cancel()
+            self._heartbeat = None
+        for queue in self._subscribers:
+            self._put(queue, None)
+
+    @property
+    def subscribers(self) -> int:
+        return len(self._subscribers)
+
+    def _put(self, queue: asyncio.Queue, message: Optional[bytes]):
+        try:
+            queue.put_nowait(message)
+        except asyncio.QueueFull:
+            # Slow client: drop what it has not read and ask it to refetch
+            while not queue.empty():
+                queue.get_nowait()
+            queue.put_nowait(RESYNC if message is not None else None)
+
+    def publish(self, event: str, data) -> None:
+        if not self._subscribers:
+            return
+        self._event_id += 1
+        message = f"id: {self._event_id}\nevent: {event}\ndata: {json.dumps(data, default=str)}\n\n".encode("utf-8")
+        for queue in self._subscribers:
+            self._put(queue, message)
+
+    async def _send_heartbeats(self):
+        # Keeps proxies from closing idle streams
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            for queue in self._subscribers:
+                self._put(queue, HEARTBEAT)
+
+    async def on_change(self, change: dict):
+        """Listener callback: runs after the query cache has been refreshed"""
+        months = change.get("months", [])
+        if change.get("resync"):
+            # Edits moved concerts between months, which deltas of new concerts can't express
+            for queue in self._subscribers:
+                self._put(queue, RESYNC)
+        elif months:
+            self.publish("concerts", {
+                "added": [{"year": year, "month": month, "count": count} for year, month, count in months]
+            })
+
+        if not self._subscribers:
+            self._top_artists = None
+            return
+        top_artists = await cache.get("top-artists", crud.get_stats_top_artists)
+        if top_artists != self._top_artists:
+            self._top_artists = top_artists
+            self.publish("top-artists", top_artists)
+
+    async def stream(self) -> AsyncIterator[bytes]:
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+        self._subscribers.add(queue)
+        try:
+            yield b"retry: 5000\n\n"
+            while True:
+                message = await queue.get()
+                if message is None:
+                    break
+                yield message
+        finally:
+            self._subscribers.discard(queue)
+
+
+broadcaster = StatsBroadcaster()
@@ -0,0 +1,115 @@
+import csv
+import io
+import json
+import zlib
+from typing import AsyncIterator, Iterable, List, Optional
+
+import anyio
+from starlette.responses import StreamingResponse
+
+from api_database import stream_rows
+
+EXPORT_CHUNK_SIZE = 5000
+
+# Exports are in primary key order. Each partition's key index is already in
+# that order, so the planner merges the partitions (Merge Append) instead of
+# sorting the whole table, and looks up the dimension rows per concert.
+CONCERTS_QUERY = """
+    SELECT c.concert_id, c.concert_date, c.tour_name,
+           a.artist_mbid, a.artist_name,
+           v.venue_name, ci.city_name, ci.country_code
+    FROM concerts c
+    JOIN artists a ON a.artist_mbid = c.artist_mbid
+    JOIN venues v ON v.venue_id = c.venue_id
+    JOIN cities ci ON ci.city_id = v.city_id
+    ORDER BY c.concert_id, c.concert_date
+"""
+
+SETLISTS_QUERY = """
+    SELECT s.concert_id, s.position_in_set, s.song_name, s.is_cover
+    FROM setlistitems s
+    ORDER BY s.concert_id, s.concert_date, s.position_in_set
+"""
+
+EXPORTS = {
+    "concerts": (
+        CONCERTS_QUERY,
+        ["concert_id", "concert_date", "tour_name", "artist_mbid", "artist_name",
+         "venue_name", "city_name", "country_code"]
+    ),
+    "setlists": (
+        SETLISTS_QUERY,
+        ["concert_id", "position_in_set", "song_name", "is_cover"]
+    ),
+}
+
+MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+
+
+def _encode_ndjson(rows: Iterable, columns: List[str]) -> str:
+    return "".join(
+        json.dumps(dict(zip(columns, row)), default=str, ensure_ascii=False) + "\n"
+        for row in rows
+    )
+
+
+def _encode_csv(rows: Iterable, header: Optional[List[str]] = None) -> str:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if header:
+        writer.writerow(header)
+    writer.writerows(rows)
+    return buffer.getvalue()
+
+
+async def export_stream(name: str, fmt: str = "ndjson", compress: bool = False) -> AsyncIterator[bytes]:
+    """Encode an export chunk by chunk; memory use is bounded by EXPORT_CHUNK_SIZE"""
+    query, columns = EXPORTS[name]
+    compressor = zlib.compressobj(wbits=31) if compress else None  # gzip container
+
+    def emit(text: str) -> bytes:
+        data = text.encode("utf-8")
+        return compressor.compress(data) if compressor else data
+
+    if fmt == "csv":
+        yield emit(_encode_csv([], columns))
+
+    chunks = stream_rows(query, chunk_size=EXPORT_CHUNK_SIZE)
+    try:
+        async for rows in chunks:
+            values = [tuple(row.values()) for row in rows]
+            if fmt == "csv":
+                chunk = emit(_encode_csv(values))
+            else:
+                chunk = emit(_encode_ndjson(values, columns))
+            if chunk:
+                yield chunk
+    finally:
+        # Hands the cursor's connection back now rather than when the
+        # abandoned generator is garbage collected
+        await chunks.aclose()
+
+    if compressor:
+        yield compressor.flush()
+
+
+class ExportResponse(StreamingResponse):
+    """StreamingResponse that closes its body iterator when the client goes away.
+
+    Starlette cancels the send on disconnect and leaves the iterator suspended,
+    which would keep the export's pool connection checked out until GC.
+    """
+
+    async def stream_response(self, send) -> None:
+        try:
+            await super().stream_response(send)
+        finally:
+            with anyio.CancelScope(shield=True):
+                await self.body_iterator.aclose()
+
+
+def export_filename(name: str, fmt: str, compress: bool) -> str:
+    return f"{name}.{fmt}" + (".gz" if compress else "")
@@ -1,26 +1,55 @@
 import uvicorn
-from fastapi import FastAPI, HTTPException, Depends
+from fastapi import FastAPI, HTTPException, Depends, Query
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse, Response
 from contextlib import asynccontextmanager
-from typing import List
+from typing import List, Optional, Literal
+from datetime import date
 import logging
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from api_database import get_db_pool, close_db_pool, get_db
+from config import settings, setup_logging
+from api_database import get_db_pool, close_db_pool, get_read_db, primary_session, replicas
 from api_schemas import (
     StatTopItem, StatYearItem, ArtistDetail, ConcertDetail,
-    StatGeoItem, StatHeatmapItem
+    StatGeoItem, StatHeatmapItem, SimilarConcert, SongTransitions, ArtistSummaryInfo,
+    NearbyConcert, SketchTopSongs, ChangeFeed
 )
 import api_crud as crud
+import api_export
+from api_cache import cache, listener
+from api_admission import AdmissionControlMiddleware, admission_stats
+from api_profiling import ProfilingMiddleware
+from api_events import broadcaster
+import snapshot
+import geo
 
 logger = logging.getLogger(__name__)
 
+async def rebuild_spatial_index(change: Optional[dict] = None):
+    async with primary_session() as db:
+        await geo.build_index(db)
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    # Here rather than at import: each uvicorn worker imports this module on boot
+    setup_logging()
     logger.info("Starting server. Initializing DB pool...")
     await get_db_pool()
+    await replicas.start()
+    await rebuild_spatial_index()
+    listener.subscribe(rebuild_spatial_index)
+    listener.subscribe(broadcaster.on_change)
+    listener.subscribe(snapshot.builder.on_change)
+    await broadcaster.start()
+    await listener.start()
+    # Builds the snapshot if this host has none or it predates the latest change
+    snapshot.builder.request(listener.latest_seq)
     yield
     logger.info("Shutting down server. Closing resources...")
+    await listener.stop()
+    await broadcaster.stop()
+    await replicas.stop()
     await close_db_pool()
 
 app = FastAPI(
@@ -29,6 +58,12 @@ app = FastAPI(
     lifespan=lifespan
 )
 
+# Innermost: only admitted requests are profiled
+app.add_middleware(ProfilingMiddleware)
+
+# Added before CORS so that shed responses still carry CORS headers
+app.add_middleware(AdmissionControlMiddleware)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -43,43 +78,206 @@ app.add_middleware(
 async def get_root():
     return {"message": "Rock API is working!"}
 
+@app.get("/admission/stats")
+async def get_admission_stats():
+    """Accepted/shed counters per endpoint (not subject to admission control)"""
+    return admission_stats()
+
+@app.get("/replicas/status")
+async def get_replicas_status():
+    return replicas.status()
+
+async def serve_stats(key: str, loader, **cache_options):
+    """Serve pre-encoded JSON from the shared snapshot, or fall back to the query cache.
+
+    After a change one worker of the host rebuilds the snapshot (see
+    snapshot.SnapshotBuilder) and the previous one is served meanwhile. Only
+    when it lags the change feed for longer than the allowed staleness (the
+    rebuild fails) does this worker query the database through its cache.
+    """
+    payload = snapshot.reader.get(key)
+    fresh = listener.stale_for(snapshot.reader.version) <= settings.stats_snapshot_max_staleness
+    if payload is not None and fresh:
+        cache.discard(key)
+        return Response(content=payload, media_type="application/json")
+    return await cache.get(key, loader, **cache_options)
+
+@app.get("/api/v1/stream/stats")
+async def stream_stats():
+    """Server-sent events: `concerts` (new concerts per month) and `top-artists` on every load"""
+    return StreamingResponse(
+        broadcaster.stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @app.get("/api/v1/stats/top-artists", response_model=List[StatTopItem])
-async def get_top_artists(db: AsyncSession = Depends(get_db)):
-    return await crud.get_stats_top_artists(db)
+async def get_top_artists():
+    return await serve_stats("top-artists", crud.get_stats_top_artists)
 
 @app.get("/api/v1/stats/top-songs", response_model=List[StatTopItem])
 async def get_top_songs():
-    return await crud.get_stats_top_songs()
+    return await serve_stats("top-songs", crud.get_stats_top_songs)
+
+@app.get("/api/v1/stats/top-songs/approx", response_model=SketchTopSongs)
+async def get_top_songs_approx(
+    artist: Optional[str] = Query(None, description="Artist MBID"),
+    year_from: Optional[int] = Query(None, ge=1900, le=2100),
+    year_to: Optional[int] = Query(None, ge=1900, le=2100),
+    limit: int = Query(20, ge=1, le=100),
+    db: AsyncSession = Depends(get_read_db)
+):
+    """Top songs of the whole dataset, one artist or a year range from heavy-hitter sketches"""
+    if artist is not None and (year_from is not None or year_to is not None):
+        raise HTTPException(422, "Filter by artist or by years, not both")
+    if year_from is not None and year_to is not None and year_from > year_to:
+        raise HTTPException(422, "year_from must not be after year_to")
+
+    data = await crud.get_sketch_top_songs(db, artist, year_from, year_to, limit)
+    if data is None:
+        raise HTTPException(404, "No songs counted for this slice")
+    return data
 
 @app.get("/api/v1/stats/concerts-by-year", response_model=List[StatYearItem])
 async def get_concerts_by_year():
-    return await crud.get_stats_concerts_by_year()
+    return await serve_stats("concerts-by-year", crud.get_stats_concerts_by_year)
 
 @app.get("/api/v1/stats/geography", response_model=List[StatGeoItem])
 async def get_geography():
-    return await crud.get_stats_geography()
+    return await serve_stats("geography", crud.get_stats_geography)
 
 @app.get("/api/v1/stats/cities", response_model=List[StatGeoItem])
 async def get_cities():
-    return await crud.get_stats_cities()
+    return await serve_stats("cities", crud.get_stats_cities)
 
 @app.get("/api/v1/stats/heatmap", response_model=List[StatHeatmapItem])
 async def get_heatmap():
-    return await crud.get_stats_heatmap()
+    return await serve_stats("heatmap", crud.get_stats_heatmap, min_year=crud.HEATMAP_FROM_YEAR)
+
+MAX_BATCH_SIZE = 100
+
+FIELDS_DESCRIPTION = "Comma separated subset of fields to return (default: all)"
+
+def parse_fields(fields: Optional[str], allowed) -> tuple:
+    try:
+        return crud.parse_fields(fields, allowed)
+    except ValueError as e:
+        raise HTTPException(422, str(e))
+
+def parse_ids(ids: str) -> List[str]:
+    parsed = list(dict.fromkeys(value.strip() for value in ids.split(",") if value.strip()))
+    if not parsed or len(parsed) > MAX_BATCH_SIZE:
+        raise HTTPException(422, f"Provide between 1 and {MAX_BATCH_SIZE} ids")
+    return parsed
 
-@app.get("/api/v1/artists/{artist_mbid}", response_model=ArtistDetail)
-async def get_artist_by_mbid(artist_mbid: str):
-    data = await crud.get_artist_details(artist_mbid)
+@app.get("/api/v1/artists/batch", response_model=List[ArtistDetail], response_model_exclude_unset=True)
+async def get_artists_batch(
+    mbids: str = Query(..., description="Comma separated artist MBIDs"),
+    fields: Optional[str] = Query(None, description=FIELDS_DESCRIPTION),
+    db: AsyncSession = Depends(get_read_db)
+):
+    return await crud.get_artists_details(
+        db, parse_ids(mbids), parse_fields(fields, crud.ARTIST_CONCERT_FIELDS)
+    )
+
+@app.get("/api/v1/artists/{artist_mbid}", response_model=ArtistDetail, response_model_exclude_unset=True)
+async def get_artist_by_mbid(
+    artist_mbid: str,
+    fields: Optional[str] = Query(None, description=FIELDS_DESCRIPTION)
+):
+    selected = parse_fields(fields, crud.ARTIST_CONCERT_FIELDS)
+    data = await cache.get(
+        ("artist", artist_mbid, selected),
+        lambda db: crud.get_artist_details(db, artist_mbid, selected),
+        artist_mbid=artist_mbid
+    )
     if not data:
         raise HTTPException(404, "Artist not found")
     return data
 
-@app.get("/api/v1/concerts/{concert_id}", response_model=ConcertDetail)
-async def get_concert_by_id(concert_id: str):
-    data = await crud.get_concert_details(concert_id)
+@app.get("/api/v1/artists/{artist_mbid}/summary", response_model=ArtistSummaryInfo)
+async def get_artist_summary(artist_mbid: str, db: AsyncSession = Depends(get_read_db)):
+    data = await crud.get_artist_summary(db, artist_mbid)
+    if not data:
+        raise HTTPException(404, "Artist not found")
+    return data
+
+@app.get("/api/v1/artists/{artist_mbid}/transitions", response_model=List[SongTransitions])
+async def get_artist_transitions(
+    artist_mbid: str,
+    song: Optional[str] = None,
+    k: int = Query(5, ge=1, le=50),
+    db: AsyncSession = Depends(get_read_db)
+):
+    data = await crud.get_artist_transitions(db, artist_mbid, song, k)
+    if data is None:
+        raise HTTPException(404, "Artist not found")
+    return data
+
+# Declared before /concerts/{concert_id} so "batch" and "nearby" are not taken for ids
+@app.get("/api/v1/concerts/batch", response_model=List[ConcertDetail], response_model_exclude_unset=True)
+async def get_concerts_batch(
+    ids: str = Query(..., description="Comma separated concert ids"),
+    fields: Optional[str] = Query(None, description=FIELDS_DESCRIPTION),
+    db: AsyncSession = Depends(get_read_db)
+):
+    return await crud.get_concerts_details(db, parse_ids(ids), parse_fields(fields, crud.CONCERT_FIELDS))
+
+@app.get("/api/v1/concerts/nearby", response_model=List[NearbyConcert])
+async def get_nearby_concerts(
+    lat: float = Query(..., ge=-90, le=90),
+    lon: float = Query(..., ge=-180, le=180),
+    radius_km: float = Query(50, gt=0, le=1000),
+    date_from: Optional[date] = Query(None, alias="from"),
+    date_to: Optional[date] = Query(None, alias="to"),
+    limit: int = Query(100, ge=1, le=1000),
+    db: AsyncSession = Depends(get_read_db)
+):
+    venues = geo.index.query(lat, lon, radius_km)
+    return await crud.get_nearby_concerts(db, venues, date_from, date_to, limit)
+
+@app.get("/api/v1/concerts/{concert_id}", response_model=ConcertDetail, response_model_exclude_unset=True)
+async def get_concert_by_id(
+    concert_id: str,
+    fields: Optional[str] = Query(None, description=FIELDS_DESCRIPTION),
+    db: AsyncSession = Depends(get_read_db)
+):
+    data = await crud.get_concert_details(db, concert_id, parse_fields(fields, crud.CONCERT_FIELDS))
     if not data:
         raise HTTPException(404, "Concert not found")
     return data
 
+@app.get("/api/v1/concerts/{concert_id}/similar", response_model=List[SimilarConcert])
+async def get_similar_concerts(
+    concert_id: str,
+    limit: int = Query(10, ge=1, le=50),
+    db: AsyncSession = Depends(get_read_db)
+):
+    data = await crud.get_similar_concerts(db, concert_id, limit)
+    if data is None:
+        raise HTTPException(404, "Concert not found")
+    return data
+
+@app.get("/api/v1/changes", response_model=ChangeFeed)
+async def get_changes(
+    since: int = Query(0, ge=0, description="next_token of the previous page (0 for the beginning)"),
+    limit: int = Query(500, ge=1, le=5000),
+    db: AsyncSession = Depends(get_read_db)
+):
+    return await crud.get_changes(db, since, limit)
+
+@app.get("/api/v1/export/{dataset}")
+async def export_dataset(
+    dataset: Literal["concerts", "setlists"],
+    format: Literal["ndjson", "csv"] = "ndjson",
+    gzip: bool = False
+):
+    filename = api_export.export_filename(dataset, format, gzip)
+    return api_export.ExportResponse(
+        api_export.export_stream(dataset, format, gzip),
+        media_type="application/gzip" if gzip else api_export.MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
 if __name__ == "__main__":
     uvicorn.run("api_main:app", host="0.0.0.0", port=8001, reload=True)
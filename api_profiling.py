@@ -0,0 +1,190 @@
+import asyncio
+import hmac
+import itertools
+import logging
+import os
+import random
+import sys
+import threading
+import time
+import weakref
+from collections import Counter
+from contextvars import ContextVar
+from typing import Optional
+
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+PROFILE_HEADER = b"x-profile"
+SUMMARY_HEADER = b"x-profile-summary"
+
+# Sampler of the request being profiled; tasks copy it from the context they are created in
+active_sampler: ContextVar[Optional["StackSampler"]] = ContextVar("active_sampler", default=None)
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class StackSampler:
+    """Samples the stack of one thread from a background thread.
+
+    Costs nothing to the profiled thread apart from the GIL hand-offs every
+    `interval` seconds; stacks are aggregated in folded format
+    ("root;caller;callee count"), readable by flamegraph.pl and speedscope.
+    With `task`, only samples taken while that task, or a task it spawned
+    (see `install_task_factory`), runs on `loop` are kept, so other requests
+    and the idle selector sharing the event loop thread are not counted.
+    """
+
+    def __init__(self, thread_id: int, interval: float,
+                 loop: Optional[asyncio.AbstractEventLoop] = None, task: Optional[asyncio.Task] = None):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.loop = loop
+        self.task = task
+        self.tasks = weakref.WeakSet([task] if task is not None else [])
+        self.stacks: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            if self.task is not None and self._current_task() not in self.tasks:
+                continue
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            labels = []
+            while frame is not None:
+                labels.append(_frame_label(frame))
+                frame = frame.f_back
+            self.stacks[";".join(reversed(labels))] += 1
+
+    def _current_task(self) -> Optional[asyncio.Task]:
+        try:
+            return asyncio.current_task(self.loop)  # reads the loop's current task from any thread
+        except RuntimeError:
+            return None
+
+    def folded(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.items())
+
+    def top_functions(self, limit: int = 3) -> list:
+        """Functions with the most self samples"""
+        self_samples: Counter = Counter()
+        for stack, count in self.stacks.items():
+            self_samples[stack.rsplit(";", 1)[-1]] += count
+        return self_samples.most_common(limit)
+
+
+def install_task_factory(loop: asyncio.AbstractEventLoop) -> None:
+    """Make tasks created while a request is profiled count as part of it (e.g. cache computes)"""
+    previous = loop.get_task_factory()
+    if getattr(previous, "profiling", False):
+        return
+
+    def factory(loop, coro, **kwargs):
+        if previous is not None:
+            task = previous(loop, coro, **kwargs)
+        else:
+            task = asyncio.Task(coro, loop=loop, **kwargs)
+        sampler = active_sampler.get()
+        if sampler is not None:
+            sampler.tasks.add(task)
+        return task
+
+    factory.profiling = True
+    loop.set_task_factory(factory)
+
+
+class ProfilingMiddleware:
+    """Opt-in per-request profiling.
+
+    A request is profiled when it carries `X-Profile: <PROFILE_TOKEN>` or is
+    picked by `PROFILE_SAMPLE_RATE`; otherwise the request passes straight
+    through. The call tree is written to PROFILE_DIR as a folded-stacks file
+    and summarised in the `X-Profile-Summary` response header.
+    """
+
+    def __init__(self, app, token: Optional[str] = settings.profile_token,
+                 sample_rate: float = settings.profile_sample_rate,
+                 output_dir: str = settings.profile_dir,
+                 interval_ms: float = settings.profile_interval_ms):
+        self.app = app
+        self.token = token.encode() if token else None
+        self.sample_rate = sample_rate
+        self.output_dir = output_dir
+        self.interval = interval_ms / 1000
+        self._busy = threading.Lock()  # one profiled request at a time
+        self._sequence = itertools.count()
+
+    def _requested(self, scope) -> bool:
+        if self.token is not None:
+            for name, value in scope["headers"]:
+                if name == PROFILE_HEADER:
+                    return hmac.compare_digest(value, self.token)
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self._requested(scope):
+            return await self.app(scope, receive, send)
+        if not self._busy.acquire(blocking=False):
+            return await self.app(scope, receive, send)
+
+        loop = asyncio.get_running_loop()
+        install_task_factory(loop)
+        sampler = StackSampler(threading.get_ident(), self.interval, loop, asyncio.current_task())
+        sampler_token = active_sampler.set(sampler)
+        started = time.perf_counter()
+        stopped = False
+
+        def finish() -> bytes:
+            nonlocal stopped
+            stopped = True
+            sampler.stop()
+            return self._save(scope, sampler, time.perf_counter() - started)
+
+        async def send_with_summary(message):
+            if message["type"] == "http.response.start" and not stopped:
+                summary = finish()
+                message = {**message, "headers": [*message.get("headers", []), (SUMMARY_HEADER, summary)]}
+            await send(message)
+
+        sampler.start()
+        try:
+            await self.app(scope, receive, send_with_summary)
+        finally:
+            if not stopped:
+                finish()
+            active_sampler.reset(sampler_token)
+            self._busy.release()
+
+    def _save(self, scope, sampler: StackSampler, elapsed: float) -> bytes:
+        samples = sum(sampler.stacks.values())
+        # pid and sequence keep profiles of the same path within one second apart
+        name = (f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{next(self._sequence)}-"
+                f"{scope['path'].strip('/').replace('/', '_') or 'root'}.folded")
+        try:
+            os.makedirs(self.output_dir, exist_ok=True)
+            with open(os.path.join(self.output_dir, name), "w", encoding="utf-8") as f:
+                f.write(sampler.folded())
+        except OSError as e:
+            logger.error(f"Failed to save profile: {e}")
+            name = "unsaved"
+
+        top = ", ".join(
+            f"{label.split(' ', 1)[0]}={count * 100 // max(samples, 1)}%"
+            for label, count in sampler.top_functions()
+        )
+        logger.info(f"Profiled {scope['path']} in {elapsed * 1000:.1f} ms -> {name}")
+        return f"wall={elapsed * 1000:.1f}ms; samples={samples}; file={name}; top={top}".encode("latin-1", "replace")
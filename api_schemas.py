@@ -1,5 +1,5 @@
 from pydantic import BaseModel, ConfigDict
-from datetime import date
+from datetime import date, datetime
 from typing import List, Optional
 
 model_config = ConfigDict(from_attributes=True)
@@ -28,25 +28,27 @@ class SetlistItemBase(BaseModel):
 
 
 # --- Response Models ---
+# Detail fields other than ids are optional: routes accept a `fields=` sparse
+# fieldset and are declared with response_model_exclude_unset
 
 class ConcertBasicInfo(BaseModel):
     model_config = model_config
     concert_id: str
-    concert_date: date
+    concert_date: Optional[date] = None
     tour_name: Optional[str] = None
-    venue_name: str
-    city_name: str
-    country_name: str
+    venue_name: Optional[str] = None
+    city_name: Optional[str] = None
+    country_name: Optional[str] = None
 
 
 class ConcertDetail(BaseModel):
     model_config = model_config
     concert_id: str
-    concert_date: date
+    concert_date: Optional[date] = None
     tour_name: Optional[str] = None
-    artist: ArtistBase
-    venue: VenueBase
-    setlist: List[SetlistItemBase] = []
+    artist: Optional[ArtistBase] = None
+    venue: Optional[VenueBase] = None
+    setlist: Optional[List[SetlistItemBase]] = None
 
 
 class ArtistDetail(BaseModel):
@@ -55,6 +57,54 @@ class ArtistDetail(BaseModel):
     concerts: List[ConcertBasicInfo] = []
 
 
+class SimilarConcert(BaseModel):
+    model_config = model_config
+    concert_id: str
+    concert_date: date
+    artist_name: str
+    similarity: float
+
+
+class NearbyConcert(BaseModel):
+    model_config = model_config
+    concert_id: str
+    concert_date: date
+    artist_name: str
+    venue_name: str
+    city_name: str
+    distance_km: float
+
+
+class SongSuccessor(BaseModel):
+    model_config = model_config
+    song_name: str
+    count: int
+    probability: float
+
+
+class SongTransitions(BaseModel):
+    model_config = model_config
+    song_name: str
+    total: int
+    successors: List[SongSuccessor] = []
+
+
+class ConcertChangeItem(BaseModel):
+    model_config = model_config
+    change_seq: int
+    concert_id: str
+    artist_mbid: str
+    operation: str
+    changed_at: datetime
+
+
+class ChangeFeed(BaseModel):
+    model_config = model_config
+    changes: List[ConcertChangeItem] = []
+    next_token: int  # pass as `since` to get the following page
+    has_more: bool
+
+
 # --- Statistics ---
 
 class StatTopItem(BaseModel):
@@ -63,6 +113,20 @@ class StatTopItem(BaseModel):
     count: int
 
 
+class SketchTopItem(BaseModel):
+    model_config = model_config
+    name: str
+    count: int  # upper bound of the true count
+    error: int  # count - error is a lower bound
+
+
+class SketchTopSongs(BaseModel):
+    model_config = model_config
+    total: int
+    error_bound: int  # no estimate exceeds the true count by more than this
+    songs: List[SketchTopItem] = []
+
+
 class StatYearItem(BaseModel):
     model_config = model_config
     year: int
@@ -82,6 +146,19 @@ class StatHeatmapItem(BaseModel):
     count: int
 
 
+class ArtistSummaryInfo(BaseModel):
+    model_config = model_config
+    artist: ArtistBase
+    concert_count: int
+    songs_played: int
+    distinct_songs: int
+    cover_ratio: float
+    countries: List[str] = []
+    top_songs: List[StatTopItem] = []
+    first_show: Optional[date] = None
+    last_show: Optional[date] = None
+
+
 # --- External API Models (moved from make_data.py) ---
 
 class ExternalArtist(BaseModel):
@@ -94,9 +171,16 @@ class ExternalCountry(BaseModel):
     name: str
 
 
+class ExternalCoords(BaseModel):
+    # Partial or empty coords must not drop the setlist; loaders ignore them
+    lat: Optional[float] = None
+    long: Optional[float] = None
+
+
 class ExternalCity(BaseModel):
     name: str
     country: ExternalCountry
+    coords: Optional[ExternalCoords] = None
 
 
 class ExternalVenue(BaseModel):
@@ -125,3 +209,4 @@ class ExternalSetlist(BaseModel):
     venue: ExternalVenue
     sets: Optional[ExternalSets] = None
     tour: Optional[dict] = None
+    lastUpdated: Optional[str] = None
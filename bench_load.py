@@ -0,0 +1,66 @@
+"""Compare rows/sec of the ORM loader and the COPY bulk loader.
+
+Writes synthetic concerts, so run it against a scratch database:
+
+    DB_NAME=rock_bench python bench_load.py --concerts 2000
+"""
+import argparse
+import random
+import time
+
+from config import setup_logging
+from load_to_db import init_db, process_data
+from bulk_load import bulk_load
+
+SONGS = [f"Song {i}" for i in range(300)]
+COUNTRIES = [("DE", "Germany"), ("PL", "Poland"), ("FR", "France"), ("GB", "United Kingdom")]
+
+
+def make_records(prefix: str, count: int, songs_per_show: int = 20, seed: int = 42) -> list:
+    rng = random.Random(seed)
+    records = []
+    for i in range(count):
+        code, country = rng.choice(COUNTRIES)
+        records.append({
+            "id": f"{prefix}-{i}",
+            "eventDate": f"{rng.randint(1, 28):02d}-{rng.randint(1, 12):02d}-{rng.randint(2015, 2024)}",
+            "artist": {"mbid": f"bench-artist-{i % 25}", "name": f"Bench Artist {i % 25}"},
+            "venue": {
+                "name": f"Arena {i % 200}",
+                "city": {"name": f"City {i % 50}", "country": {"code": code, "name": country}}
+            },
+            "sets": {"set": [{"song": [{"name": name} for name in rng.sample(SONGS, songs_per_show)]}]},
+            "tour": {"name": "Bench Tour"}
+        })
+    return records
+
+
+def measure(label: str, load, records: list) -> float:
+    rows = sum(1 + len(r["sets"]["set"][0]["song"]) for r in records)
+    started = time.perf_counter()
+    load(records)
+    elapsed = time.perf_counter() - started
+    print(f"{label:<6} {len(records):>8} concerts {rows:>10} rows {elapsed:>8.2f} s {rows / elapsed:>12.0f} rows/sec")
+    return rows / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concerts", type=int, default=2000)
+    args = parser.parse_args()
+
+    setup_logging()
+    init_db()
+    run_id = int(time.time())
+    orm = measure("orm", process_data, make_records(f"bench-orm-{run_id}", args.concerts))
+    bulk_stats = {}
+    bulk = measure("bulk", lambda records: bulk_stats.update(bulk_load(records)),
+                   make_records(f"bench-bulk-{run_id}", args.concerts))
+    print(f"speedup: {bulk / orm:.1f}x")
+    # Both totals include the derived data (similarity, transitions, summaries, sketches)
+    print(f"bulk COPY + merge alone: {bulk_stats['load_seconds']:.2f} s "
+          f"{bulk_stats['rows_per_second']:.0f} rows/sec ({bulk_stats['rows_per_second'] / orm:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,343 @@
+import asyncio
+import json
+import logging
+import queue
+import threading
+import time
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import asyncpg
+from sqlalchemy.orm import sessionmaker
+
+from config import settings, CHANGES_CHANNEL
+import load_to_db
+from load_to_db import parse_date, parse_coords, parse_last_updated, get_engine
+import partitions
+import changes
+import summaries
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 5000  # concerts per COPY round trip
+QUEUE_SIZE = 4  # parsed chunks buffered ahead of the writer (backpressure)
+PUT_TIMEOUT = 0.5  # seconds between the parser's checks for a failed writer
+DERIVED_BATCH_SIZE = 500
+NOTIFY_MAX_BYTES = 8000  # NOTIFY payloads must be shorter than this
+
+STAGING_CONCERTS_COLUMNS = [
+    "concert_id", "concert_date", "tour_name", "artist_mbid", "artist_name",
+    "country_code", "country_name", "city_name", "latitude", "longitude", "venue_name", "last_updated"
+]
+STAGING_ITEMS_COLUMNS = ["concert_id", "concert_date", "song_name", "position_in_set", "is_cover"]
+
+# Temporary tables: private to the loader's connection, so concurrent runs
+# never share staging rows, and always created with the current columns
+STAGING_DDL = [
+    """
+    CREATE TEMP TABLE staging_concerts (
+        concert_id TEXT, concert_date DATE, tour_name TEXT,
+        artist_mbid TEXT, artist_name TEXT,
+        country_code TEXT, country_name TEXT, city_name TEXT,
+        latitude DOUBLE PRECISION, longitude DOUBLE PRECISION, venue_name TEXT, last_updated TIMESTAMPTZ
+    )
+    """,
+    """
+    CREATE TEMP TABLE staging_setlistitems (
+        concert_id TEXT, concert_date DATE, song_name TEXT,
+        position_in_set INTEGER, is_cover BOOLEAN
+    )
+    """,
+]
+
+MERGE_REFERENCE_DATA = [
+    """
+    INSERT INTO artists (artist_mbid, artist_name)
+    SELECT DISTINCT ON (artist_mbid) artist_mbid, artist_name FROM staging_concerts
+    ON CONFLICT (artist_mbid) DO NOTHING
+    """,
+    """
+    INSERT INTO countries (country_code, country_name)
+    SELECT DISTINCT ON (country_code) country_code, country_name FROM staging_concerts
+    ON CONFLICT (country_code) DO NOTHING
+    """,
+    """
+    INSERT INTO cities (city_name, country_code, latitude, longitude)
+    SELECT DISTINCT ON (city_name, country_code) city_name, country_code, latitude, longitude
+    FROM staging_concerts
+    ORDER BY city_name, country_code, latitude NULLS LAST
+    ON CONFLICT ON CONSTRAINT uq_city_country DO UPDATE SET
+        latitude = COALESCE(cities.latitude, EXCLUDED.latitude),
+        longitude = COALESCE(cities.longitude, EXCLUDED.longitude)
+    """,
+    """
+    INSERT INTO venues (venue_name, city_id)
+    SELECT DISTINCT s.venue_name, c.city_id
+    FROM staging_concerts s
+    JOIN cities c ON c.city_name = s.city_name AND c.country_code = s.country_code
+    ON CONFLICT ON CONSTRAINT uq_venue_city DO NOTHING
+    """,
+]
+
+# Known concert ids are filtered out here; concert_ids (see models.ConcertId)
+# rejects any inserted concurrently by another loader. Only new concerts are
+# inserted: edited setlists of existing concerts are applied by the ORM
+# loader (`rock load` without --bulk)
+MERGE_CONCERTS = """
+    INSERT INTO concerts (concert_id, artist_mbid, venue_id, concert_date, tour_name, last_updated)
+    SELECT DISTINCT ON (s.concert_id) s.concert_id, s.artist_mbid, v.venue_id, s.concert_date, s.tour_name,
+           s.last_updated
+    FROM staging_concerts s
+    JOIN cities c ON c.city_name = s.city_name AND c.country_code = s.country_code
+    JOIN venues v ON v.venue_name = s.venue_name AND v.city_id = c.city_id
+    WHERE NOT EXISTS (SELECT 1 FROM concerts e WHERE e.concert_id = s.concert_id)
+    ORDER BY s.concert_id, s.last_updated DESC NULLS LAST
+    RETURNING concert_id
+"""
+
+MERGE_SETLISTITEMS = """
+    INSERT INTO setlistitems (concert_id, concert_date, song_name, position_in_set, is_cover)
+    SELECT DISTINCT ON (s.concert_id, s.position_in_set)
+           s.concert_id, s.concert_date, s.song_name, s.position_in_set, s.is_cover
+    FROM staging_setlistitems s
+    WHERE s.concert_id = ANY($1::text[])
+    ORDER BY s.concert_id, s.position_in_set
+"""
+
+NEW_CONCERTS_BY_MONTH = """
+    SELECT artist_mbid, EXTRACT(YEAR FROM concert_date)::INT, EXTRACT(MONTH FROM concert_date)::INT, COUNT(*)
+    FROM concerts
+    WHERE concert_id = ANY($1::text[])
+    GROUP BY 1, 2, 3
+    ORDER BY 1, 2, 3
+"""
+
+
+def parse_record(concert_data: Dict[str, Any]) -> Optional[Tuple[tuple, List[tuple]]]:
+    """Flatten one setlist into a staging concert row and its setlist item rows"""
+    artist_data = concert_data.get('artist')
+    venue_data = concert_data.get('venue')
+    city_data = venue_data.get('city') if venue_data else None
+    country_data = city_data.get('country') if city_data else None
+
+    if not all([artist_data, venue_data, city_data, country_data]):
+        logger.warning(f"Missing required data for concert {concert_data.get('id')}")
+        return None
+
+    concert_id = concert_data.get('id')
+    concert_date = parse_date(concert_data.get('eventDate'))
+    if not concert_date:
+        logger.warning(f"Invalid date for concert {concert_id}")
+        return None
+
+    tour_data = concert_data.get('tour')
+    latitude, longitude = parse_coords(city_data.get('coords'))
+    concert_row = (
+        concert_id, concert_date, tour_data.get('name') if tour_data else None,
+        artist_data['mbid'], artist_data['name'],
+        country_data['code'], country_data['name'], city_data['name'],
+        latitude, longitude, venue_data['name'],
+        parse_last_updated(concert_data.get('lastUpdated'))
+    )
+
+    item_rows = []
+    position = 1
+    for set_data in (concert_data.get('sets') or {}).get('set', []):
+        for song in set_data.get('song', []):
+            if song.get('name'):
+                item_rows.append((concert_id, concert_date, song['name'], position, 'cover' in song))
+                position += 1
+
+    return concert_row, item_rows
+
+
+def _produce(records: Iterable[dict], chunks: queue.Queue, stats: Dict[str, Any],
+             cancelled: threading.Event) -> None:
+    """Parser thread: fills the bounded queue, waiting while the writer catches up.
+
+    Stops once `cancelled` is set, so a failed writer never leaves it
+    blocked on a full queue.
+    """
+    def put(item) -> bool:
+        while not cancelled.is_set():
+            try:
+                chunks.put(item, timeout=PUT_TIMEOUT)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    try:
+        concerts, items = [], []
+        for record in records:
+            parsed = parse_record(record)
+            if parsed is None:
+                stats["skipped"] += 1
+                continue
+            concerts.append(parsed[0])
+            items.extend(parsed[1])
+            if len(concerts) >= CHUNK_SIZE:
+                if not put((concerts, items)):
+                    return
+                concerts, items = [], []
+        if concerts:
+            put((concerts, items))
+    except Exception as e:
+        stats["error"] = e
+    finally:
+        put(None)
+
+
+async def _copy_to_staging(connection: asyncpg.Connection, records: Iterable[dict],
+                           stats: Dict[str, int]) -> None:
+    chunks: queue.Queue = queue.Queue(maxsize=QUEUE_SIZE)
+    cancelled = threading.Event()
+    producer = threading.Thread(
+        target=_produce, args=(records, chunks, stats, cancelled), name="bulk-load-parser", daemon=True
+    )
+    producer.start()
+
+    loop = asyncio.get_running_loop()
+    try:
+        while True:
+            chunk = await loop.run_in_executor(None, chunks.get)
+            if chunk is None:
+                break
+            concerts, items = chunk
+            # Binary COPY protocol
+            await connection.copy_records_to_table(
+                "staging_concerts", records=concerts, columns=STAGING_CONCERTS_COLUMNS
+            )
+            await connection.copy_records_to_table(
+                "staging_setlistitems", records=items, columns=STAGING_ITEMS_COLUMNS
+            )
+            stats["staged_concerts"] += len(concerts)
+            stats["staged_songs"] += len(items)
+            logger.info(f"Staged {stats['staged_concerts']} concerts...")
+    finally:
+        # No-op after the producer's end marker; stops it if the COPY failed
+        cancelled.set()
+        await loop.run_in_executor(None, producer.join)
+
+    if "error" in stats:
+        raise stats.pop("error")
+
+
+async def _ensure_partitions(connection: asyncpg.Connection, attempts: int = 5) -> None:
+    """Create partitions for the staged years in their own short transaction.
+
+    Done before the merge so that the parent tables are not locked for its
+    whole duration (see partitions.ensure_year_partitions).
+    """
+    years = [row["year"] for row in await connection.fetch(
+        "SELECT DISTINCT EXTRACT(YEAR FROM concert_date)::INT AS year FROM staging_concerts"
+    )]
+    for attempt in range(1, attempts + 1):
+        try:
+            async with connection.transaction():
+                await connection.execute(f"SET LOCAL lock_timeout = {partitions.PARTITION_LOCK_TIMEOUT_MS}")
+                for year in years:
+                    for table in partitions.PARTITIONED_TABLES:
+                        await connection.execute(partitions.partition_ddl(table, year))
+            return
+        except asyncpg.LockNotAvailableError:
+            if attempt == attempts:
+                raise
+            logger.warning(f"Partitions for {years} are locked, retrying...")
+            await asyncio.sleep(attempt)
+
+
+async def _merge(connection: asyncpg.Connection) -> List[str]:
+    """Move staged rows into the real tables with set-based statements"""
+    await _ensure_partitions(connection)
+    async with connection.transaction():
+        for statement in MERGE_REFERENCE_DATA:
+            await connection.execute(statement)
+
+        new_ids = [row["concert_id"] for row in await connection.fetch(MERGE_CONCERTS)]
+        await connection.execute(MERGE_SETLISTITEMS, new_ids)
+        if new_ids:
+            # Committed together with the concerts, like the ORM path
+            await connection.execute("SELECT pg_advisory_xact_lock($1)", changes.CHANGES_LOCK_KEY)
+            await connection.execute(changes.RECORD_CHANGES, new_ids, changes.INSERT)
+            await _notify(connection, new_ids)
+        await connection.execute("TRUNCATE staging_concerts, staging_setlistitems")
+    return new_ids
+
+
+def notify_payloads(rows: List[tuple], seq: int) -> Iterator[str]:
+    """Serialized change payloads for (artist_mbid, year, month, concerts) rows.
+
+    The rows are halved until each payload fits NOTIFY's size limit;
+    listeners merge the parts again (api_cache.merge_changes).
+    """
+    payload = load_to_db.change_payload(rows)
+    payload["seq"] = seq
+    encoded = json.dumps(payload)
+    if len(encoded.encode("utf-8")) < NOTIFY_MAX_BYTES or len(rows) <= 1:
+        yield encoded
+        return
+    middle = len(rows) // 2
+    yield from notify_payloads(rows[:middle], seq)
+    yield from notify_payloads(rows[middle:], seq)
+
+
+async def _notify(connection: asyncpg.Connection, new_ids: List[str]) -> None:
+    """Announce the merged concerts to API listeners; delivered on commit"""
+    rows = [tuple(row) for row in await connection.fetch(NEW_CONCERTS_BY_MONTH, new_ids)]
+    seq = await connection.fetchval(changes.LATEST_SEQ)
+    for payload in notify_payloads(rows, seq):
+        await connection.execute("SELECT pg_notify($1, $2)", CHANGES_CHANNEL, payload)
+
+
+async def bulk_load_async(records: Iterable[dict]) -> Tuple[List[str], Dict[str, int]]:
+    stats = {"staged_concerts": 0, "staged_songs": 0, "skipped": 0}
+    connection = await asyncpg.connect(
+        user=settings.db_user,
+        password=settings.db_password,
+        host=settings.db_host,
+        port=settings.db_port,
+        database=settings.db_name
+    )
+    try:
+        for statement in STAGING_DDL:
+            await connection.execute(statement)
+        await _copy_to_staging(connection, records, stats)
+        new_ids = await _merge(connection)
+    finally:
+        await connection.close()
+    return new_ids, stats
+
+
+def update_derived_data(concert_ids: List[str]) -> None:
+    """Index merged concerts in batches (feed rows and NOTIFY were committed by the merge).
+
+    If this fails the concerts stay loaded without derived data; the rebuild
+    scripts (similarity.py, transitions.py, summaries.py, sketches.py) repair it.
+    """
+    SessionLocal = sessionmaker(bind=get_engine())
+    with SessionLocal() as session:
+        for start in range(0, len(concert_ids), DERIVED_BATCH_SIZE):
+            load_to_db.update_derived_data(session, concert_ids[start:start + DERIVED_BATCH_SIZE])
+            session.commit()
+        summaries.refresh_queued(session)
+
+
+def bulk_load(records: Iterable[dict]) -> Dict[str, Any]:
+    """COPY records through staging tables; returns load statistics"""
+    started = time.perf_counter()
+    new_ids, stats = asyncio.run(bulk_load_async(records))
+    load_seconds = time.perf_counter() - started
+
+    update_derived_data(new_ids)
+
+    stats.update({
+        "concerts": len(new_ids),
+        "load_seconds": load_seconds,
+        "rows_per_second": (stats["staged_concerts"] + stats["staged_songs"]) / load_seconds if load_seconds else 0.0
+    })
+    logger.info("\n--- Bulk upload completed ---")
+    logger.info(f"Successfully imported: {stats['concerts']} concerts")
+    logger.info(f"Staged rows: {stats['staged_concerts']} concerts, {stats['staged_songs']} songs "
+                f"({stats['rows_per_second']:.0f} rows/sec)")
+    logger.info(f"Skipped due to errors: {stats['skipped']}")
+    return stats
@@ -0,0 +1,86 @@
+import logging
+from typing import Sequence
+
+from sqlalchemy import select, insert, literal, text
+from sqlalchemy.orm import Session
+
+from models import Concert, ConcertChange
+
+logger = logging.getLogger(__name__)
+
+# Serialises writers of the change feed so that sequence numbers become
+# visible in commit order and a consumer paging with `since` never skips one
+CHANGES_LOCK_KEY = 0x726F636B
+
+INSERT = "insert"
+UPDATE = "update"
+
+# Databases created before edits were tracked (python changes.py applies it)
+MIGRATION = [
+    "ALTER TABLE concerts ADD COLUMN IF NOT EXISTS last_updated TIMESTAMPTZ",
+]
+
+# record_changes() for an asyncpg connection (COPY loader): $1 concert ids, $2 operation
+RECORD_CHANGES = """
+    INSERT INTO concert_changes (concert_id, artist_mbid, operation)
+    SELECT concert_id, artist_mbid, $2 FROM concerts
+    WHERE concert_id = ANY($1::text[])
+    ORDER BY concert_date, concert_id
+"""
+
+# Newest sequence number of the feed; the version of data derived from it (stats snapshot)
+LATEST_SEQ = "SELECT COALESCE(MAX(change_seq), 0) FROM concert_changes"
+
+
+def record_changes(session: Session, concert_ids: Sequence[str], operation: str = INSERT) -> None:
+    """Append the given concerts to the change feed; runs in the caller's transaction"""
+    if not concert_ids:
+        return
+
+    session.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": CHANGES_LOCK_KEY})
+    session.execute(
+        insert(ConcertChange).from_select(
+            ["concert_id", "artist_mbid", "operation"],
+            select(Concert.concert_id, Concert.artist_mbid, literal(operation))
+            .where(Concert.concert_id.in_(concert_ids))
+            .order_by(Concert.concert_date, Concert.concert_id)
+        )
+    )
+
+
+def latest_seq(session: Session) -> int:
+    """Newest change_seq; after record_changes() the one of this transaction's last concert"""
+    return session.scalar(text(LATEST_SEQ))
+
+
+def backfill_changes(chunk_size: int = 10000) -> None:
+    """Record already loaded concerts that are missing from the feed"""
+    from sqlalchemy.orm import sessionmaker
+    from load_to_db import get_engine
+
+    engine = get_engine()
+    with engine.begin() as connection:
+        for statement in MIGRATION:
+            connection.execute(text(statement))
+    ConcertChange.__table__.create(engine, checkfirst=True)
+    SessionLocal = sessionmaker(bind=engine)
+
+    with SessionLocal() as session:
+        missing = session.scalars(
+            select(Concert.concert_id)
+            .where(~select(ConcertChange.change_seq)
+                   .where(ConcertChange.concert_id == Concert.concert_id).exists())
+            .order_by(Concert.concert_date, Concert.concert_id)
+        ).all()
+        for start in range(0, len(missing), chunk_size):
+            record_changes(session, missing[start:start + chunk_size])
+            session.commit()
+
+    logger.info(f"Recorded {len(missing)} concerts in the change feed")
+
+
+if __name__ == "__main__":
+    from config import setup_logging
+
+    setup_logging()
+    backfill_changes()
@@ -1,10 +1,21 @@
 from pydantic_settings import BaseSettings, SettingsConfigDict
+from functools import lru_cache
+from typing import List, Optional
 import logging
 import sys
 
 LOG_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
 
+# Postgres NOTIFY channel used by the loader to announce committed batches
+CHANGES_CHANNEL = "rock_data_changed"
+
+_logging_configured = False
+
 def setup_logging():
+    """Configure root logging once; called by entry points, not at import time"""
+    global _logging_configured
+    if _logging_configured:
+        return
     logging.basicConfig(
         level=logging.INFO,
         format=LOG_FORMAT,
@@ -13,8 +24,7 @@ def setup_logging():
             logging.FileHandler("app.log", encoding="utf-8") # Запис у файл
         ]
     )
-
-setup_logging()
+    _logging_configured = True
 
 class Settings(BaseSettings):
     db_user: str
@@ -23,8 +33,60 @@ class Settings(BaseSettings):
     db_port: int = 5432
     db_name: str
 
+    # Connection pools; admission control limits are derived from the pool sizes.
+    # db_pool_max_size is the API's total on the primary, split between the
+    # SQLAlchemy engine and the asyncpg pool (api_database.split_primary_pool)
+    db_pool_min_size: int = 5
+    db_pool_max_size: int = 20
+
+    # Read replicas (JSON list of DSNs) used for stats and detail reads
+    db_replica_dsns: List[str] = []
+    db_replica_pool_size: int = 10
+    db_replica_max_lag_seconds: float = 5.0
+    db_replica_check_interval: float = 2.0
+
+    # In-process query cache (see api_cache.py)
+    cache_max_entries: int = 1000
+    cache_refresh_delay: float = 1.0  # seconds over which loader notifications are coalesced
+
+    # Memory-mapped stats snapshot shared by all API workers of a host (see snapshot.py);
+    # one worker rebuilds it after data changes, at most every `stats_snapshot_interval`
+    # seconds. Stats older than `stats_snapshot_max_staleness` are served from the cache.
+    stats_snapshot_path: str = "stats_snapshot.bin"
+    stats_snapshot_interval: float = 5.0
+    stats_snapshot_max_staleness: float = 30.0
+
+    # Per-client token bucket
+    rate_limit_per_second: float = 20.0
+    rate_limit_burst: int = 40
+    # Open server-sent event streams per client (they bypass the route limits)
+    stream_max_per_client: int = 4
+
+    # Opt-in request profiling (see api_profiling.py)
+    profile_token: Optional[str] = None
+    profile_sample_rate: float = 0.0
+    profile_dir: str = "profiles"
+    profile_interval_ms: float = 10.0
+
     setlist_api_key: str
 
     model_config = SettingsConfigDict(env_file=".env", extra="ignore")
 
-settings = Settings()
\ No newline at end of file
+@lru_cache(maxsize=None)
+def get_settings() -> Settings:
+    """Read the environment and `.env` on first use rather than when config is imported"""
+    return Settings()
+
+class _LazySettings:
+    """Module-level `settings`: forwards to get_settings(), so importing config reads nothing"""
+
+    def __getattr__(self, name):
+        return getattr(get_settings(), name)
+
+    def __setattr__(self, name, value):
+        setattr(get_settings(), name, value)
+
+    def __delattr__(self, name):
+        delattr(get_settings(), name)
+
+settings: Settings = _LazySettings()  # type: ignore[assignment]
\ No newline at end of file
@@ -0,0 +1,97 @@
+import logging
+import math
+from collections import defaultdict
+from typing import Dict, List, Tuple
+
+from sqlalchemy import select, text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models import City, Venue
+
+logger = logging.getLogger(__name__)
+
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEGREE = 111.2
+
+
+def haversine_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    d_phi = phi2 - phi1
+    d_lambda = math.radians(lon2 - lon1)
+    a = math.sin(d_phi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(d_lambda / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+class SpatialGrid:
+    """Uniform lat/lon grid of venues (venues are located at their city's coordinates)"""
+
+    def __init__(self, cell_degrees: float = 1.0):
+        self.cell_degrees = cell_degrees
+        self._cells: Dict[Tuple[int, int], List[tuple]] = defaultdict(list)
+        self.size = 0
+
+    def _cell(self, lat: float, lon: float) -> Tuple[int, int]:
+        return math.floor(lat / self.cell_degrees), math.floor(lon / self.cell_degrees)
+
+    def add(self, venue_id: int, lat: float, lon: float):
+        self._cells[self._cell(lat, lon)].append((venue_id, lat, lon))
+        self.size += 1
+
+    def query(self, lat: float, lon: float, radius_km: float) -> Dict[int, float]:
+        """venue_id -> distance for venues within radius_km"""
+        lat_delta = radius_km / KM_PER_DEGREE
+        cos_lat = max(math.cos(math.radians(min(abs(lat) + lat_delta, 89.0))), 0.01)
+        lon_delta = min(radius_km / (KM_PER_DEGREE * cos_lat), 180.0)
+
+        min_i, min_j = self._cell(lat - lat_delta, lon - lon_delta)
+        max_i, max_j = self._cell(lat + lat_delta, lon + lon_delta)
+        cells_per_turn = round(360 / self.cell_degrees)
+
+        found = {}
+        for i in range(min_i, max_i + 1):
+            for j in range(min_j, max_j + 1):
+                # Wrap around the antimeridian
+                wrapped_j = (j + cells_per_turn // 2) % cells_per_turn - cells_per_turn // 2
+                for venue_id, venue_lat, venue_lon in self._cells.get((i, wrapped_j), ()):
+                    distance = haversine_km(lat, lon, venue_lat, venue_lon)
+                    if distance <= radius_km:
+                        found[venue_id] = distance
+        return found
+
+
+index = SpatialGrid()
+
+
+async def build_index(db: AsyncSession) -> SpatialGrid:
+    """Load venue coordinates and swap in a fresh grid"""
+    global index
+    grid = SpatialGrid()
+    result = await db.execute(
+        select(Venue.venue_id, City.latitude, City.longitude)
+        .join(City, City.city_id == Venue.city_id)
+        .where(City.latitude.is_not(None), City.longitude.is_not(None))
+    )
+    for venue_id, lat, lon in result:
+        grid.add(venue_id, lat, lon)
+
+    index = grid
+    logger.info(f"Spatial index built with {grid.size} venues")
+    return grid
+
+
+MIGRATION = [
+    "ALTER TABLE cities ADD COLUMN IF NOT EXISTS latitude DOUBLE PRECISION",
+    "ALTER TABLE cities ADD COLUMN IF NOT EXISTS longitude DOUBLE PRECISION",
+    "CREATE INDEX IF NOT EXISTS ix_concerts_venue_id ON concerts (venue_id)",
+]
+
+
+if __name__ == "__main__":
+    from config import setup_logging
+    from load_to_db import get_engine
+
+    setup_logging()
+    with get_engine().begin() as conn:
+        for statement in MIGRATION:
+            conn.execute(text(statement))
+    logger.info("Added city coordinates columns")
@@ -1,17 +1,29 @@
 import json
+import gzip
+import hashlib
 import os
 import logging
+from collections import Counter
 from datetime import datetime
-from typing import Optional, Dict, Any
-from sqlalchemy import create_engine, select
+from itertools import islice
+from typing import Optional, Dict, Any, Iterable, Iterator
+from sqlalchemy import create_engine, select, extract, func, text
 from sqlalchemy.orm import sessionmaker, Session
 from sqlalchemy.exc import SQLAlchemyError
 
-from config import settings
+from config import settings, setup_logging, CHANGES_CHANNEL
 from models import Base, Artist, Country, City, Venue, Concert, SetlistItem
+import similarity
+import transitions
+import partitions
+import summaries
+import sketches
+import changes
 
 logger = logging.getLogger(__name__)
 
+BATCH_SIZE = 50  # concerts per transaction
+
 
 def get_engine():
     """Create SQLAlchemy engine"""
@@ -22,6 +34,16 @@ def get_engine():
     return create_engine(connection_string, echo=False)
 
 
+def init_db(engine=None) -> None:
+    """Create the tables of a fresh database (`rock init-db`).
+
+    Loads no longer do this on every run; existing databases are upgraded by
+    the MIGRATION of the module that changed (`python partitions.py`, ...).
+    """
+    Base.metadata.create_all(engine or get_engine())
+    logger.info("Database tables created")
+
+
 def load_data_from_json(filename: str) -> Optional[list]:
     """Load concert data from JSON file"""
     if not os.path.exists(filename):
@@ -42,6 +64,34 @@ def load_data_from_json(filename: str) -> Optional[list]:
         return None
 
 
+def load_manifest(data_dir: str) -> Optional[dict]:
+    """Read the shard manifest written by make_data.py"""
+    manifest_path = os.path.join(data_dir, "manifest.json")
+    if not os.path.exists(manifest_path):
+        return None
+
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def iter_shard_records(data_dir: str, manifest: dict) -> Iterator[dict]:
+    """Stream records from JSONL shards, skipping shards whose checksum does not match"""
+    for shard in manifest["shards"]:
+        path = os.path.join(data_dir, shard["file"])
+
+        sha256 = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                sha256.update(block)
+        if sha256.hexdigest() != shard["sha256"]:
+            logger.error(f"Checksum mismatch for shard '{shard['file']}', skipping it")
+            continue
+
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            for line in f:
+                yield json.loads(line)
+
+
 def get_or_create_artist(session: Session, mbid: str, name: str) -> Artist:
     """Get existing artist or create new one"""
     stmt = select(Artist).where(Artist.artist_mbid == mbid)
@@ -68,19 +118,30 @@ def get_or_create_country(session: Session, code: str, name: str) -> Country:
     return country
 
 
-def get_or_create_city(session: Session, city_name: str, country_code: str) -> City:
+def parse_coords(coords: Optional[Dict[str, Any]]) -> tuple:
+    """(latitude, longitude), or (None, None) unless both are present"""
+    if not coords or coords.get('lat') is None or coords.get('long') is None:
+        return None, None
+    return coords['lat'], coords['long']
+
+
+def get_or_create_city(session: Session, city_name: str, country_code: str,
+                       coords: Optional[Dict[str, float]] = None) -> City:
     """Get existing city or create new one"""
     stmt = select(City).where(
         City.city_name == city_name,
         City.country_code == country_code
     )
     city = session.scalar(stmt)
+    latitude, longitude = parse_coords(coords)
 
     if not city:
-        city = City(city_name=city_name, country_code=country_code)
+        city = City(city_name=city_name, country_code=country_code, latitude=latitude, longitude=longitude)
         session.add(city)
         session.flush()  # Get city_id immediately
         logger.debug(f"Created new city: {city_name} in {country_code}")
+    elif city.latitude is None and latitude is not None:
+        city.latitude, city.longitude = latitude, longitude
 
     return city
 
@@ -111,8 +172,70 @@ def parse_date(date_string: str) -> Optional[datetime.date]:
         return None
 
 
-def process_concert(session: Session, concert_data: Dict[str, Any], stats: Dict[str, int]) -> bool:
-    """Process a single concert record"""
+def parse_last_updated(value: Optional[str]) -> Optional[datetime]:
+    """Parse Setlist.fm `lastUpdated` (e.g. 2013-10-20T05:18:08.000+0000)"""
+    if not value:
+        return None
+    try:
+        return datetime.strptime(value, "%Y-%m-%dT%H:%M:%S.%f%z")
+    except ValueError:
+        logger.warning(f"Invalid lastUpdated '{value}'")
+        return None
+
+
+def setlist_songs(concert_data: Dict[str, Any]) -> list:
+    """(song name, is cover) in playing order"""
+    return [
+        (song['name'], 'cover' in song)
+        for set_data in (concert_data.get('sets') or {}).get('set', [])
+        for song in set_data.get('song', [])
+        if song.get('name')
+    ]
+
+
+def is_edited(session: Session, concert: Concert, concert_data: Dict[str, Any], concert_date) -> bool:
+    """Whether a re-fetched setlist is a newer version of the stored concert.
+
+    With edit times on both sides only a newer edit counts, so older copies
+    of a setlist in earlier shards never overwrite a later one; otherwise
+    the content is compared.
+    """
+    last_updated = parse_last_updated(concert_data.get('lastUpdated'))
+    if last_updated is not None and concert.last_updated is not None:
+        return last_updated > concert.last_updated
+
+    tour_data = concert_data.get('tour')
+    venue_data = concert_data['venue']
+    venue = session.get(Venue, concert.venue_id)
+    stored_songs = session.execute(
+        select(SetlistItem.song_name, SetlistItem.is_cover)
+        .where(SetlistItem.concert_id == concert.concert_id)
+        .order_by(SetlistItem.position_in_set)
+    ).all()
+    return (
+        concert.concert_date != concert_date
+        or concert.tour_name != (tour_data.get('name') if tour_data else None)
+        or venue.venue_name != venue_data['name']
+        or venue.city.city_name != venue_data['city']['name']
+        or [tuple(row) for row in stored_songs] != setlist_songs(concert_data)
+    )
+
+
+def retract_concert(session: Session, concert: Concert) -> None:
+    """Take an edited concert out of the incremental derived data and delete it for re-insertion"""
+    transitions.retract_transitions(session, [concert.concert_id])
+    sketches.retract_sketches(session, [concert.concert_id])
+    summaries.queue_artists(session, [concert.artist_mbid])
+    session.delete(concert)  # setlist items are deleted by the relationship cascade
+    session.flush()
+
+
+def process_concert(session: Session, concert_data: Dict[str, Any], stats: Dict[str, int],
+                    replaced: Optional[list] = None) -> Optional[str]:
+    """Process a single concert record; returns changes.INSERT, changes.UPDATE or None if skipped.
+
+    For updates, the (artist_mbid, year, month) of the replaced version is appended to `replaced`.
+    """
     try:
         # Extract nested data
         artist_data = concert_data.get('artist')
@@ -124,7 +247,7 @@ def process_concert(session: Session, concert_data: Dict[str, Any], stats: Dict[
         if not all([artist_data, venue_data, city_data, country_data]):
             logger.warning(f"Missing required data for concert {concert_data.get('id')}")
             stats["skipped"] += 1
-            return False
+            return None
 
         concert_id = concert_data.get('id')
         event_date_str = concert_data.get('eventDate')
@@ -133,108 +256,241 @@ def process_concert(session: Session, concert_data: Dict[str, Any], stats: Dict[
         if not concert_date:
             logger.warning(f"Invalid date for concert {concert_id}")
             stats["skipped"] += 1
-            return False
+            return None
 
-        # Check if concert already exists
+        # Existing concerts are only replaced when the setlist was edited upstream
         stmt = select(Concert).where(Concert.concert_id == concert_id)
-        if session.scalar(stmt):
+        existing = session.scalar(stmt)
+        if existing and not is_edited(session, existing, concert_data, concert_date):
             logger.debug(f"Concert {concert_id} already exists, skipping")
             stats["skipped"] += 1
-            return False
-
-        # Get or create related entities
-        artist = get_or_create_artist(
-            session,
-            artist_data['mbid'],
-            artist_data['name']
-        )
-
-        country = get_or_create_country(
-            session,
-            country_data['code'],
-            country_data['name']
-        )
-
-        city = get_or_create_city(
-            session,
-            city_data['name'],
-            country_data['code']
-        )
-
-        venue = get_or_create_venue(
-            session,
-            venue_data['name'],
-            city.city_id
-        )
-
-        # Create concert
-        tour_data = concert_data.get('tour')
-        tour_name = tour_data.get('name') if tour_data else None
-
-        concert = Concert(
-            concert_id=concert_id,
-            artist_mbid=artist.artist_mbid,
-            venue_id=venue.venue_id,
-            concert_date=concert_date,
-            tour_name=tour_name
-        )
-        session.add(concert)
-
-        # Process setlist items
-        sets_data = concert_data.get('sets', {}).get('set', [])
-        song_position = 1
-
-        for set_data in sets_data:
-            songs_in_set = set_data.get('song', [])
-            for song in songs_in_set:
-                song_name = song.get('name')
-                if song_name:
-                    setlist_item = SetlistItem(
-                        concert_id=concert_id,
-                        song_name=song_name,
-                        position_in_set=song_position,
-                        is_cover='cover' in song
-                    )
-                    session.add(setlist_item)
-                    stats["songs"] += 1
-                    song_position += 1
-
+            return None
+
+        songs = setlist_songs(concert_data)
+        if existing:
+            previous = (existing.artist_mbid, existing.concert_date.year, existing.concert_date.month)
+
+        # Savepoint: if building the new version fails, the deletion of the old
+        # one is rolled back with it instead of being committed by the batch
+        with session.begin_nested():
+            if existing:
+                logger.debug(f"Concert {concert_id} was edited, replacing it")
+                retract_concert(session, existing)
+
+            # Get or create related entities
+            artist = get_or_create_artist(
+                session,
+                artist_data['mbid'],
+                artist_data['name']
+            )
+
+            country = get_or_create_country(
+                session,
+                country_data['code'],
+                country_data['name']
+            )
+
+            city = get_or_create_city(
+                session,
+                city_data['name'],
+                country_data['code'],
+                city_data.get('coords')
+            )
+
+            venue = get_or_create_venue(
+                session,
+                venue_data['name'],
+                city.city_id
+            )
+
+            # Create concert
+            tour_data = concert_data.get('tour')
+            tour_name = tour_data.get('name') if tour_data else None
+
+            concert = Concert(
+                concert_id=concert_id,
+                artist_mbid=artist.artist_mbid,
+                venue_id=venue.venue_id,
+                concert_date=concert_date,
+                tour_name=tour_name,
+                last_updated=parse_last_updated(concert_data.get('lastUpdated'))
+            )
+            session.add(concert)
+
+            # Process setlist items
+            for song_position, (song_name, is_cover) in enumerate(songs, start=1):
+                setlist_item = SetlistItem(
+                    concert_id=concert_id,
+                    concert_date=concert_date,
+                    song_name=song_name,
+                    position_in_set=song_position,
+                    is_cover=is_cover
+                )
+                session.add(setlist_item)
+
+        stats["songs"] += len(songs)
+        if existing:
+            stats["updated"] += 1
+            if replaced is not None:
+                replaced.append(previous)
+            return changes.UPDATE
         stats["concerts"] += 1
-        return True
+        return changes.INSERT
 
     except Exception as e:
         logger.error(f"Error processing concert {concert_data.get('id')}: {e}")
         stats["skipped"] += 1
-        return False
+        return None
+
+
+def update_derived_data(session: Session, concert_ids: list) -> None:
+    """Refresh precomputed structures for concerts added in the current batch"""
+    session.flush()
+    similarity.index_concerts(session, concert_ids)
+    transitions.update_transitions(session, concert_ids)
+    summaries.queue_for_concerts(session, concert_ids)
+    sketches.update_sketches(session, concert_ids)
+
+
+def change_payload(rows: Iterable[tuple], updated_rows: Iterable[tuple] = (),
+                   replaced: Iterable[tuple] = ()) -> dict:
+    """NOTIFY payload from (artist_mbid, year, month, concerts) rows of new concerts.
+
+    Replaced concerts (edited upstream) are given as `updated_rows` (new
+    versions, same shape) and `replaced` ((artist_mbid, year, month) of the
+    old versions). They only mark artists and years as affected; `resync`
+    is set when an edit moved concerts to another month, since the
+    per-month counts of new concerts cannot express that.
+    """
+    artists = set()
+    years = set()
+    months: Counter = Counter()
+    for artist_mbid, year, month, count in rows:
+        artists.add(artist_mbid)
+        years.add(int(year))
+        months[(int(year), int(month))] += count
+
+    before: Counter = Counter()
+    after: Counter = Counter()
+    for artist_mbid, year, month in replaced:
+        artists.add(artist_mbid)
+        years.add(int(year))
+        before[(int(year), int(month))] += 1
+    for artist_mbid, year, month, count in updated_rows:
+        artists.add(artist_mbid)
+        years.add(int(year))
+        after[(int(year), int(month))] += count
+
+    payload = {
+        "artists": sorted(artists),
+        "years": sorted(years),
+        "months": [[year, month, count] for (year, month), count in sorted(months.items())]  # new concerts per month
+    }
+    if before != after:
+        payload["resync"] = True
+    return payload
+
+
+def concerts_by_month(session: Session, concert_ids: list) -> list:
+    """(artist_mbid, year, month, concerts) of the given concerts"""
+    if not concert_ids:
+        return []
+    year = extract('YEAR', Concert.concert_date)
+    month = extract('MONTH', Concert.concert_date)
+    return session.execute(
+        select(Concert.artist_mbid, year, month, func.count())
+        .where(Concert.concert_id.in_(concert_ids))
+        .group_by(Concert.artist_mbid, year, month)
+    ).all()
+
+
+def notify_changes(session: Session, concert_ids: list, updated_ids: Optional[list] = None,
+                   replaced: Optional[list] = None) -> None:
+    """Announce affected artists/years and new concerts per month to API listeners; delivered on commit.
+
+    `seq` is the change feed position the batch was recorded at, so listeners
+    can tell whether data derived earlier (the stats snapshot) includes it.
+    """
+    payload = change_payload(
+        concerts_by_month(session, concert_ids), concerts_by_month(session, updated_ids or []), replaced or []
+    )
+    payload["seq"] = changes.latest_seq(session)
+    session.execute(
+        text("SELECT pg_notify(:channel, :payload)"),
+        {"channel": CHANGES_CHANNEL, "payload": json.dumps(payload)}
+    )
 
 
-def process_data(concert_list: list) -> None:
-    """Process all concerts and load into database"""
+def commit_batch(session: Session, concert_ids: list, updated_ids: Optional[list] = None,
+                 replaced: Optional[list] = None) -> None:
+    """Commit a batch (new and replaced concerts) together with its derived data.
+
+    `replaced` holds the (artist_mbid, year, month) of the versions replaced by `updated_ids`.
+    """
+    updated_ids = updated_ids or []
+    if concert_ids or updated_ids:
+        update_derived_data(session, concert_ids + updated_ids)
+        changes.record_changes(session, concert_ids)
+        changes.record_changes(session, updated_ids, changes.UPDATE)
+        notify_changes(session, concert_ids, updated_ids, replaced)
+    session.commit()
+
+
+def iter_batches(records: Iterable[dict], size: int) -> Iterator[list]:
+    iterator = iter(records)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def batch_years(batch: list) -> set:
+    """Years of the records' event dates (invalid dates are skipped later by process_concert)"""
+    years = set()
+    for concert_data in batch:
+        try:
+            years.add(datetime.strptime(concert_data.get('eventDate') or '', "%d-%m-%Y").year)
+        except ValueError:
+            pass
+    return years
+
+
+def process_data(concert_list: Iterable[dict], total_concerts: Optional[int] = None) -> Dict[str, int]:
+    """Process all concerts and load into database; returns load statistics"""
     engine = get_engine()
     SessionLocal = sessionmaker(bind=engine)
 
-    stats = {"concerts": 0, "songs": 0, "skipped": 0}
-    total_concerts = len(concert_list)
+    stats = {"concerts": 0, "updated": 0, "songs": 0, "skipped": 0}
+    if total_concerts is None:
+        total_concerts = len(concert_list)
 
-    logger.info(f"Found {total_concerts} concerts in JSON file. Starting upload to database...")
+    logger.info(f"Found {total_concerts} concerts. Starting upload to database...")
 
     with SessionLocal() as session:
+        processed = 0
         try:
-            for index, concert_data in enumerate(concert_list):
-                success = process_concert(session, concert_data, stats)
-
-                # Commit in batches of 50 for better performance
-                if (index + 1) % 50 == 0:
-                    try:
-                        session.commit()
-                        logger.info(f"Processed {index + 1} / {total_concerts} concerts...")
-                    except SQLAlchemyError as e:
-                        logger.error(f"Commit error at batch {index + 1}: {e}")
-                        session.rollback()
-
-            # Final commit
-            session.commit()
-            logger.info("Final commit completed successfully")
+            for batch in iter_batches(concert_list, BATCH_SIZE):
+                # Before the batch transaction starts: creating a partition locks the
+                # parent tables, which must not stay locked until the batch commits
+                partitions.ensure_year_partitions(engine, batch_years(batch))
+
+                batch_ids, updated_ids, replaced = [], [], []
+                for concert_data in batch:
+                    operation = process_concert(session, concert_data, stats, replaced)
+                    if operation == changes.INSERT:
+                        batch_ids.append(concert_data['id'])
+                    elif operation == changes.UPDATE:
+                        updated_ids.append(concert_data['id'])
+
+                processed += len(batch)
+                try:
+                    commit_batch(session, batch_ids, updated_ids, replaced)
+                    logger.info(f"Processed {processed} / {total_concerts} concerts...")
+                except SQLAlchemyError as e:
+                    logger.error(f"Commit error at batch {processed}: {e}")
+                    session.rollback()
+
+            # Once per touched artist rather than per batch (see summaries.queue_artists)
+            refreshed = summaries.refresh_queued(session)
+            logger.info(f"Refreshed summaries of {refreshed} artists")
 
         except KeyboardInterrupt:
             logger.warning("Process interrupted by user. Rolling back current transaction...")
@@ -245,23 +501,44 @@ def process_data(concert_list: list) -> None:
         finally:
             logger.info("\n--- Upload completed ---")
             logger.info(f"Successfully imported: {stats['concerts']} concerts")
+            logger.info(f"Replaced edited concerts: {stats['updated']}")
             logger.info(f"Processed songs: {stats['songs']}")
             logger.info(f"Skipped due to errors/duplicates: {stats['skipped']}")
 
+    return stats
 
-def main():
-    """Main entry point"""
+
+def main(bulk: bool = False):
+    """Main entry point; `bulk` loads through COPY and staging tables (bulk_load.py)"""
+    DATA_DIR = "setlists_data"
     JSON_FILE_NAME = "all_setlists_filtered.json"
 
     logger.info("=== Starting data load process ===")
 
-    raw_data = load_data_from_json(JSON_FILE_NAME)
-    if raw_data:
-        process_data(raw_data)
+    manifest = load_manifest(DATA_DIR)
+    if manifest:
+        logger.info(f"Reading {len(manifest['shards'])} shards from '{DATA_DIR}'...")
+        records, total = iter_shard_records(DATA_DIR, manifest), manifest["total_records"]
+    else:
+        # Legacy single-file output of make_data.py
+        records = load_data_from_json(JSON_FILE_NAME)
+        if not records:
+            logger.error("Failed to load data from JSON file")
+            return
+        total = len(records)
+
+    if bulk:
+        import bulk_load
+        bulk_load.bulk_load(records)
     else:
-        logger.error("Failed to load data from JSON file")
+        stats = process_data(records, total)
+        if stats["updated"]:
+            # Retracting replaced setlists voids the sketches' error bound
+            logger.info("Rebuilding song sketches after replacing edited concerts...")
+            sketches.rebuild_sketches()
 
 
 if __name__ == "__main__":
+    setup_logging()
     main()
 
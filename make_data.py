@@ -1,103 +1,315 @@
 import requests
 import time
 import json
+import gzip
+import hashlib
+import os
 import logging
-from typing import List
-from pydantic import ValidationError
-from config import settings
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Set
+from pydantic import TypeAdapter, ValidationError
+from config import settings, setup_logging
 from api_schemas import ExternalSetlist
 
 logger = logging.getLogger(__name__)
-logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+setlists_adapter = TypeAdapter(List[ExternalSetlist])
+
+API_URL = "https://api.setlist.fm/rest/1.0"
+MBID_CACHE_FILE = "artist_mbids.json"  # kept in the output directory, like CRAWL_STATE_FILE
+MBID_MISS_TTL = 7 * 24 * 3600  # seconds before a name without a match is searched again
+CRAWL_STATE_FILE = "crawl_state.json"
+LAST_UPDATED_FORMAT = "%Y%m%d%H%M%S"
+
+
+class ShardWriter:
+    """Streams records into rotating gzip-compressed JSONL shards.
+
+    Closed shards are renamed into place and recorded in `manifest.json`
+    (record count, sha256, artist/year coverage), so a crash loses at most
+    the shard that is still open (and `checkpoint()` closes it early). With
+    `append`, shards listed in an existing manifest are kept (incremental crawls).
+    """
+
+    def __init__(self, output_dir: str, shard_size: int = 1000, prefix: str = "setlists",
+                 append: bool = False):
+        self.output_dir = output_dir
+        self.shard_size = shard_size
+        self.prefix = prefix
+        self.manifest_path = os.path.join(output_dir, "manifest.json")
+        self.shards = []
+        if append and os.path.exists(self.manifest_path):
+            # Keep the shards of earlier runs and number new ones after them
+            with open(self.manifest_path, "r", encoding="utf-8") as f:
+                self.shards = json.load(f)["shards"]
+        self._file = None
+        self._path = None
+        self._records = 0
+        self._coverage = None
+        os.makedirs(output_dir, exist_ok=True)
+
+    @property
+    def total_records(self) -> int:
+        return sum(shard["records"] for shard in self.shards) + self._records
+
+    def _open_shard(self):
+        name = f"{self.prefix}-{len(self.shards):05d}.jsonl.gz"
+        self._path = os.path.join(self.output_dir, name)
+        self._file = gzip.open(self._path + ".part", "wt", encoding="utf-8")
+        self._records = 0
+        self._coverage = defaultdict(lambda: defaultdict(int))
+
+    def write(self, records: list):
+        for record in records:
+            if self._file is None:
+                self._open_shard()
+
+            self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self._records += 1
+            year = record["eventDate"][-4:]
+            self._coverage[record["artist"]["name"]][year] += 1
+
+            if self._records >= self.shard_size:
+                self._close_shard()
+
+        if self._file is not None:
+            self._file.flush()  # sync flush keeps the open shard readable
+
+    def _close_shard(self):
+        self._file.close()
+        os.replace(self._path + ".part", self._path)
+
+        sha256 = hashlib.sha256()
+        with open(self._path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                sha256.update(block)
+
+        self.shards.append({
+            "file": os.path.basename(self._path),
+            "records": self._records,
+            "sha256": sha256.hexdigest(),
+            "coverage": {artist: dict(years) for artist, years in self._coverage.items()}
+        })
+        self._file = None
+        self._records = 0
+        self._write_manifest()
+        logger.info(f"Closed shard {self.shards[-1]['file']} ({self.shards[-1]['records']} records)")
+
+    def _write_manifest(self):
+        coverage = defaultdict(lambda: defaultdict(int))
+        for shard in self.shards:
+            for artist, years in shard["coverage"].items():
+                for year, count in years.items():
+                    coverage[artist][year] += count
+
+        manifest = {
+            "total_records": sum(shard["records"] for shard in self.shards),
+            "shards": self.shards,
+            "coverage": {artist: dict(sorted(years.items())) for artist, years in coverage.items()}
+        }
+        tmp_path = self.manifest_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2, ensure_ascii=False)
+        os.replace(tmp_path, self.manifest_path)
+
+    def checkpoint(self):
+        """Close the open shard so everything written so far survives a crash"""
+        if self._file is not None and self._records:
+            self._close_shard()
+
+    def close(self):
+        if self._file is not None and self._records:
+            self._close_shard()
+        elif self._file is not None:
+            self._file.close()
+            os.remove(self._path + ".part")
+            self._file = None
+        logger.info(f"Saved {self.total_records} objects to {len(self.shards)} shards in {self.output_dir}")
+
 
 def validate_and_filter(raw_setlists: list, european_filter: set) -> list:
-    """Validate raw data through Pydantic and filter by countries"""
-    valid_data = []
-    for item in raw_setlists:
-        try:
-            obj = ExternalSetlist.model_validate(item)
-            if obj.venue.city.country.code in european_filter:
-                valid_data.append(obj.model_dump())
-        except ValidationError as e:
-            logger.debug(f"Object {item.get('id')} failed validation: {e.json()}")
-            continue
-    return valid_data
+    """Validate raw data through Pydantic in one batch and filter by countries"""
+    try:
+        setlists = setlists_adapter.validate_python(raw_setlists)
+    except ValidationError as e:
+        bad_indexes = {error["loc"][0] for error in e.errors() if error["loc"]}
+        for index in sorted(bad_indexes):
+            logger.debug(f"Object {raw_setlists[index].get('id')} failed validation")
+        raw_setlists = [item for index, item in enumerate(raw_setlists) if index not in bad_indexes]
+        setlists = setlists_adapter.validate_python(raw_setlists)
+
+    european = [obj for obj in setlists if obj.venue.city.country.code in european_filter]
+    return setlists_adapter.dump_python(european)
+
+
+class CollectionError(Exception):
+    """A request failed for a reason other than rate limiting"""
 
-def fetch_artist_year_data(artist: str, year: int, european_filter: set):
-    """Fetch data from API with pagination and validation"""
-    all_filtered = []
-    current_page = 1
-    total_pages = 1
 
-    search_url = "https://api.setlist.fm/rest/1.0/search/setlists"
+def api_get(path: str, params: dict) -> Optional[dict]:
+    """GET an API resource, waiting out rate limits; None when nothing matches (404)"""
     headers = {
         "x-api-key": settings.setlist_api_key,
         "Accept": "application/json"
     }
-
-    while current_page <= total_pages:
-        params = {"artistName": artist, "year": year, "p": current_page}
+    while True:
         try:
-            response = requests.get(search_url, headers=headers, params=params, timeout=10)
+            response = requests.get(f"{API_URL}{path}", headers=headers, params=params, timeout=10)
+        except requests.exceptions.RequestException as e:
+            raise CollectionError(f"Network error: {e}") from e
 
-            if response.status_code == 429:
-                logger.warning(f"Rate limit hit. Sleeping 10s... [{artist}, {year}]")
-                time.sleep(10)
-                continue
+        if response.status_code == 429:
+            logger.warning(f"Rate limit hit. Sleeping 10s... [{path} {params}]")
+            time.sleep(10)
+            continue
+        if response.status_code == 404:
+            return None
+        if response.status_code != 200:
+            raise CollectionError(f"Error {response.status_code} for {path} {params}")
+        return response.json()
 
-            if response.status_code != 200:
-                logger.error(f"Error {response.status_code} for {artist} on page {current_page}")
-                break
 
-            data = response.json()
+def read_json(path: str, default):
+    if not os.path.exists(path):
+        return default
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
 
-            if current_page == 1:
-                total_items = data.get('total', 0)
-                if total_items == 0:
-                    break
-                items_per_page = data.get('itemsPerPage', 20)
-                total_pages = (total_items + items_per_page - 1) // items_per_page
-                logger.info(f"Found {total_items} shows: {artist} ({year})")
 
-            raw_page_data = data.get('setlist', [])
-            filtered_page = validate_and_filter(raw_page_data, european_filter)
-            all_filtered.extend(filtered_page)
+def write_json(path: str, data) -> None:
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2, ensure_ascii=False)
+    os.replace(tmp_path, path)
 
-            current_page += 1
-            time.sleep(1)
 
-        except requests.exceptions.RequestException as e:
-            logger.error(f"Network error: {e}")
+def resolve_mbid(artist: str, mbid_cache: Dict[str, Any], cache_path: str,
+                 now: Optional[float] = None) -> Optional[str]:
+    """Artist name -> MusicBrainz ID, looked up once and kept in `cache_path`.
+
+    Names without an exact match are remembered as well and only searched
+    again after MBID_MISS_TTL, instead of costing an API call on every run.
+    """
+    now = time.time() if now is None else now
+    cached = mbid_cache.get(artist)
+    if isinstance(cached, str):
+        return cached
+    if cached is not None and now - cached["missed_at"] < MBID_MISS_TTL:
+        return None
+
+    data = api_get("/search/artists", {"artistName": artist, "sort": "relevance"})
+    candidates = data.get("artist", []) if data else []
+    # Prefer the exact name over tribute bands and similarly named acts
+    match = next((c for c in candidates if c.get("name", "").casefold() == artist.casefold()), None)
+    if match is None:
+        logger.warning(f"No exact MusicBrainz match for '{artist}'")
+        mbid_cache[artist] = {"missed_at": now}
+        write_json(cache_path, mbid_cache)
+        return None
+
+    mbid_cache[artist] = match["mbid"]
+    write_json(cache_path, mbid_cache)
+    logger.info(f"Resolved {artist} -> {match['mbid']}")
+    return match["mbid"]
+
+
+def fetch_setlists(params: dict, label: str, european_filter: set, writer: ShardWriter,
+                   years: Optional[Set[str]] = None) -> int:
+    """Page through setlist search results, streaming valid European setlists to `writer`.
+
+    `years` (as "YYYY") keeps only setlists of those years, for queries without a year filter.
+    """
+    written = 0
+    current_page = 1
+    total_pages = 1
+
+    while current_page <= total_pages:
+        data = api_get("/search/setlists", {**params, "p": current_page})
+        if data is None:
             break
 
-    return all_filtered
+        if current_page == 1:
+            total_items = data.get('total', 0)
+            if total_items == 0:
+                break
+            items_per_page = data.get('itemsPerPage', 20)
+            total_pages = (total_items + items_per_page - 1) // items_per_page
+            logger.info(f"Found {total_items} shows: {label}")
+
+        raw_page_data = data.get('setlist', [])
+        if years is not None:
+            raw_page_data = [item for item in raw_page_data if item.get('eventDate', '')[-4:] in years]
+        filtered_page = validate_and_filter(raw_page_data, european_filter)
+        writer.write(filtered_page)
+        written += len(filtered_page)
+
+        current_page += 1
+        time.sleep(1)
+
+    return written
 
-def save_to_json(data: list, filename: str):
-    try:
-        with open(filename, "w", encoding="utf-8") as f:
-            json.dump(data, f, indent=2, ensure_ascii=False)
-        logger.info(f"Saved {len(data)} objects to {filename}")
-    except Exception:
-        logger.exception("Error saving JSON")
 
-def main():
+def fetch_artist_year_data(artist: str, year: int, european_filter: set, writer: ShardWriter,
+                           mbid: Optional[str] = None) -> int:
+    """Fetch one artist-year; by mbid when known, otherwise by free-text name"""
+    params = {"artistMbid": mbid} if mbid else {"artistName": artist}
+    return fetch_setlists({**params, "year": year}, f"{artist} ({year})", european_filter, writer)
+
+
+def fetch_artist_updates(artist: str, mbid: str, since: str, years: Set[int],
+                         european_filter: set, writer: ShardWriter) -> int:
+    """Fetch setlists of an artist created or edited since `since` (one query for all years)"""
+    params = {"artistMbid": mbid, "lastUpdated": since}
+    return fetch_setlists(params, f"{artist} (updated since {since})", european_filter, writer,
+                          {str(year) for year in years})
+
+
+def main(incremental: bool = False):
+    """Collect setlists; `incremental` only fetches setlists changed since the last successful run"""
     target_artists = ["Metallica", "Korn", "Slipknot", "Rammstein", "System of a Down"]
     target_years = list(range(2020, 2025))
     eu_countries = {"DE", "PL", "FR", "IT", "ES", "GB", "NL", "BE", "UA"}
 
-    collected_data = []
-    output_file = "all_setlists_filtered.json"
+    output_dir = "setlists_data"
+    state_path = os.path.join(output_dir, CRAWL_STATE_FILE)
+    since = read_json(state_path, {}).get("last_success") if incremental else None
+    if incremental and since is None:
+        logger.warning("No successful run recorded yet, collecting everything")
+
+    mbid_path = os.path.join(output_dir, MBID_CACHE_FILE)
+    # Older versions kept the cache in the working directory
+    mbid_cache = read_json(mbid_path, None) or read_json(MBID_CACHE_FILE, {})
+    started = datetime.now(timezone.utc).strftime(LAST_UPDATED_FORMAT)
+    writer = ShardWriter(output_dir, append=since is not None)
+    failures = 0
 
     logger.info("--- START WORK ---")
     try:
         for artist in target_artists:
-            for year in target_years:
-                results = fetch_artist_year_data(artist, year, eu_countries)
-                collected_data.extend(results)
+            try:
+                mbid = resolve_mbid(artist, mbid_cache, mbid_path)
+                if since is not None and mbid:
+                    fetch_artist_updates(artist, mbid, since, set(target_years), eu_countries, writer)
+                    continue
+                for year in target_years:
+                    fetch_artist_year_data(artist, year, eu_countries, writer, mbid)
+            except CollectionError as e:
+                logger.error(f"{artist}: {e}")
+                failures += 1
+            # A full crawl is smaller than one shard: don't keep it all in the open one
+            writer.checkpoint()
     except KeyboardInterrupt:
         logger.warning("Collection interrupted. Saving progress...")
+        failures += 1
     finally:
-        save_to_json(collected_data, output_file)
+        writer.close()
+
+    if failures:
+        logger.warning(f"{failures} artists failed; the next incremental run starts from the previous one")
+    else:
+        write_json(state_path, {"last_success": started})
 
 if __name__ == "__main__":
+    setup_logging()
     main()
@@ -1,6 +1,10 @@
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
-from sqlalchemy import String, ForeignKey, Date, Integer, Boolean, UniqueConstraint
-from datetime import date
+from sqlalchemy.dialects.postgresql import ARRAY, JSONB
+from sqlalchemy import (
+    String, ForeignKey, ForeignKeyConstraint, Date, DateTime, Integer, SmallInteger, BigInteger, Boolean,
+    LargeBinary, Float, UniqueConstraint, Identity, func, event, DDL
+)
+from datetime import date, datetime
 from typing import List, Optional
 
 
@@ -38,6 +42,8 @@ class City(Base):
     city_id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     city_name: Mapped[str] = mapped_column(String, nullable=False)
     country_code: Mapped[str] = mapped_column(ForeignKey("countries.country_code"), nullable=False)
+    latitude: Mapped[Optional[float]] = mapped_column(Float, nullable=True)
+    longitude: Mapped[Optional[float]] = mapped_column(Float, nullable=True)
 
     country: Mapped["Country"] = relationship(back_populates="cities")
     venues: Mapped[List["Venue"]] = relationship(back_populates="city", cascade="all, delete-orphan")
@@ -69,27 +75,81 @@ class Venue(Base):
 
 
 class Concert(Base):
+    """Range-partitioned by concert year (see partitions.py); the partition key
+    has to be part of the primary key, so concert_id uniqueness is enforced
+    through ConcertId."""
     __tablename__ = "concerts"
 
     concert_id: Mapped[str] = mapped_column(String, primary_key=True)
     artist_mbid: Mapped[str] = mapped_column(ForeignKey("artists.artist_mbid"), nullable=False)
-    venue_id: Mapped[int] = mapped_column(ForeignKey("venues.venue_id"), nullable=False)
-    concert_date: Mapped[date] = mapped_column(Date, nullable=False)
+    venue_id: Mapped[int] = mapped_column(ForeignKey("venues.venue_id"), nullable=False, index=True)
+    concert_date: Mapped[date] = mapped_column(Date, primary_key=True)
     tour_name: Mapped[Optional[str]] = mapped_column(String, nullable=True)
+    # Setlist.fm edit time; a re-fetched setlist only replaces the row when newer
+    last_updated: Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True), nullable=True)
 
     artist: Mapped["Artist"] = relationship(back_populates="concerts")
     venue: Mapped["Venue"] = relationship(back_populates="concerts")
     setlist_items: Mapped[List["SetlistItem"]] = relationship(back_populates="concert", cascade="all, delete-orphan")
 
+    __table_args__ = (
+        {"postgresql_partition_by": "RANGE (concert_date)"},
+    )
+
     def __repr__(self) -> str:
         return f"<Concert(id={self.concert_id}, date={self.concert_date}, artist={self.artist_mbid})>"
 
 
+class ConcertId(Base):
+    """One row per concert_id, kept in sync by a trigger on concerts.
+
+    Not partitioned, so its primary key makes concert_id unique across all
+    concert partitions, whichever loader writes them.
+    """
+    __tablename__ = "concert_ids"
+
+    concert_id: Mapped[str] = mapped_column(String, primary_key=True)
+
+    def __repr__(self) -> str:
+        return f"<ConcertId({self.concert_id})>"
+
+
+# AFTER row triggers work on partitioned tables; a row moved to another
+# partition fires DELETE then INSERT. A duplicate id fails the statement
+# with a unique violation on concert_ids_pkey.
+CONCERT_ID_GUARD = [
+    """
+    CREATE OR REPLACE FUNCTION guard_concert_id() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP IN ('DELETE', 'UPDATE') THEN
+            DELETE FROM concert_ids WHERE concert_id = OLD.concert_id;
+        END IF;
+        IF TG_OP IN ('INSERT', 'UPDATE') THEN
+            INSERT INTO concert_ids (concert_id) VALUES (NEW.concert_id);
+        END IF;
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    "DROP TRIGGER IF EXISTS concerts_unique_id ON concerts",
+    """
+    CREATE TRIGGER concerts_unique_id
+    AFTER INSERT OR DELETE OR UPDATE OF concert_id ON concerts
+    FOR EACH ROW EXECUTE FUNCTION guard_concert_id()
+    """,
+]
+
+for statement in CONCERT_ID_GUARD:
+    event.listen(Concert.__table__, "after_create", DDL(statement))
+
+
 class SetlistItem(Base):
+    """Partitioned like concerts; concert_date is copied from the concert"""
     __tablename__ = "setlistitems"
 
     item_id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
-    concert_id: Mapped[str] = mapped_column(ForeignKey("concerts.concert_id"), nullable=False)
+    concert_id: Mapped[str] = mapped_column(String, nullable=False)
+    concert_date: Mapped[date] = mapped_column(Date, primary_key=True)
     song_name: Mapped[str] = mapped_column(String, nullable=False)
     position_in_set: Mapped[int] = mapped_column(Integer, nullable=False)
     is_cover: Mapped[bool] = mapped_column(Boolean, default=False, nullable=False)
@@ -97,8 +157,117 @@ class SetlistItem(Base):
     concert: Mapped["Concert"] = relationship(back_populates="setlist_items")
 
     __table_args__ = (
-        UniqueConstraint("concert_id", "position_in_set", name="uq_concert_position"),
+        ForeignKeyConstraint(
+            ["concert_id", "concert_date"], ["concerts.concert_id", "concerts.concert_date"],
+            name="fk_setlistitem_concert"
+        ),
+        UniqueConstraint("concert_id", "concert_date", "position_in_set", name="uq_concert_position"),
+        {"postgresql_partition_by": "RANGE (concert_date)"},
     )
 
     def __repr__(self) -> str:
         return f"<SetlistItem(id={self.item_id}, concert={self.concert_id}, song={self.song_name}, pos={self.position_in_set})>"
+
+
+class ConcertChange(Base):
+    """Append-only feed of loaded concerts, ordered by change_seq (see changes.py).
+
+    No foreign key: concerts is partitioned and its primary key includes the date.
+    """
+    __tablename__ = "concert_changes"
+
+    change_seq: Mapped[int] = mapped_column(BigInteger, Identity(always=True), primary_key=True)
+    concert_id: Mapped[str] = mapped_column(String, nullable=False, index=True)
+    artist_mbid: Mapped[str] = mapped_column(String, nullable=False)
+    operation: Mapped[str] = mapped_column(String(10), nullable=False)
+    changed_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False, server_default=func.now())
+
+    def __repr__(self) -> str:
+        return f"<ConcertChange(seq={self.change_seq}, concert={self.concert_id}, {self.operation})>"
+
+
+class ConcertSignature(Base):
+    """MinHash signature of a concert setlist (see similarity.py).
+
+    Derived data maintained by the loader, so no FK to the partitioned concerts table.
+    """
+    __tablename__ = "concert_signatures"
+
+    concert_id: Mapped[str] = mapped_column(String, primary_key=True)
+    signature: Mapped[bytes] = mapped_column(LargeBinary, nullable=False)
+    song_count: Mapped[int] = mapped_column(Integer, nullable=False)
+
+    def __repr__(self) -> str:
+        return f"<ConcertSignature(concert={self.concert_id}, songs={self.song_count})>"
+
+
+class SetlistBucket(Base):
+    """LSH band bucket: concerts sharing a (band, bucket_hash) pair are similarity candidates"""
+    __tablename__ = "setlist_lsh_buckets"
+
+    band: Mapped[int] = mapped_column(SmallInteger, primary_key=True)
+    bucket_hash: Mapped[int] = mapped_column(BigInteger, primary_key=True)
+    concert_id: Mapped[str] = mapped_column(String, primary_key=True, index=True)
+
+    def __repr__(self) -> str:
+        return f"<SetlistBucket(band={self.band}, hash={self.bucket_hash}, concert={self.concert_id})>"
+
+
+class SongTransition(Base):
+    """Per-artist count of setlists where to_song directly followed from_song"""
+    __tablename__ = "song_transitions"
+
+    artist_mbid: Mapped[str] = mapped_column(ForeignKey("artists.artist_mbid", ondelete="CASCADE"), primary_key=True)
+    from_song: Mapped[str] = mapped_column(String, primary_key=True)
+    to_song: Mapped[str] = mapped_column(String, primary_key=True)
+    count: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+
+    def __repr__(self) -> str:
+        return f"<SongTransition(artist={self.artist_mbid}, {self.from_song} -> {self.to_song}, count={self.count})>"
+
+
+class SongSketch(Base):
+    """Space-Saving top-songs sketch of one slice: "global", "artist:<mbid>" or "year:<yyyy>" (see sketches.py).
+
+    A slice is striped over up to `sketches.SHARDS` rows so that concurrent
+    loaders write different rows; readers merge them.
+    """
+    __tablename__ = "song_sketches"
+
+    scope: Mapped[str] = mapped_column(String, primary_key=True)
+    shard: Mapped[int] = mapped_column(SmallInteger, primary_key=True, default=0)
+    capacity: Mapped[int] = mapped_column(Integer, nullable=False)
+    total: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0)
+    counters: Mapped[dict] = mapped_column(JSONB, nullable=False, default=dict)  # song -> [count, error]
+
+    def __repr__(self) -> str:
+        return f"<SongSketch(scope={self.scope}, total={self.total}, counters={len(self.counters)})>"
+
+
+class ArtistSummaryQueue(Base):
+    """Artists whose summary is out of date; the loader appends, summaries.refresh_queued() drains"""
+    __tablename__ = "artist_summary_queue"
+
+    queue_id: Mapped[int] = mapped_column(BigInteger, Identity(), primary_key=True)
+    artist_mbid: Mapped[str] = mapped_column(String, nullable=False)
+
+    def __repr__(self) -> str:
+        return f"<ArtistSummaryQueue(id={self.queue_id}, artist={self.artist_mbid})>"
+
+
+class ArtistSummary(Base):
+    """Precomputed per-artist aggregates, refreshed at the end of a load for touched artists (see summaries.py)"""
+    __tablename__ = "artist_summaries"
+
+    artist_mbid: Mapped[str] = mapped_column(ForeignKey("artists.artist_mbid", ondelete="CASCADE"), primary_key=True)
+    concert_count: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    songs_played: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    distinct_songs: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    cover_ratio: Mapped[float] = mapped_column(Float, nullable=False, default=0.0)
+    countries: Mapped[List[str]] = mapped_column(ARRAY(String), nullable=False, default=list)
+    top_songs: Mapped[list] = mapped_column(JSONB, nullable=False, default=list)
+    first_show: Mapped[Optional[date]] = mapped_column(Date, nullable=True)
+    last_show: Mapped[Optional[date]] = mapped_column(Date, nullable=True)
+
+    def __repr__(self) -> str:
+        return f"<ArtistSummary(artist={self.artist_mbid}, concerts={self.concert_count})>"
@@ -0,0 +1,169 @@
+import logging
+import time
+from typing import Iterable, Set
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.exc import DBAPIError
+
+from models import Concert, ConcertId, SetlistItem, CONCERT_ID_GUARD
+
+logger = logging.getLogger(__name__)
+
+# Fact tables range-partitioned by concert year
+PARTITIONED_TABLES = ("concerts", "setlistitems")
+
+# Years whose partitions were committed by this process
+_known_years: Set[int] = set()
+
+# How long partition DDL may wait for the parent tables' lock before retrying
+PARTITION_LOCK_TIMEOUT_MS = 2000
+
+
+def partition_name(table: str, year: int) -> str:
+    return f"{table}_y{year}"
+
+
+def partition_ddl(table: str, year: int) -> str:
+    return (
+        f"CREATE TABLE IF NOT EXISTS {partition_name(table, year)} PARTITION OF {table} "
+        f"FOR VALUES FROM ('{year}-01-01') TO ('{year + 1}-01-01')"
+    )
+
+
+def _create_year_partitions(bind, year: int) -> None:
+    for table in PARTITIONED_TABLES:
+        bind.execute(text(partition_ddl(table, year)))
+
+
+def ensure_year_partitions(engine: Engine, years: Iterable[int], attempts: int = 5) -> None:
+    """Create missing yearly partitions before rows for those years are inserted.
+
+    Runs in its own short transaction, outside the caller's: creating a
+    partition takes an ACCESS EXCLUSIVE lock on the parent table, blocking
+    every read of it until commit. `lock_timeout` keeps the DDL from queueing
+    behind a long read (e.g. an export) and blocking all later reads with it;
+    it retries instead.
+    """
+    missing = sorted(set(years) - _known_years)
+    if not missing:
+        return
+
+    for attempt in range(1, attempts + 1):
+        try:
+            with engine.begin() as connection:
+                connection.execute(text(f"SET LOCAL lock_timeout = {PARTITION_LOCK_TIMEOUT_MS}"))
+                for year in missing:
+                    _create_year_partitions(connection, year)
+            break
+        except DBAPIError as e:
+            if attempt == attempts:
+                raise
+            logger.warning(f"Creating partitions for {missing} failed ({e}), retrying...")
+            time.sleep(attempt)
+
+    # Only committed partitions are remembered, so a rolled back batch never leaves the cache stale
+    _known_years.update(missing)
+    logger.info(f"Ensured partitions for years {missing}")
+
+
+def reset_known_years() -> None:
+    """Forget ensured partitions (e.g. after the tables were dropped and recreated)"""
+    _known_years.clear()
+
+
+MIGRATION_RENAMES = [
+    "ALTER TABLE setlistitems RENAME TO setlistitems_old",
+    "ALTER TABLE concerts RENAME TO concerts_old",
+    # Index-backed constraint names are schema-wide, free them for the new tables
+    "ALTER TABLE setlistitems_old RENAME CONSTRAINT setlistitems_pkey TO setlistitems_old_pkey",
+    "ALTER TABLE setlistitems_old RENAME CONSTRAINT uq_concert_position TO uq_concert_position_old",
+    "ALTER TABLE concerts_old RENAME CONSTRAINT concerts_pkey TO concerts_old_pkey",
+    # Created by `python geo.py` when it runs before this migration
+    "ALTER INDEX IF EXISTS ix_concerts_venue_id RENAME TO ix_concerts_old_venue_id",
+    # Derived tables lose their FKs: concerts.concert_id alone is no longer unique
+    "ALTER TABLE IF EXISTS concert_signatures DROP CONSTRAINT IF EXISTS concert_signatures_concert_id_fkey",
+    "ALTER TABLE IF EXISTS setlist_lsh_buckets DROP CONSTRAINT IF EXISTS setlist_lsh_buckets_concert_id_fkey",
+]
+
+MIGRATION_COPY = [
+    # Present when `python changes.py` ran first; added so the copy works either way
+    "ALTER TABLE concerts_old ADD COLUMN IF NOT EXISTS last_updated TIMESTAMPTZ",
+    """
+    INSERT INTO concerts (concert_id, artist_mbid, venue_id, concert_date, tour_name, last_updated)
+    SELECT concert_id, artist_mbid, venue_id, concert_date, tour_name, last_updated FROM concerts_old
+    """,
+    """
+    INSERT INTO setlistitems (item_id, concert_id, concert_date, song_name, position_in_set, is_cover)
+    SELECT s.item_id, s.concert_id, c.concert_date, s.song_name, s.position_in_set, s.is_cover
+    FROM setlistitems_old s
+    JOIN concerts_old c ON c.concert_id = s.concert_id
+    """,
+    """
+    SELECT setval(pg_get_serial_sequence('setlistitems', 'item_id'), COALESCE(MAX(item_id), 0) + 1, false)
+    FROM setlistitems
+    """,
+    "DROP TABLE setlistitems_old",
+    "DROP TABLE concerts_old",
+]
+
+
+def is_partitioned(connection: Connection) -> bool:
+    return bool(connection.scalar(text(
+        "SELECT 1 FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid "
+        "WHERE c.relname = 'concerts'"
+    )))
+
+
+def install_concert_id_guard(connection: Connection) -> None:
+    """Add the concert_ids uniqueness guard to partitioned tables created before it existed"""
+    ConcertId.__table__.create(connection, checkfirst=True)
+    duplicates = connection.scalars(text(
+        "SELECT concert_id FROM concerts GROUP BY concert_id HAVING COUNT(*) > 1 LIMIT 10"
+    )).all()
+    if duplicates:
+        raise RuntimeError(f"Duplicate concert ids must be removed first, e.g. {duplicates}")
+
+    connection.execute(text(
+        "INSERT INTO concert_ids (concert_id) SELECT concert_id FROM concerts ON CONFLICT DO NOTHING"
+    ))
+    for statement in CONCERT_ID_GUARD:
+        connection.execute(text(statement))
+    logger.info("Concert id guard installed")
+
+
+def migrate(connection: Connection) -> None:
+    """Convert plain concerts/setlistitems tables into year-partitioned ones"""
+    if is_partitioned(connection):
+        logger.info("Tables are already partitioned")
+        install_concert_id_guard(connection)
+        return
+
+    for statement in MIGRATION_RENAMES:
+        connection.execute(text(statement))
+
+    # Created with the partitioned concerts table, its trigger fills concert_ids during the copy
+    ConcertId.__table__.create(connection, checkfirst=True)
+    Concert.__table__.create(connection)
+    SetlistItem.__table__.create(connection)
+
+    years = connection.scalars(text(
+        "SELECT DISTINCT EXTRACT(YEAR FROM concert_date)::INT FROM concerts_old ORDER BY 1"
+    )).all()
+    for year in years:
+        _create_year_partitions(connection, year)
+    logger.info(f"Created partitions for {len(years)} years")
+
+    for statement in MIGRATION_COPY:
+        connection.execute(text(statement))
+
+    logger.info("Migration to partitioned tables completed")
+
+
+if __name__ == "__main__":
+    from config import setup_logging
+    from load_to_db import get_engine
+
+    setup_logging()
+    with get_engine().begin() as conn:
+        migrate(conn)
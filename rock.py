@@ -0,0 +1,142 @@
+"""Unified command line entry point: init-db, collect, load, report, serve.
+
+Only argparse is imported up front; each subcommand imports the modules
+(and heavy dependencies) it needs when it runs, so `--help` and small
+tasks start quickly.
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+_STARTED = time.perf_counter()
+
+COMMANDS = ("init-db", "collect", "load", "report", "serve", "snapshot")
+
+
+def _ready(args) -> bool:
+    """Report import time; returns False when only startup is being measured"""
+    if args.import_only or args.timings:
+        elapsed_ms = (time.perf_counter() - _STARTED) * 1000
+        print(f"[rock] {args.command}: ready in {elapsed_ms:.0f} ms", file=sys.stderr)
+    return not args.import_only
+
+
+def cmd_init_db(args):
+    from config import setup_logging
+    import load_to_db
+
+    if _ready(args):
+        setup_logging()
+        load_to_db.init_db()
+
+
+def cmd_collect(args):
+    from config import setup_logging
+    import make_data
+
+    if _ready(args):
+        setup_logging()
+        make_data.main(incremental=args.incremental)
+
+
+def cmd_load(args):
+    from config import setup_logging
+    import load_to_db
+
+    if _ready(args):
+        setup_logging()
+        load_to_db.main(bulk=args.bulk)
+
+
+def cmd_report(args):
+    import analytics
+
+    if _ready(args):
+        analytics.create_seaborn_report()
+
+
+def cmd_snapshot(args):
+    from config import setup_logging
+    import snapshot
+
+    if _ready(args):
+        setup_logging()
+        snapshot.build()
+
+
+def cmd_serve(args):
+    import uvicorn
+
+    if args.import_only:
+        import api_main  # noqa: F401  (what each worker imports on boot)
+    if _ready(args):
+        uvicorn.run("api_main:app", host=args.host, port=args.port, workers=args.workers, reload=args.reload)
+
+
+def cmd_startup(args):
+    """Measure cold start of every subcommand in fresh interpreters"""
+    print(f"{'command':<10}{'min ms':>10}{'median ms':>12}")
+    for command in COMMANDS:
+        samples = []
+        for _ in range(args.repeat):
+            started = time.perf_counter()
+            result = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "--import-only", command],
+                capture_output=True, text=True
+            )
+            elapsed = (time.perf_counter() - started) * 1000
+            if result.returncode != 0:
+                print(f"{command:<10}{'failed':>10}  {result.stderr.strip().splitlines()[-1:]}")
+                break
+            samples.append(elapsed)
+        else:
+            samples.sort()
+            print(f"{command:<10}{samples[0]:>10.0f}{samples[len(samples) // 2]:>12.0f}")
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="rock", description="Rock Scene Europe data platform")
+    parser.add_argument("--timings", action="store_true", help="print subcommand startup time")
+    parser.add_argument("--import-only", action="store_true", help=argparse.SUPPRESS)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    subparsers.add_parser(
+        "init-db", help="create the database tables (once, before the first load)"
+    ).set_defaults(func=cmd_init_db)
+
+    collect = subparsers.add_parser("collect", help="collect setlists from Setlist.fm")
+    collect.add_argument("--incremental", action="store_true",
+                         help="only fetch setlists updated since the last successful collection")
+    collect.set_defaults(func=cmd_collect)
+    load = subparsers.add_parser("load", help="load collected setlists into PostgreSQL")
+    load.add_argument("--bulk", action="store_true", help="load through binary COPY into staging tables")
+    load.set_defaults(func=cmd_load)
+    subparsers.add_parser("report", help="generate the PDF analytics report").set_defaults(func=cmd_report)
+
+    subparsers.add_parser(
+        "snapshot", help="rebuild the shared stats snapshot served by API workers"
+    ).set_defaults(func=cmd_snapshot)
+
+    serve = subparsers.add_parser("serve", help="run the API server")
+    serve.add_argument("--host", default="0.0.0.0")
+    serve.add_argument("--port", type=int, default=8001)
+    serve.add_argument("--workers", type=int, default=1)
+    serve.add_argument("--reload", action="store_true")
+    serve.set_defaults(func=cmd_serve)
+
+    startup = subparsers.add_parser("startup", help="measure cold-start time of each subcommand")
+    startup.add_argument("--repeat", type=int, default=5)
+    startup.set_defaults(func=cmd_startup)
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+import hashlib
+import logging
+import random
+from array import array
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from sqlalchemy import select, delete, insert
+from sqlalchemy.orm import Session
+
+from models import Concert, SetlistItem, ConcertSignature, SetlistBucket
+
+logger = logging.getLogger(__name__)
+
+# 64 permutations split into 16 bands of 4 rows: concerts with Jaccard >= ~0.5
+# share at least one bucket with high probability
+NUM_PERM = 64
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+
+# Upper bound of candidates scored per query, keeps lookups constant time
+MAX_CANDIDATES = 200
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+
+_rng = random.Random(1337)
+_PERMUTATIONS = [
+    (_rng.randint(1, _MERSENNE_PRIME - 1), _rng.randint(0, _MERSENNE_PRIME - 1))
+    for _ in range(NUM_PERM)
+]
+
+
+def _hash_token(token: str) -> int:
+    return int.from_bytes(hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def normalize_song(song_name: str) -> str:
+    return " ".join(song_name.lower().split())
+
+
+def compute_signature(songs: Iterable[str]) -> Optional[List[int]]:
+    """MinHash signature of a setlist treated as a set of songs"""
+    hashes = {_hash_token(normalize_song(name)) for name in songs if name}
+    if not hashes:
+        return None
+
+    return [
+        min(((a * h + b) % _MERSENNE_PRIME) & _MAX_HASH for h in hashes)
+        for a, b in _PERMUTATIONS
+    ]
+
+
+def pack_signature(signature: Sequence[int]) -> bytes:
+    return array("I", signature).tobytes()
+
+
+def unpack_signature(data: bytes) -> List[int]:
+    values = array("I")
+    values.frombytes(data)
+    return values.tolist()
+
+
+def band_hashes(signature: Sequence[int]) -> List[Tuple[int, int]]:
+    """(band, bucket_hash) pairs; bucket_hash fits a signed BIGINT column"""
+    result = []
+    for band in range(BANDS):
+        chunk = array("I", signature[band * ROWS:(band + 1) * ROWS]).tobytes()
+        digest = hashlib.blake2b(chunk, digest_size=8).digest()
+        result.append((band, int.from_bytes(digest, "little", signed=True)))
+    return result
+
+
+def estimate_similarity(sig_a: Sequence[int], sig_b: Sequence[int]) -> float:
+    """Estimated Jaccard similarity of two setlists"""
+    return sum(1 for a, b in zip(sig_a, sig_b) if a == b) / NUM_PERM
+
+
+def index_concerts(session: Session, concert_ids: Sequence[str]) -> int:
+    """(Re)build signatures and LSH buckets for the given concerts.
+
+    Runs inside the caller's transaction, so the loader commits it together
+    with the batch it belongs to.
+    """
+    if not concert_ids:
+        return 0
+
+    songs: Dict[str, List[str]] = defaultdict(list)
+    rows = session.execute(
+        select(SetlistItem.concert_id, SetlistItem.song_name)
+        .where(SetlistItem.concert_id.in_(concert_ids))
+    )
+    for concert_id, song_name in rows:
+        songs[concert_id].append(song_name)
+
+    session.execute(delete(SetlistBucket).where(SetlistBucket.concert_id.in_(concert_ids)))
+    session.execute(delete(ConcertSignature).where(ConcertSignature.concert_id.in_(concert_ids)))
+
+    signature_rows = []
+    bucket_rows = []
+    for concert_id, names in songs.items():
+        signature = compute_signature(names)
+        if signature is None:
+            continue
+        signature_rows.append({
+            "concert_id": concert_id,
+            "signature": pack_signature(signature),
+            "song_count": len(names)
+        })
+        bucket_rows.extend(
+            {"band": band, "bucket_hash": bucket_hash, "concert_id": concert_id}
+            for band, bucket_hash in band_hashes(signature)
+        )
+
+    if signature_rows:
+        session.execute(insert(ConcertSignature), signature_rows)
+        session.execute(insert(SetlistBucket), bucket_rows)
+
+    return len(signature_rows)
+
+
+def rebuild_index(chunk_size: int = 500) -> None:
+    """Index every concert in the database (initial backfill)"""
+    from sqlalchemy.orm import sessionmaker
+    from load_to_db import get_engine
+
+    engine = get_engine()
+    ConcertSignature.__table__.create(engine, checkfirst=True)
+    SetlistBucket.__table__.create(engine, checkfirst=True)
+    SessionLocal = sessionmaker(bind=engine)
+
+    with SessionLocal() as session:
+        concert_ids = session.scalars(select(Concert.concert_id).order_by(Concert.concert_id)).all()
+        logger.info(f"Indexing {len(concert_ids)} concerts...")
+
+        indexed = 0
+        for start in range(0, len(concert_ids), chunk_size):
+            indexed += index_concerts(session, concert_ids[start:start + chunk_size])
+            session.commit()
+            logger.info(f"Indexed {min(start + chunk_size, len(concert_ids))} / {len(concert_ids)} concerts...")
+
+        logger.info(f"Similarity index built: {indexed} setlists")
+
+
+if __name__ == "__main__":
+    from config import setup_logging
+
+    setup_logging()
+    rebuild_index()
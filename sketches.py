@@ -0,0 +1,274 @@
+import heapq
+import logging
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from sqlalchemy import select, extract, delete, text
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+
+from models import Concert, SetlistItem, SongSketch
+
+logger = logging.getLogger(__name__)
+
+CAPACITY = 200  # counters kept per sketch
+GLOBAL_SCOPE = "global"
+YEAR_SCOPE_PREFIX = "year:"
+
+# Every slice is striped over SHARDS rows. A loading transaction claims a
+# shard (advisory lock on SKETCH_LOCK_KEY, shard) and only touches its rows,
+# so concurrent loaders do not queue behind each other's row locks; readers
+# merge the shards of a slice, which keeps the error bound.
+SHARDS = 4
+SKETCH_LOCK_KEY = 0x736B6574
+
+# Databases created before sketches were striped (python sketches.py applies it)
+MIGRATION = [
+    "ALTER TABLE song_sketches ADD COLUMN IF NOT EXISTS shard SMALLINT NOT NULL DEFAULT 0",
+    "ALTER TABLE song_sketches DROP CONSTRAINT IF EXISTS song_sketches_pkey",
+    "ALTER TABLE song_sketches ADD PRIMARY KEY (scope, shard)",
+]
+
+
+def artist_scope(artist_mbid: str) -> str:
+    return f"artist:{artist_mbid}"
+
+
+def year_scope(year: int) -> str:
+    return f"{YEAR_SCOPE_PREFIX}{year}"
+
+
+class SpaceSaving:
+    """Space-Saving heavy-hitter sketch (Metwally et al.) with `capacity` counters.
+
+    Each counter holds an estimated count and the overestimation it may carry.
+    For a stream of `total` items every estimate satisfies
+    true <= count <= true + total / capacity, and any song played more than
+    total / capacity times is guaranteed to be in the sketch.
+    """
+
+    def __init__(self, capacity: int = CAPACITY, total: int = 0,
+                 counters: Optional[Dict[str, List[int]]] = None):
+        self.capacity = capacity
+        self.total = total
+        self.counters: Dict[str, List[int]] = counters or {}  # song -> [count, error]
+        # (count, song) per counter, built on the first eviction. Entries are not
+        # updated when a count grows, only when they surface as the minimum.
+        self._heap: Optional[List[Tuple[int, str]]] = None
+
+    def add(self, song: str, weight: int = 1) -> None:
+        self.total += weight
+        counter = self.counters.get(song)
+        if counter is not None:
+            counter[0] += weight
+            return
+        if len(self.counters) < self.capacity:
+            floor = 0
+        else:
+            # Replace the smallest counter; the newcomer inherits its count as error
+            floor = self._evict()
+        self.counters[song] = [floor + weight, floor]
+        if self._heap is not None:
+            heapq.heappush(self._heap, (floor + weight, song))
+
+    def _evict(self) -> int:
+        """Drop the smallest counter in O(log capacity) amortized; returns its count"""
+        if self._heap is None:
+            self._heap = [(count, song) for song, (count, _) in self.counters.items()]
+            heapq.heapify(self._heap)
+        while True:
+            count, song = heapq.heappop(self._heap)
+            current = self.counters[song][0]
+            if current == count:
+                del self.counters[song]
+                return count
+            heapq.heappush(self._heap, (current, song))
+
+    def remove(self, song: str) -> None:
+        """Take back one occurrence counted earlier (a setlist edited upstream).
+
+        Monitored counts stay upper bounds of their songs, but the smallest
+        counter can drop below the count of a song evicted earlier, so songs
+        missing from the sketch are no longer bounded by `error_bound`.
+        Loads that retract songs rebuild the sketches afterwards
+        (`rebuild_sketches`).
+        """
+        self.total = max(self.total - 1, 0)
+        counter = self.counters.get(song)
+        if counter is None:
+            return
+        self._heap = None  # counts only grow between rebuilds of the heap
+        counter[0] -= 1
+        counter[1] = min(counter[1], counter[0])
+        if counter[0] <= 0:
+            del self.counters[song]
+
+    def _floor(self) -> int:
+        """Upper bound of the count of any song missing from a full sketch"""
+        if len(self.counters) < self.capacity:
+            return 0
+        return min(count for count, _ in self.counters.values())
+
+    def merge(self, other: "SpaceSaving") -> "SpaceSaving":
+        """Combine two sketches; the error bound stays (total_a + total_b) / capacity"""
+        floor_a, floor_b = self._floor(), other._floor()
+        combined = {}
+        for song in self.counters.keys() | other.counters.keys():
+            count_a, error_a = self.counters.get(song, (floor_a, floor_a))
+            count_b, error_b = other.counters.get(song, (floor_b, floor_b))
+            combined[song] = [count_a + count_b, error_a + error_b]
+
+        capacity = max(self.capacity, other.capacity)
+        kept = sorted(combined.items(), key=lambda item: (-item[1][0], item[0]))[:capacity]
+        return SpaceSaving(capacity, self.total + other.total, dict(kept))
+
+    def top(self, limit: int) -> List[dict]:
+        ranked = sorted(self.counters.items(), key=lambda item: (-item[1][0], item[0]))[:limit]
+        return [{"name": song, "count": count, "error": error} for song, (count, error) in ranked]
+
+    @property
+    def error_bound(self) -> int:
+        return self.total // self.capacity
+
+    @classmethod
+    def from_row(cls, row: SongSketch) -> "SpaceSaving":
+        return cls(row.capacity, row.total, {song: list(counter) for song, counter in row.counters.items()})
+
+
+def merge_all(sketches: Iterable[SpaceSaving]) -> Optional[SpaceSaving]:
+    merged = None
+    for sketch in sketches:
+        merged = sketch if merged is None else merged.merge(sketch)
+    return merged
+
+
+def _song_rows(concert_ids: Optional[Sequence[str]] = None):
+    query = (
+        select(Concert.artist_mbid, extract('YEAR', Concert.concert_date).label("year"), SetlistItem.song_name)
+        .join(Concert, (Concert.concert_id == SetlistItem.concert_id)
+              & (Concert.concert_date == SetlistItem.concert_date))
+    )
+    if concert_ids is not None:
+        query = query.where(SetlistItem.concert_id.in_(concert_ids))
+    return query
+
+
+def feed(sketches: Dict[str, SpaceSaving], rows: Iterable[Tuple[str, int, str]]) -> None:
+    """Stream (artist, year, song) rows into the global, artist and year sketches"""
+    for artist_mbid, year, song_name in rows:
+        for scope in (GLOBAL_SCOPE, artist_scope(artist_mbid), year_scope(int(year))):
+            sketches[scope].add(song_name)
+
+
+def save_sketches(session: Session, sketches: Dict[str, SpaceSaving], shard: int = 0) -> None:
+    if not sketches:
+        return
+
+    stmt = insert(SongSketch).values([
+        {"scope": scope, "shard": shard, "capacity": sketch.capacity, "total": sketch.total,
+         "counters": sketch.counters}
+        for scope, sketch in sketches.items()
+    ])
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[SongSketch.scope, SongSketch.shard],
+        set_={"capacity": stmt.excluded.capacity, "total": stmt.excluded.total, "counters": stmt.excluded.counters}
+    )
+    session.execute(stmt)
+
+
+def claim_shard(session: Session) -> int:
+    """Shard this transaction writes: the first one no other transaction holds.
+
+    With more concurrent loaders than shards the last one waits for its
+    shard, like every loader did on the single row before striping.
+    """
+    for shard in range(SHARDS):
+        if session.scalar(text("SELECT pg_try_advisory_xact_lock(:key, :shard)"),
+                          {"key": SKETCH_LOCK_KEY, "shard": shard}):
+            return shard
+    shard = session.scalar(text("SELECT pg_backend_pid()")) % SHARDS
+    session.execute(text("SELECT pg_advisory_xact_lock(:key, :shard)"), {"key": SKETCH_LOCK_KEY, "shard": shard})
+    return shard
+
+
+def _load_sketches(session: Session, rows: List[Tuple[str, int, str]], shard: int) -> Dict[str, SpaceSaving]:
+    """Stored sketches of one shard for every scope the rows touch (the shard is claimed)"""
+    scopes = {GLOBAL_SCOPE}
+    for artist_mbid, year, _ in rows:
+        scopes.update((artist_scope(artist_mbid), year_scope(int(year))))
+
+    sketches: Dict[str, SpaceSaving] = defaultdict(SpaceSaving)
+    stored = session.scalars(
+        select(SongSketch).where(SongSketch.scope.in_(scopes), SongSketch.shard == shard)
+    )
+    for row in stored:
+        sketches[row.scope] = SpaceSaving.from_row(row)
+    return sketches
+
+
+def update_sketches(session: Session, concert_ids: Sequence[str]) -> int:
+    """Add songs of newly loaded concerts to the stored sketches; runs in the caller's transaction"""
+    if not concert_ids:
+        return 0
+
+    rows = session.execute(_song_rows(concert_ids)).all()
+    shard = claim_shard(session)
+    sketches = _load_sketches(session, rows, shard)
+    feed(sketches, rows)
+    save_sketches(session, sketches, shard)
+    return len(rows)
+
+
+def retract_sketches(session: Session, concert_ids: Sequence[str]) -> None:
+    """Remove the current songs of concerts about to be replaced (edited upstream).
+
+    Keeps the sketches close until the load ends; the error bound only holds
+    again after `rebuild_sketches` (see SpaceSaving.remove). The songs are
+    taken from the claimed shard, which need not be the one that counted them.
+    """
+    if not concert_ids:
+        return
+
+    rows = session.execute(_song_rows(concert_ids)).all()
+    shard = claim_shard(session)
+    sketches = _load_sketches(session, rows, shard)
+    for artist_mbid, year, song_name in rows:
+        for scope in (GLOBAL_SCOPE, artist_scope(artist_mbid), year_scope(int(year))):
+            sketches[scope].remove(song_name)
+    save_sketches(session, sketches, shard)
+
+
+def rebuild_sketches(chunk_size: int = 10000) -> None:
+    """Recompute every sketch with one pass over setlistitems"""
+    from sqlalchemy.orm import sessionmaker
+    from load_to_db import get_engine
+
+    engine = get_engine()
+    SongSketch.__table__.create(engine, checkfirst=True)
+    with engine.begin() as connection:
+        for statement in MIGRATION:
+            connection.execute(text(statement))
+    SessionLocal = sessionmaker(bind=engine)
+
+    with SessionLocal() as session:
+        # Waits for loading transactions holding any shard
+        for shard in range(SHARDS):
+            session.execute(text("SELECT pg_advisory_xact_lock(:key, :shard)"),
+                            {"key": SKETCH_LOCK_KEY, "shard": shard})
+        session.execute(delete(SongSketch))
+        sketches: Dict[str, SpaceSaving] = defaultdict(SpaceSaving)
+        feed(sketches, session.execute(_song_rows(), execution_options={"yield_per": chunk_size}))
+
+        items = list(sketches.items())
+        for start in range(0, len(items), 500):
+            save_sketches(session, dict(items[start:start + 500]))
+        session.commit()
+
+    logger.info(f"Song sketches rebuilt for {len(sketches)} scopes")
+
+
+if __name__ == "__main__":
+    from config import setup_logging
+
+    setup_logging()
+    rebuild_sketches()
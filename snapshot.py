@@ -0,0 +1,235 @@
+import asyncio
+import fcntl
+import logging
+import mmap
+import os
+import struct
+import time
+from typing import Dict, List, Optional, Tuple
+
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+# File layout: header, index entries (key + payload position), then the
+# pre-encoded JSON payloads back to back. The version is the change feed
+# position (concert_changes.change_seq) the payloads were computed at.
+MAGIC = b"ROCKSNP2"
+HEADER = struct.Struct("<8sdqI")  # magic, built_at, version, entry count
+ENTRY = struct.Struct("<HQQ")  # key length, payload offset, payload length
+
+
+def write_snapshot(path: str, payloads: Dict[str, bytes], version: int) -> None:
+    """Write all payloads to a new file and atomically swap it into place"""
+    keys = [(key.encode("utf-8"), payload) for key, payload in payloads.items()]
+    index_size = HEADER.size + sum(ENTRY.size + len(key) for key, _ in keys)
+
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, time.time(), version, len(keys)))
+        offset = index_size
+        for key, payload in keys:
+            f.write(ENTRY.pack(len(key), offset, len(payload)))
+            f.write(key)
+            offset += len(payload)
+        for _, payload in keys:
+            f.write(payload)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class SnapshotReader:
+    """Serves payloads straight from a memory-mapped snapshot file.
+
+    Every worker maps the same file, so the pages are shared through the OS
+    page cache. A rebuilt file is picked up by checking its inode at most
+    every `check_interval` seconds; the old mapping is released once no
+    response references it anymore.
+    """
+
+    def __init__(self, path: Optional[str] = None, check_interval: float = 1.0):
+        self._path = path
+        self.check_interval = check_interval
+        self.built_at: Optional[float] = None
+        self.version = -1  # no snapshot loaded
+        self._view: Optional[memoryview] = None
+        self._index: Dict[str, memoryview] = {}
+        self._inode = None
+        self._checked_at = 0.0
+
+    @property
+    def path(self) -> str:
+        # Resolved on use, so importing this module does not read the settings
+        return self._path or settings.stats_snapshot_path
+
+    def _load(self, inode) -> None:
+        with open(self.path, "rb") as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(mapped)
+
+        magic, built_at, version, count = HEADER.unpack_from(view, 0)
+        if magic != MAGIC:
+            raise ValueError(f"'{self.path}' is not a stats snapshot")
+
+        index = {}
+        position = HEADER.size
+        for _ in range(count):
+            key_length, offset, length = ENTRY.unpack_from(view, position)
+            position += ENTRY.size
+            key = bytes(view[position:position + key_length]).decode("utf-8")
+            position += key_length
+            index[key] = view[offset:offset + length]
+
+        self._view, self._index, self._inode = view, index, inode
+        self.built_at, self.version = built_at, version
+        logger.info(f"Loaded stats snapshot with {count} payloads (version {version}, "
+                    f"built at {time.ctime(built_at)})")
+
+    def _refresh(self, force: bool = False) -> None:
+        now = time.monotonic()
+        if not force and now - self._checked_at < self.check_interval:
+            return
+        self._checked_at = now
+
+        try:
+            inode = os.stat(self.path).st_ino
+        except FileNotFoundError:
+            self._index = {}
+            self._inode = None
+            self.version = -1
+            return
+
+        if inode != self._inode:
+            try:
+                self._load(inode)
+            except (OSError, ValueError, struct.error) as e:
+                logger.error(f"Failed to load stats snapshot: {e}")
+
+    def get(self, key: str) -> Optional[memoryview]:
+        self._refresh()
+        return self._index.get(key)
+
+    def reload(self) -> None:
+        """Pick up a file this process just wrote without waiting for the next check"""
+        self._refresh(force=True)
+
+
+reader = SnapshotReader()
+
+
+def _stats_sources() -> List[tuple]:
+    import api_crud as crud
+    from api_schemas import StatTopItem, StatYearItem, StatGeoItem, StatHeatmapItem
+
+    return [
+        ("top-artists", crud.get_stats_top_artists, StatTopItem),
+        ("top-songs", crud.get_stats_top_songs, StatTopItem),
+        ("concerts-by-year", crud.get_stats_concerts_by_year, StatYearItem),
+        ("geography", crud.get_stats_geography, StatGeoItem),
+        ("cities", crud.get_stats_cities, StatGeoItem),
+        ("heatmap", crud.get_stats_heatmap, StatHeatmapItem),
+    ]
+
+
+async def build_payloads() -> Tuple[int, Dict[str, bytes]]:
+    """Run every stats query once on the primary and encode it exactly like the API would.
+
+    The queries share one REPEATABLE READ transaction with the change feed
+    lookup, so the returned version matches the data.
+    """
+    from pydantic import TypeAdapter
+    from sqlalchemy import text
+    from api_database import background, async_session
+    import changes
+
+    payloads = {}
+    async with background.slot(), async_session() as db:
+        await db.connection(execution_options={"isolation_level": "REPEATABLE READ"})
+        version = await db.scalar(text(changes.LATEST_SEQ))
+        for key, loader, model in _stats_sources():
+            data = await loader(db)
+            # Validated first, like FastAPI does with response_model: dumping the
+            # loaders' plain dicts as models directly warns for every row
+            adapter = TypeAdapter(List[model])
+            payloads[key] = adapter.dump_json(adapter.validate_python(data))
+    return version, payloads
+
+
+async def build_async(path: Optional[str] = None) -> int:
+    path = path or settings.stats_snapshot_path
+    version, payloads = await build_payloads()
+    write_snapshot(path, payloads, version)
+    logger.info(f"Stats snapshot version {version} written to '{path}' ({len(payloads)} payloads)")
+    return version
+
+
+def build(path: Optional[str] = None) -> None:
+    from api_database import engine
+
+    async def run():
+        try:
+            await build_async(path)
+        finally:
+            await engine.dispose()
+
+    asyncio.run(run())
+
+
+class SnapshotBuilder:
+    """Rebuilds the snapshot of this host after data changes.
+
+    Subscribed to the change listener of every worker, but only the worker
+    holding the lock file builds; the others keep serving the previous
+    snapshot until the new file is swapped in. Rebuilds start at most every
+    `interval` seconds, so the stats queries run once per interval and host
+    during a load, however many workers there are.
+    """
+
+    def __init__(self, snapshot_reader: SnapshotReader, interval: Optional[float] = None):
+        self.reader = snapshot_reader
+        self._interval = interval
+        self.wanted = 0
+        self._built_at = float("-inf")
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def interval(self) -> float:
+        return settings.stats_snapshot_interval if self._interval is None else self._interval
+
+    async def on_change(self, change: dict):
+        self.request(change.get("seq", 0))
+
+    def request(self, seq: int) -> None:
+        """Make sure a snapshot of at least version `seq` gets built"""
+        self.wanted = max(self.wanted, seq)
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self) -> None:
+        path = self.reader.path
+        try:
+            with open(f"{path}.lock", "a") as lock:
+                try:
+                    fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    return  # another worker of this host is rebuilding
+                self.reader.reload()
+                while self.reader.version < self.wanted:
+                    await asyncio.sleep(max(0.0, self._built_at + self.interval - time.monotonic()))
+                    self._built_at = time.monotonic()
+                    if await build_async(path) <= self.reader.version:
+                        break
+                    self.reader.reload()
+        except Exception as e:
+            logger.error(f"Failed to rebuild stats snapshot: {e}")
+
+
+builder = SnapshotBuilder(reader)
+
+
+if __name__ == "__main__":
+    from config import setup_logging
+
+    setup_logging()
+    build()
@@ -0,0 +1,156 @@
+import logging
+from typing import Sequence
+
+from sqlalchemy import select, insert, delete, func, text
+from sqlalchemy.orm import Session
+
+from models import Artist, Concert, ArtistSummary, ArtistSummaryQueue
+
+logger = logging.getLogger(__name__)
+
+TOP_SONGS = 10
+
+# Recomputes the summary rows of the given artists in one statement
+REFRESH_SUMMARIES = text(f"""
+    WITH shows AS (
+        SELECT artist_mbid, COUNT(*) AS concert_count,
+               MIN(concert_date) AS first_show, MAX(concert_date) AS last_show
+        FROM concerts
+        WHERE artist_mbid = ANY(:artists)
+        GROUP BY artist_mbid
+    ),
+    songs AS (
+        SELECT c.artist_mbid, s.song_name, COUNT(*) AS plays,
+               COUNT(*) FILTER (WHERE s.is_cover) AS covers
+        FROM setlistitems s
+        JOIN concerts c ON c.concert_id = s.concert_id AND c.concert_date = s.concert_date
+        WHERE c.artist_mbid = ANY(:artists)
+        GROUP BY c.artist_mbid, s.song_name
+    ),
+    song_totals AS (
+        SELECT artist_mbid, SUM(plays) AS songs_played, COUNT(*) AS distinct_songs, SUM(covers) AS covers
+        FROM songs
+        GROUP BY artist_mbid
+    ),
+    top_songs AS (
+        SELECT artist_mbid,
+               jsonb_agg(jsonb_build_object('name', song_name, 'count', plays) ORDER BY plays DESC, song_name) AS top_songs
+        FROM (
+            SELECT artist_mbid, song_name, plays,
+                   ROW_NUMBER() OVER (PARTITION BY artist_mbid ORDER BY plays DESC, song_name) AS rank
+            FROM songs
+        ) ranked
+        WHERE rank <= {TOP_SONGS}
+        GROUP BY artist_mbid
+    ),
+    countries AS (
+        SELECT c.artist_mbid, array_agg(DISTINCT co.country_name ORDER BY co.country_name) AS countries
+        FROM concerts c
+        JOIN venues v ON v.venue_id = c.venue_id
+        JOIN cities ci ON ci.city_id = v.city_id
+        JOIN countries co ON co.country_code = ci.country_code
+        WHERE c.artist_mbid = ANY(:artists)
+        GROUP BY c.artist_mbid
+    )
+    INSERT INTO artist_summaries (
+        artist_mbid, concert_count, songs_played, distinct_songs, cover_ratio,
+        countries, top_songs, first_show, last_show
+    )
+    SELECT sh.artist_mbid, sh.concert_count,
+           COALESCE(st.songs_played, 0), COALESCE(st.distinct_songs, 0),
+           COALESCE(st.covers::FLOAT / NULLIF(st.songs_played, 0), 0),
+           COALESCE(co.countries, ARRAY[]::VARCHAR[]), COALESCE(ts.top_songs, '[]'::JSONB),
+           sh.first_show, sh.last_show
+    FROM shows sh
+    LEFT JOIN song_totals st ON st.artist_mbid = sh.artist_mbid
+    LEFT JOIN top_songs ts ON ts.artist_mbid = sh.artist_mbid
+    LEFT JOIN countries co ON co.artist_mbid = sh.artist_mbid
+    ON CONFLICT (artist_mbid) DO UPDATE SET
+        concert_count = EXCLUDED.concert_count,
+        songs_played = EXCLUDED.songs_played,
+        distinct_songs = EXCLUDED.distinct_songs,
+        cover_ratio = EXCLUDED.cover_ratio,
+        countries = EXCLUDED.countries,
+        top_songs = EXCLUDED.top_songs,
+        first_show = EXCLUDED.first_show,
+        last_show = EXCLUDED.last_show
+""")
+
+
+def refresh_artists(session: Session, artist_mbids: Sequence[str]) -> None:
+    """Recompute summaries of the given artists; runs in the caller's transaction"""
+    if artist_mbids:
+        session.execute(REFRESH_SUMMARIES, {"artists": list(artist_mbids)})
+
+
+def queue_artists(session: Session, artist_mbids: Sequence[str]) -> None:
+    """Mark summaries as out of date; runs in the caller's transaction.
+
+    Recomputing a summary reads the artist's whole history, so doing it per
+    batch would make a load quadratic in the concerts per artist. Batches
+    only queue the artists and the load refreshes each of them once at the
+    end (`refresh_queued`). Queue rows are plain appends, so concurrent
+    loaders never wait for each other here.
+    """
+    if artist_mbids:
+        session.execute(insert(ArtistSummaryQueue), [{"artist_mbid": artist} for artist in set(artist_mbids)])
+
+
+def queue_for_concerts(session: Session, concert_ids: Sequence[str]) -> None:
+    """Queue the artists that played the given concerts"""
+    artists = session.scalars(
+        select(Concert.artist_mbid).where(Concert.concert_id.in_(concert_ids)).distinct()
+    ).all()
+    queue_artists(session, artists)
+
+
+def refresh_queued(session: Session, chunk_size: int = 100) -> int:
+    """Refresh every queued artist, committing per chunk; returns the number of artists refreshed.
+
+    Only the queue rows that were read are deleted: rows appended by a load
+    committing meanwhile stay for the next pass.
+    """
+    refreshed = 0
+    while True:
+        pending = session.execute(
+            select(ArtistSummaryQueue.artist_mbid, func.array_agg(ArtistSummaryQueue.queue_id))
+            .group_by(ArtistSummaryQueue.artist_mbid)
+            .order_by(ArtistSummaryQueue.artist_mbid)
+            .limit(chunk_size)
+        ).all()
+        if not pending:
+            return refreshed
+        refresh_artists(session, [artist for artist, _ in pending])
+        session.execute(
+            delete(ArtistSummaryQueue)
+            .where(ArtistSummaryQueue.queue_id.in_([queue_id for _, ids in pending for queue_id in ids]))
+        )
+        session.commit()
+        refreshed += len(pending)
+
+
+def rebuild_summaries(chunk_size: int = 100) -> None:
+    """Compute summaries for every artist (initial backfill)"""
+    from sqlalchemy.orm import sessionmaker
+    from load_to_db import get_engine
+
+    engine = get_engine()
+    ArtistSummary.__table__.create(engine, checkfirst=True)
+    ArtistSummaryQueue.__table__.create(engine, checkfirst=True)
+    SessionLocal = sessionmaker(bind=engine)
+
+    with SessionLocal() as session:
+        # Everything queued so far is covered by the full rebuild below
+        session.execute(delete(ArtistSummaryQueue))
+        artists = session.scalars(select(Artist.artist_mbid).order_by(Artist.artist_mbid)).all()
+        for start in range(0, len(artists), chunk_size):
+            refresh_artists(session, artists[start:start + chunk_size])
+            session.commit()
+        logger.info(f"Artist summaries rebuilt for {len(artists)} artists")
+
+
+if __name__ == "__main__":
+    from config import setup_logging
+
+    setup_logging()
+    rebuild_summaries()
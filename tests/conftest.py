@@ -0,0 +1,46 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# config.Settings() needs these at import; the values win over the checked-in .env
+for name, value in {
+    "DB_USER": "postgres", "DB_PASSWORD": "", "DB_HOST": "localhost", "DB_PORT": "5432",
+    "DB_NAME": "rock_test", "SETLIST_API_KEY": "test",
+}.items():
+    os.environ.setdefault(name, value)
+
+
+@pytest.fixture
+def db_engine():
+    """Engine on the scratch database named by ROCK_TEST_DB; every table is recreated per test"""
+    name = os.environ.get("ROCK_TEST_DB")
+    if not name:
+        pytest.skip("set ROCK_TEST_DB to a scratch database to run database tests")
+
+    from sqlalchemy import create_engine, text
+    from config import settings
+    from models import Base
+    import partitions
+
+    engine = create_engine(
+        f"postgresql+pg8000://{settings.db_user}:{settings.db_password}"
+        f"@{settings.db_host}:{settings.db_port}/{name}"
+    )
+    with engine.begin() as connection:
+        connection.execute(text("DROP SCHEMA public CASCADE"))
+        connection.execute(text("CREATE SCHEMA public"))
+    Base.metadata.create_all(engine)
+    partitions.reset_known_years()
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture
+def db_session(db_engine):
+    from sqlalchemy.orm import Session
+
+    with Session(db_engine) as session:
+        yield session
@@ -0,0 +1,39 @@
+import pytest
+
+pytest.importorskip("seaborn")
+import matplotlib
+
+matplotlib.use("Agg")
+import analytics
+
+
+def draw_title(df):
+    return analytics.plot_title_page(df)
+
+
+def test_unchanged_pages_are_not_drawn_again(tmp_path, monkeypatch):
+    monkeypatch.setattr(analytics, "CACHE_DIR", str(tmp_path))
+    drawn = []
+
+    def draw(df):
+        drawn.append(df)
+        return draw_title(df)
+
+    first_key, first_path = analytics.render_page("title", None, draw)
+    second_key, second_path = analytics.render_page("title", None, draw)
+
+    assert len(drawn) == 1
+    assert (first_key, first_path) == (second_key, second_path)
+    assert first_path.endswith(".png")
+
+
+def test_report_is_assembled_from_rendered_pages(tmp_path, monkeypatch):
+    monkeypatch.setattr(analytics, "CACHE_DIR", str(tmp_path))
+    _, path = analytics.render_page("title", None, draw_title)
+    report = tmp_path / "report.pdf"
+
+    analytics.assemble_report(str(report), [path, path])
+
+    content = report.read_bytes()
+    assert content.startswith(b"%PDF")
+    assert b"/Count 2" in content
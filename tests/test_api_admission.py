@@ -0,0 +1,144 @@
+import asyncio
+
+import api_admission
+from api_admission import AdmissionControlMiddleware, RouteLimit
+
+
+def test_route_limit_sheds_after_waiting():
+    async def run():
+        route_limit = RouteLimit("detail", pool_share=0.5, statement_timeout_ms=1000, max_wait=0.05)
+        route_limit.configure(4)
+        first = await route_limit.acquire()
+        second = await route_limit.acquire()
+        third = await route_limit.acquire()
+        return route_limit, [first, second, third]
+
+    route_limit, results = asyncio.run(run())
+
+    assert route_limit.limit == 2
+    assert results == [None, None, "shed_timeout"]
+
+
+def test_growing_the_pool_admits_waiting_requests():
+    async def run():
+        route_limit = RouteLimit("stats", pool_share=0.5, statement_timeout_ms=1000, max_wait=1.0)
+        route_limit.configure(2)
+        await route_limit.acquire()
+        waiter = asyncio.ensure_future(route_limit.acquire())
+        await asyncio.sleep(0)
+        assert route_limit.waiting == 1
+        route_limit.configure(4)
+        return await waiter, route_limit.active
+
+    assert asyncio.run(run()) == (None, 2)
+
+
+def test_read_routes_follow_the_routable_pool(monkeypatch):
+    pool = [20]
+    monkeypatch.setattr(api_admission, "read_pool_size", lambda: pool[0])
+    middleware = AdmissionControlMiddleware(app=None, export_pool=2)
+    stats = middleware._classify("/api/v1/stats/top-artists")
+    assert stats.limit == 3
+
+    pool[0] = 40  # two healthy replicas of 20
+    middleware._resize(stats)
+    assert stats.limit == 6
+
+    pool[0] = 20  # replicas down, reads go to the primary again
+    middleware._resize(stats)
+    assert stats.limit == 3
+
+
+def test_endpoints_have_their_own_limits():
+    middleware = AdmissionControlMiddleware(app=None, export_pool=2, read_pool=20)
+    names = {
+        path: middleware._classify(path).name
+        for path in ["/api/v1/concerts/nearby", "/api/v1/concerts/c1/similar", "/api/v1/concerts/c1",
+                     "/api/v1/artists/a1/transitions", "/api/v1/artists/a1", "/api/v1/export/setlists",
+                     "/api/v1/stats/top-songs/approx", "/api/v1/stats/heatmap", "/api/v1/unknown"]
+    }
+
+    assert names == {
+        "/api/v1/concerts/nearby": "concerts-nearby", "/api/v1/concerts/c1/similar": "concerts-similar",
+        "/api/v1/concerts/c1": "concerts", "/api/v1/artists/a1/transitions": "artist-transitions",
+        "/api/v1/artists/a1": "artists", "/api/v1/export/setlists": "export",
+        "/api/v1/stats/top-songs/approx": "stats-approx", "/api/v1/stats/heatmap": "stats",
+        "/api/v1/unknown": "other",
+    }
+    assert middleware._classify("/api/v1/export/concerts").limit == 2
+
+
+def test_read_limits_fit_the_read_pool():
+    for pool_size in (10, 14, 20, 40):
+        middleware = AdmissionControlMiddleware(app=None, read_pool=pool_size)
+        admitted = sum(route_limit.limit for _, route_limit in middleware.route_limits if route_limit.reads_replicas)
+        assert admitted <= pool_size
+
+
+def test_streams_are_capped_per_client(monkeypatch):
+    monkeypatch.setattr(api_admission, "STREAMS", api_admission.StreamLimit(per_client=2))
+    closed = asyncio.Event()
+
+    async def stream_app(scope, receive, send):
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await closed.wait()
+
+    async def run():
+        middleware = AdmissionControlMiddleware(stream_app, read_pool=20, rate=100, burst=100)
+        statuses = []
+
+        async def open_stream(host):
+            async def send(message):
+                if message["type"] == "http.response.start":
+                    statuses.append((host, message["status"]))
+            scope = {"type": "http", "path": "/api/v1/stream/stats", "client": (host, 1234)}
+            await middleware(scope, None, send)
+
+        streams = [asyncio.ensure_future(open_stream(host)) for host in ["a", "a", "a", "b"]]
+        await asyncio.sleep(0.01)
+        open_while_streaming = dict(middleware.streams.open)
+        closed.set()
+        await asyncio.gather(*streams)
+        return statuses, open_while_streaming, middleware.streams.open
+
+    statuses, open_while_streaming, open_after = asyncio.run(run())
+
+    assert sorted(statuses) == [("a", 200), ("a", 200), ("a", 429), ("b", 200)]
+    assert open_while_streaming == {"a": 2, "b": 1}
+    assert open_after == {}
+
+
+def test_token_bucket_refills_at_rate(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(api_admission.time, "monotonic", lambda: now[0])
+    bucket = api_admission.TokenBucket(capacity=2)
+
+    assert [bucket.take(rate=1.0, capacity=2) for _ in range(3)] == [0.0, 0.0, 1.0]
+    now[0] += 0.5
+    assert bucket.take(rate=1.0, capacity=2) == 0.5
+    now[0] += 10  # refills only up to capacity
+    assert [bucket.take(rate=1.0, capacity=2) for _ in range(3)] == [0.0, 0.0, 1.0]
+
+
+def test_rate_limited_client_gets_429(monkeypatch):
+    async def app(scope, receive, send):
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+
+    async def run():
+        middleware = AdmissionControlMiddleware(app, read_pool=20, rate=0.001, burst=1)
+        statuses = []
+
+        async def send(message):
+            if message["type"] == "http.response.start":
+                statuses.append((message["status"], dict(message["headers"]).get(b"retry-after")))
+
+        scope = {"type": "http", "path": "/api/v1/concerts/c1", "client": ("10.0.0.1", 1)}
+        await middleware(scope, None, send)
+        await middleware(scope, None, send)
+        return statuses, middleware._classify(scope["path"]).counters
+
+    statuses, counters = asyncio.run(run())
+
+    assert statuses[0] == (200, None)
+    assert statuses[1][0] == 429 and int(statuses[1][1]) >= 1
+    assert counters["rate_limited"] == 1
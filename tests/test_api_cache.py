@@ -0,0 +1,25 @@
+from api_cache import merge_changes, CacheEntry
+
+
+def test_merge_changes_adds_up_months_and_unions_the_rest():
+    first = {"artists": ["a1"], "years": [2021], "months": [[2021, 3, 2]]}
+    second = {"artists": ["a2", "a1"], "years": [2022], "months": [[2021, 3, 1], [2022, 1, 4]]}
+
+    assert merge_changes(first, second) == {
+        "artists": ["a1", "a2"], "years": [2021, 2022], "months": [[2021, 3, 3], [2022, 1, 4]]
+    }
+
+
+def test_merge_changes_keeps_resync():
+    merged = merge_changes({"artists": [], "years": [], "months": [], "resync": True},
+                           {"artists": ["a1"], "years": [2022], "months": [[2022, 1, 1]]})
+
+    assert merged["resync"] is True
+    assert "resync" not in merge_changes(None, {"artists": [], "years": [], "months": []})
+
+
+def test_entries_are_only_affected_by_their_artist_and_years():
+    assert CacheEntry(loader=None).is_affected({"a1"}, {2000})
+    assert not CacheEntry(loader=None, artist_mbid="a2").is_affected({"a1"}, {2022})
+    assert not CacheEntry(loader=None, min_year=2010).is_affected({"a1"}, {2005})
+    assert CacheEntry(loader=None, min_year=2010).is_affected({"a1"}, {2005, 2012})
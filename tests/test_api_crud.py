@@ -0,0 +1,18 @@
+import pytest
+
+import api_crud as crud
+
+
+def test_parse_fields_defaults_to_all():
+    assert crud.parse_fields(None, crud.CONCERT_FIELDS) == crud.CONCERT_FIELDS
+    assert crud.parse_fields("", crud.CONCERT_FIELDS) == crud.CONCERT_FIELDS
+
+
+def test_parse_fields_keeps_id_and_allowed_order():
+    assert crud.parse_fields(" setlist , venue,setlist", crud.CONCERT_FIELDS) == ("concert_id", "venue", "setlist")
+    assert crud.parse_fields("concert_id", crud.CONCERT_FIELDS) == ("concert_id",)
+
+
+def test_parse_fields_rejects_unknown_names():
+    with pytest.raises(ValueError, match="Unknown fields: password, secret"):
+        crud.parse_fields("tour_name,password,secret", crud.ARTIST_CONCERT_FIELDS)
@@ -0,0 +1,123 @@
+import asyncio
+import os
+
+import pytest
+
+import api_database
+from api_database import PrimaryPosition, ReplicaRouter, parse_lsn
+
+
+def test_parse_lsn():
+    assert parse_lsn("0/0") == 0
+    assert parse_lsn("16/B374D848") == (0x16 << 32) + 0xB374D848
+
+
+def test_idle_primary_means_no_lag():
+    position = PrimaryPosition(horizon=12)
+    position.record(1000, now=0)
+    position.record(1000, now=3600)
+
+    assert position.lag_behind(1000, now=3600) == 0.0
+
+
+def test_lag_counts_from_the_first_position_the_replica_lacks():
+    position = PrimaryPosition(horizon=12)
+    position.record(1000, now=0)
+    position.record(2000, now=3600)  # first write after an idle hour
+    position.record(3000, now=3602)
+
+    assert position.lag_behind(1500, now=3603) == 3.0
+    assert position.lag_behind(2500, now=3603) == 1.0
+    assert position.lag_behind(3000, now=3603) == 0.0
+
+
+def test_lag_is_unknown_until_the_history_covers_the_horizon():
+    position = PrimaryPosition(horizon=12)
+    position.record(1000, now=0)
+
+    assert position.lag_behind(500, now=2) is None
+    position.record(1000, now=20)
+    assert position.lag_behind(500, now=20) == 20
+
+
+def test_read_pool_follows_healthy_replicas(monkeypatch):
+    router = ReplicaRouter(["postgresql://reader@replica1/rock", "postgresql://reader@replica2/rock"])
+    monkeypatch.setattr(api_database, "replicas", router)
+    monkeypatch.setattr(api_database.settings, "db_replica_pool_size", 10)
+
+    assert api_database.read_pool_size() == api_database.ENGINE_POOL_SIZE - api_database.BACKGROUND_CONNECTIONS
+    router.replicas[0].healthy = True
+    assert api_database.read_pool_size() == router.replicas[0].pool_size
+    router.replicas[1].healthy = True
+    assert api_database.read_pool_size() == sum(replica.pool_size for replica in router.replicas)
+
+
+@pytest.fixture
+def replica_dsn():
+    """Streaming replica of the test server, e.g. made with pg_basebackup -R"""
+    dsn = os.environ.get("ROCK_TEST_REPLICA_DSN")
+    if not dsn:
+        pytest.skip("set ROCK_TEST_REPLICA_DSN to a streaming replica to run replica tests")
+    return dsn
+
+
+def test_streaming_replica_becomes_healthy_and_serves_reads(replica_dsn):
+    async def run():
+        router = ReplicaRouter([replica_dsn])
+        try:
+            for _ in range(50):
+                await router.check_all()
+                if router.replicas[0].healthy:
+                    break
+                await asyncio.sleep(0.2)
+            replica = router.pick()
+            assert replica is router.replicas[0]
+            assert replica.lag <= api_database.settings.db_replica_max_lag_seconds
+            async with replica.sessionmaker() as session:
+                return await session.scalar(api_database.text("SELECT pg_is_in_recovery()"))
+        finally:
+            await router.stop()
+            await api_database.engine.dispose()
+
+    assert asyncio.run(run()) is True
+
+
+def test_unreachable_replica_falls_back_to_the_primary(replica_dsn, monkeypatch):
+    async def run():
+        router = ReplicaRouter(["postgresql://postgres@127.0.0.1:1/rock"])
+        try:
+            await router.check_all()
+        finally:
+            await router.stop()
+            await api_database.engine.dispose()
+        return router
+
+    router = asyncio.run(run())
+    monkeypatch.setattr(api_database, "replicas", router)
+
+    assert router.pick() is None
+    assert api_database.read_pool_size() == api_database.ENGINE_POOL_SIZE - api_database.BACKGROUND_CONNECTIONS
+
+
+def test_primary_pool_budget_is_split_not_doubled():
+    for total in (3, 10, 20, 50):
+        export_pool, engine_pool, background = api_database.split_primary_pool(total)
+        assert export_pool + engine_pool == total
+        assert 1 <= background < engine_pool
+
+
+def test_background_budget_waits_instead_of_shedding():
+    budget = api_database.ConnectionBudget(1)
+    order = []
+
+    async def work(name):
+        async with budget.slot():
+            order.append((name, budget.active))
+            await asyncio.sleep(0.01)
+
+    async def run():
+        await asyncio.gather(work("first"), work("second"))
+
+    asyncio.run(run())
+    assert order == [("first", 1), ("second", 1)]
+    assert (budget.active, budget.waiting) == (0, 0)
@@ -0,0 +1,44 @@
+import asyncio
+import json
+
+import api_events
+from api_events import StatsBroadcaster, RESYNC
+
+
+def run_change(monkeypatch, change):
+    async def top_artists(key, loader, **options):
+        return [{"name": "Metallica", "count": 1}]
+
+    monkeypatch.setattr(api_events.cache, "get", top_artists)
+    broadcaster = StatsBroadcaster()
+    queue = asyncio.Queue(maxsize=broadcaster.queue_size)
+    broadcaster._subscribers.add(queue)
+    asyncio.run(broadcaster.on_change(change))
+    return [queue.get_nowait() for _ in range(queue.qsize())]
+
+
+def test_new_concerts_are_published_per_month(monkeypatch):
+    messages = run_change(monkeypatch, {"artists": ["a1"], "years": [2022], "months": [[2022, 6, 3]]})
+
+    assert messages[0].startswith(b"id: 1\nevent: concerts\n")
+    data = json.loads(messages[0].split(b"data: ", 1)[1])
+    assert data == {"added": [{"year": 2022, "month": 6, "count": 3}]}
+    assert b"event: top-artists" in messages[1]
+
+
+def test_moved_concerts_trigger_a_resync(monkeypatch):
+    messages = run_change(monkeypatch, {"artists": ["a1"], "years": [2019, 2020], "months": [[2020, 1, 1]],
+                                        "resync": True})
+
+    assert messages[0] == RESYNC
+    assert not any(b"event: concerts" in message for message in messages)
+
+
+def test_slow_subscriber_gets_a_resync_instead_of_stale_events():
+    broadcaster = StatsBroadcaster(queue_size=2)
+    queue = asyncio.Queue(maxsize=2)
+    broadcaster._subscribers.add(queue)
+    for count in range(3):
+        broadcaster.publish("concerts", {"added": [{"year": 2022, "month": 1, "count": count}]})
+
+    assert [queue.get_nowait() for _ in range(queue.qsize())] == [RESYNC]
@@ -0,0 +1,69 @@
+import asyncio
+
+import pytest
+
+import api_export
+
+
+class FakeRows:
+    """Stands in for stream_rows; records whether the cursor was closed"""
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.closed = False
+
+    def __call__(self, query, chunk_size):
+        self.query = query
+        return self._generate()
+
+    async def _generate(self):
+        try:
+            for chunk in self.chunks:
+                yield chunk
+        finally:
+            self.closed = True
+
+
+def test_queries_are_in_primary_key_order():
+    assert "ORDER BY c.concert_id, c.concert_date" in api_export.CONCERTS_QUERY
+    assert "ORDER BY s.concert_id, s.concert_date, s.position_in_set" in api_export.SETLISTS_QUERY
+
+
+def test_closing_export_closes_cursor(monkeypatch):
+    rows = FakeRows([[{"concert_id": "c1"}], [{"concert_id": "c2"}]])
+    monkeypatch.setattr(api_export, "stream_rows", rows)
+
+    async def read_one():
+        stream = api_export.export_stream("setlists")
+        first = await stream.__anext__()
+        await stream.aclose()
+        return first, rows.closed
+
+    assert asyncio.run(read_one()) == (b'{"concert_id": "c1"}\n', True)
+
+
+@pytest.mark.parametrize("spec_version", ["2.0", "2.4"])
+def test_response_closes_export_when_client_disconnects(monkeypatch, spec_version):
+    rows = FakeRows([[{"concert_id": "c1"}], [{"concert_id": "c2"}]])
+    monkeypatch.setattr(api_export, "stream_rows", rows)
+    response = api_export.ExportResponse(api_export.export_stream("setlists"))
+    scope = {"type": "http", "asgi": {"spec_version": spec_version}}
+
+    async def receive():
+        await asyncio.sleep(0.01)
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        if message.get("body"):
+            if spec_version == "2.4":
+                raise OSError("connection reset")
+            await asyncio.sleep(10)  # the disconnect cancels the send
+
+    async def serve():
+        try:
+            await response(scope, receive, send)
+        except Exception:
+            pass
+        return rows.closed  # before asyncio.run finalizes leftover generators
+
+    assert asyncio.run(serve())
@@ -0,0 +1,36 @@
+import asyncio
+import time
+
+from api_profiling import ProfilingMiddleware
+
+
+def busy_child_work(seconds):
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        pass
+
+
+def test_samples_include_tasks_spawned_by_the_request(tmp_path):
+    async def child():
+        busy_child_work(0.2)
+        return b"done"
+
+    async def app(scope, receive, send):
+        body = await asyncio.create_task(child())
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": body})
+
+    middleware = ProfilingMiddleware(app, token="secret", sample_rate=0.0, output_dir=str(tmp_path),
+                                     interval_ms=5)
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {"type": "http", "path": "/api/v1/stats/top-artists", "headers": [(b"x-profile", b"secret")]}
+    asyncio.run(middleware(scope, None, send))
+
+    summary = dict(sent[0]["headers"])[b"x-profile-summary"].decode()
+    assert "busy_child_work" in summary
+    (profile,) = tmp_path.iterdir()
+    assert "child" in profile.read_text()
@@ -0,0 +1,57 @@
+import asyncio
+import json
+import threading
+
+import pytest
+
+import bulk_load
+import load_to_db
+from api_cache import merge_changes
+from tests.test_load_to_db import make_record
+
+
+def test_notify_payloads_fit_the_notify_limit():
+    rows = [(f"mbid-{artist:04d}-{'x' * 30}", 1960 + month // 12, month % 12 + 1, 1)
+            for artist in range(300) for month in range(0, 720, 24)]
+
+    payloads = list(bulk_load.notify_payloads(rows, seq=7))
+
+    assert len(payloads) > 1
+    assert all(len(payload.encode("utf-8")) < bulk_load.NOTIFY_MAX_BYTES for payload in payloads)
+    merged = None
+    for payload in payloads:
+        merged = merge_changes(merged, json.loads(payload))
+    expected = load_to_db.change_payload(rows)
+    expected["seq"] = 7
+    assert merged == expected
+
+
+def test_small_notify_payload_is_sent_whole():
+    payloads = list(bulk_load.notify_payloads([("a1", 2022, 6, 2)], seq=1))
+
+    assert [json.loads(payload) for payload in payloads] == [
+        {"artists": ["a1"], "years": [2022], "months": [[2022, 6, 2]], "seq": 1}
+    ]
+
+
+def test_failed_copy_stops_the_parser_thread(monkeypatch):
+    class FailingConnection:
+        async def copy_records_to_table(self, table, records, columns):
+            raise OSError("connection lost")
+
+    consumed = []
+
+    def records():
+        for i in range(1000):
+            consumed.append(i)
+            yield make_record(concert_id=f"c{i}")
+
+    monkeypatch.setattr(bulk_load, "CHUNK_SIZE", 1)
+    monkeypatch.setattr(bulk_load, "PUT_TIMEOUT", 0.01)
+    stats = {"staged_concerts": 0, "staged_songs": 0, "skipped": 0}
+
+    with pytest.raises(OSError):
+        asyncio.run(bulk_load._copy_to_staging(FailingConnection(), records(), stats))
+
+    assert not any(thread.name == "bulk-load-parser" for thread in threading.enumerate())
+    assert len(consumed) < 1000
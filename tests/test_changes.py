@@ -0,0 +1,26 @@
+from sqlalchemy import select
+
+import changes
+from models import ConcertChange
+from tests.test_load_to_db import load, make_record
+
+
+def test_feed_follows_load_order_then_concert_date(db_session):
+    assert changes.latest_seq(db_session) == 0
+
+    load(db_session, make_record("c2", date="01-07-2022"), make_record("c1", date="01-06-2022"))
+    load(db_session, make_record("c3", date="01-01-2020"))
+
+    feed = db_session.execute(
+        select(ConcertChange.concert_id, ConcertChange.operation).order_by(ConcertChange.change_seq)
+    ).all()
+    assert [tuple(row) for row in feed] == [("c1", "insert"), ("c2", "insert"), ("c3", "insert")]
+    assert changes.latest_seq(db_session) == 3
+
+
+def test_edits_are_recorded_as_updates(db_session):
+    load(db_session, make_record(last_updated="2022-06-15T10:00:00.000+0000"))
+    load(db_session, make_record(songs=("One",), last_updated="2022-06-16T10:00:00.000+0000"))
+
+    operations = db_session.scalars(select(ConcertChange.operation).order_by(ConcertChange.change_seq)).all()
+    assert operations == [changes.INSERT, changes.UPDATE]
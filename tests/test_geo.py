@@ -0,0 +1,29 @@
+import pytest
+
+import geo
+
+BERLIN = (52.52, 13.405)
+PARIS = (48.857, 2.352)
+
+
+def test_haversine_distance():
+    assert geo.haversine_km(*BERLIN, *BERLIN) == 0
+    assert geo.haversine_km(*BERLIN, *PARIS) == pytest.approx(878, abs=5)
+
+
+def test_grid_returns_venues_within_radius():
+    grid = geo.SpatialGrid()
+    grid.add(1, *BERLIN)
+    grid.add(2, 52.39, 13.06)  # Potsdam, ~27 km
+    grid.add(3, *PARIS)
+
+    assert set(grid.query(*BERLIN, radius_km=50)) == {1, 2}
+    assert set(grid.query(*BERLIN, radius_km=1000)) == {1, 2, 3}
+    assert grid.query(*BERLIN, radius_km=50)[2] == pytest.approx(geo.haversine_km(*BERLIN, 52.39, 13.06))
+
+
+def test_grid_wraps_around_the_antimeridian():
+    grid = geo.SpatialGrid()
+    grid.add(1, -17.0, 179.9)
+
+    assert set(grid.query(-17.0, -179.9, radius_km=50)) == {1}
@@ -0,0 +1,153 @@
+import pytest
+from sqlalchemy import select
+
+import load_to_db
+import changes
+import partitions
+from models import Concert, SetlistItem, SongTransition
+
+
+def make_record(concert_id="c1", songs=("Intro", "One", "Battery"), date="14-06-2022",
+                venue="Olympiastadion", last_updated=None):
+    record = {
+        "id": concert_id,
+        "eventDate": date,
+        "artist": {"mbid": "mbid-metallica", "name": "Metallica"},
+        "venue": {"name": venue, "city": {"name": "Berlin", "country": {"code": "DE", "name": "Germany"}}},
+        "sets": {"set": [{"song": [{"name": name} for name in songs]}]},
+        "tour": {"name": "M72"},
+    }
+    if last_updated:
+        record["lastUpdated"] = last_updated
+    return record
+
+
+def new_stats():
+    return {"concerts": 0, "updated": 0, "songs": 0, "skipped": 0}
+
+
+def load(session, *records):
+    """Process records as one batch; returns the operations"""
+    partitions.ensure_year_partitions(session.get_bind(), load_to_db.batch_years(records))
+    stats = new_stats()
+    inserted, updated, replaced = [], [], []
+    for record in records:
+        operation = load_to_db.process_concert(session, record, stats, replaced)
+        if operation == changes.INSERT:
+            inserted.append(record["id"])
+        elif operation == changes.UPDATE:
+            updated.append(record["id"])
+    load_to_db.commit_batch(session, inserted, updated, replaced)
+    return inserted, updated
+
+
+def stored_songs(session, concert_id):
+    return session.scalars(
+        select(SetlistItem.song_name).where(SetlistItem.concert_id == concert_id)
+        .order_by(SetlistItem.position_in_set)
+    ).all()
+
+
+def test_edited_setlist_replaces_concert(db_session):
+    load(db_session, make_record(last_updated="2022-06-15T10:00:00.000+0000"))
+    inserted, updated = load(db_session, make_record(songs=("Intro", "Battery"),
+                                                     last_updated="2022-06-16T10:00:00.000+0000"))
+
+    assert (inserted, updated) == ([], ["c1"])
+    assert stored_songs(db_session, "c1") == ["Intro", "Battery"]
+    edges = db_session.execute(select(SongTransition.from_song, SongTransition.to_song)).all()
+    assert sorted(tuple(edge) for edge in edges) == [("Intro", "Battery")]
+
+
+def test_failed_replacement_keeps_stored_concert(db_session, monkeypatch):
+    load(db_session, make_record(last_updated="2022-06-15T10:00:00.000+0000"))
+
+    def fail(*args, **kwargs):
+        raise RuntimeError("venue lookup failed")
+
+    monkeypatch.setattr(load_to_db, "get_or_create_venue", fail)
+    inserted, updated = load(db_session, make_record(songs=("Intro",), venue="Elsewhere",
+                                                     last_updated="2022-06-16T10:00:00.000+0000"))
+
+    assert (inserted, updated) == ([], [])
+    assert db_session.scalar(select(Concert.concert_id).where(Concert.concert_id == "c1")) == "c1"
+    assert stored_songs(db_session, "c1") == ["Intro", "One", "Battery"]
+    assert db_session.scalar(select(SongTransition.count).where(SongTransition.from_song == "Intro")) == 1
+
+
+@pytest.mark.parametrize("stored, fetched, edited", [
+    ("2022-06-15T10:00:00.000+0000", "2022-06-16T10:00:00.000+0000", True),
+    ("2022-06-16T10:00:00.000+0000", "2022-06-15T10:00:00.000+0000", False),
+    ("2022-06-16T10:00:00.000+0000", "2022-06-16T10:00:00.000+0000", False),
+])
+def test_is_edited_compares_edit_times(db_session, stored, fetched, edited):
+    load(db_session, make_record(last_updated=stored))
+    concert = db_session.scalar(select(Concert))
+    record = make_record(songs=("Other",), last_updated=fetched)
+
+    assert load_to_db.is_edited(db_session, concert, record, concert.concert_date) is edited
+
+
+def test_is_edited_compares_content_without_edit_times(db_session):
+    load(db_session, make_record())
+    concert = db_session.scalar(select(Concert))
+
+    assert not load_to_db.is_edited(db_session, concert, make_record(), concert.concert_date)
+    assert load_to_db.is_edited(db_session, concert, make_record(songs=("One",)), concert.concert_date)
+    assert load_to_db.is_edited(db_session, concert, make_record(venue="Waldbühne"), concert.concert_date)
+
+
+def test_setlist_songs_flags_covers():
+    record = make_record()
+    record["sets"]["set"].append({"song": [{"name": "Whiskey in the Jar", "cover": {"name": "Thin Lizzy"}},
+                                           {"name": ""}]})
+
+    assert load_to_db.setlist_songs(record) == [
+        ("Intro", False), ("One", False), ("Battery", False), ("Whiskey in the Jar", True)
+    ]
+
+
+def test_parse_coords_needs_both_values():
+    assert load_to_db.parse_coords({"lat": 52.5, "long": 13.4}) == (52.5, 13.4)
+    assert load_to_db.parse_coords({"lat": 52.5}) == (None, None)
+    assert load_to_db.parse_coords(None) == (None, None)
+
+
+def test_change_payload_counts_only_new_concerts_per_month():
+    payload = load_to_db.change_payload(
+        [("a1", 2022, 6, 2), ("a2", 2022, 6, 1)],
+        updated_rows=[("a3", 2019, 5, 1)],
+        replaced=[("a3", 2019, 5)],
+    )
+
+    assert payload == {"artists": ["a1", "a2", "a3"], "years": [2019, 2022], "months": [[2022, 6, 3]]}
+
+
+def test_change_payload_requests_resync_when_an_edit_moves_a_concert():
+    payload = load_to_db.change_payload([], updated_rows=[("a1", 2020, 1, 1)], replaced=[("a1", 2019, 12)])
+
+    assert payload == {"artists": ["a1"], "years": [2019, 2020], "months": [], "resync": True}
+
+
+def test_update_is_notified_without_new_concert_counts(db_engine, db_session):
+    import json
+    from config import CHANGES_CHANNEL
+
+    listener = db_engine.raw_connection()
+    try:
+        cursor = listener.cursor()
+        cursor.execute(f"LISTEN {CHANGES_CHANNEL}")
+        listener.commit()
+
+        load(db_session, make_record(last_updated="2022-06-15T10:00:00.000+0000"))
+        load(db_session, make_record(songs=("One",), date="02-01-2023",
+                                     last_updated="2022-06-16T10:00:00.000+0000"))
+        cursor.execute("SELECT 1")
+        payloads = [json.loads(payload) for _, _, payload in listener.driver_connection.notifications]
+    finally:
+        listener.close()
+
+    assert payloads == [
+        {"artists": ["mbid-metallica"], "years": [2022], "months": [[2022, 6, 1]], "seq": 1},
+        {"artists": ["mbid-metallica"], "years": [2022, 2023], "months": [], "resync": True, "seq": 2},
+    ]
@@ -0,0 +1,88 @@
+import json
+
+import make_data
+
+
+def fake_search(calls, names):
+    def api_get(path, params):
+        calls.append(params["artistName"])
+        return {"artist": [{"name": name, "mbid": f"mbid-{name.lower()}"} for name in names]}
+    return api_get
+
+
+def test_resolve_mbid_caches_matches(tmp_path, monkeypatch):
+    calls = []
+    monkeypatch.setattr(make_data, "api_get", fake_search(calls, ["Metallica Tribute", "Metallica"]))
+    cache_path = str(tmp_path / make_data.MBID_CACHE_FILE)
+    cache = {}
+
+    assert make_data.resolve_mbid("Metallica", cache, cache_path) == "mbid-metallica"
+    assert make_data.resolve_mbid("Metallica", cache, cache_path) == "mbid-metallica"
+    assert calls == ["Metallica"]
+    with open(cache_path, encoding="utf-8") as f:
+        assert json.load(f) == {"Metallica": "mbid-metallica"}
+
+
+def test_resolve_mbid_retries_misses_after_ttl(tmp_path, monkeypatch):
+    calls = []
+    monkeypatch.setattr(make_data, "api_get", fake_search(calls, ["Metallica Tribute"]))
+    cache_path = str(tmp_path / make_data.MBID_CACHE_FILE)
+    cache = {}
+
+    assert make_data.resolve_mbid("Metallica", cache, cache_path, now=1000.0) is None
+    assert make_data.resolve_mbid("Metallica", cache, cache_path, now=1000.0 + make_data.MBID_MISS_TTL - 1) is None
+    assert calls == ["Metallica"]
+
+    monkeypatch.setattr(make_data, "api_get", fake_search(calls, ["Metallica"]))
+    later = 1000.0 + make_data.MBID_MISS_TTL
+    assert make_data.resolve_mbid("Metallica", cache, cache_path, now=later) == "mbid-metallica"
+    assert calls == ["Metallica", "Metallica"]
+
+
+def record(concert_id, artist="Metallica", year=2022):
+    return {"id": concert_id, "eventDate": f"14-06-{year}", "artist": {"name": artist}}
+
+
+def test_shard_writer_rotates_and_records_manifest(tmp_path):
+    import load_to_db
+
+    writer = make_data.ShardWriter(str(tmp_path), shard_size=2)
+    writer.write([record("c1"), record("c2"), record("c3", artist="Korn", year=2023)])
+    writer.close()
+
+    manifest = load_to_db.load_manifest(str(tmp_path))
+    assert [shard["records"] for shard in manifest["shards"]] == [2, 1]
+    assert manifest["total_records"] == 3
+    assert manifest["coverage"] == {"Metallica": {"2022": 2}, "Korn": {"2023": 1}}
+    assert not list(tmp_path.glob("*.part"))
+    assert [r["id"] for r in load_to_db.iter_shard_records(str(tmp_path), manifest)] == ["c1", "c2", "c3"]
+
+
+def test_shard_writer_append_keeps_earlier_shards(tmp_path):
+    import load_to_db
+
+    first = make_data.ShardWriter(str(tmp_path))
+    first.write([record("c1")])
+    first.checkpoint()  # closed early: survives a crash before close()
+    assert load_to_db.load_manifest(str(tmp_path))["total_records"] == 1
+    first.close()
+
+    second = make_data.ShardWriter(str(tmp_path), append=True)
+    second.write([record("c2")])
+    second.close()
+
+    manifest = load_to_db.load_manifest(str(tmp_path))
+    assert [shard["file"] for shard in manifest["shards"]] == ["setlists-00000.jsonl.gz", "setlists-00001.jsonl.gz"]
+    assert [r["id"] for r in load_to_db.iter_shard_records(str(tmp_path), manifest)] == ["c1", "c2"]
+
+
+def test_corrupted_shard_is_skipped(tmp_path):
+    import load_to_db
+
+    writer = make_data.ShardWriter(str(tmp_path), shard_size=1)
+    writer.write([record("c1"), record("c2")])
+    writer.close()
+    (tmp_path / "setlists-00000.jsonl.gz").write_bytes(b"garbage")
+
+    manifest = load_to_db.load_manifest(str(tmp_path))
+    assert [r["id"] for r in load_to_db.iter_shard_records(str(tmp_path), manifest)] == ["c2"]
@@ -0,0 +1,94 @@
+import pytest
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError, IntegrityError
+
+import load_to_db
+import partitions
+from tests.test_load_to_db import make_record
+
+
+def partition_exists(engine, table, year):
+    with engine.connect() as connection:
+        return connection.scalar(
+            text("SELECT to_regclass(:name) IS NOT NULL"), {"name": partitions.partition_name(table, year)}
+        )
+
+
+def test_partitions_are_committed_outside_the_callers_transaction(db_engine, db_session):
+    db_session.execute(text("SELECT 1"))  # caller has an open transaction
+    partitions.ensure_year_partitions(db_engine, [2021])
+    db_session.rollback()
+
+    assert partition_exists(db_engine, "concerts", 2021)
+    assert partition_exists(db_engine, "setlistitems", 2021)
+
+
+def test_locked_parent_times_out_without_remembering_the_year(db_engine):
+    with db_engine.connect() as reader:
+        reader.execute(text("SELECT COUNT(*) FROM concerts"))  # holds ACCESS SHARE until rollback
+        with pytest.raises(DBAPIError):
+            partitions.ensure_year_partitions(db_engine, [2030], attempts=1)
+        reader.rollback()
+
+    assert not partition_exists(db_engine, "concerts", 2030)
+    partitions.ensure_year_partitions(db_engine, [2030])
+    assert partition_exists(db_engine, "concerts", 2030)
+
+
+def test_process_data_creates_partitions_per_batch(db_engine, monkeypatch):
+    monkeypatch.setattr(load_to_db, "get_engine", lambda: db_engine)
+    monkeypatch.setattr(load_to_db, "BATCH_SIZE", 2)
+    records = [make_record(f"c{year}", date=f"01-05-{year}") for year in (2018, 2019, 2020)]
+    records.append(make_record("bad", date="not a date"))
+
+    stats = load_to_db.process_data(records)
+
+    assert stats["concerts"] == 3 and stats["skipped"] == 1
+    assert all(partition_exists(db_engine, "concerts", year) for year in (2018, 2019, 2020))
+
+
+def test_batches_keep_order_and_remainder():
+    assert list(load_to_db.iter_batches(iter(range(5)), 2)) == [[0, 1], [2, 3], [4]]
+
+
+def insert_concert(connection, concert_id, concert_date):
+    connection.execute(text(
+        "INSERT INTO concerts (concert_id, artist_mbid, venue_id, concert_date) "
+        "VALUES (:id, 'mbid-metallica', (SELECT MIN(venue_id) FROM venues), :date)"
+    ), {"id": concert_id, "date": concert_date})
+
+
+def test_concert_id_is_unique_across_partitions(db_engine, db_session):
+    partitions.ensure_year_partitions(db_engine, [2021, 2022])
+    load_to_db.process_concert(db_session, make_record("c1", date="01-05-2021"),
+                               {"concerts": 0, "updated": 0, "songs": 0, "skipped": 0})
+    db_session.commit()
+
+    with pytest.raises(IntegrityError, match="concert_ids_pkey"):
+        with db_engine.begin() as connection:
+            insert_concert(connection, "c1", "2022-03-01")
+
+    with db_engine.begin() as connection:
+        connection.execute(text("DELETE FROM setlistitems WHERE concert_id = 'c1'"))
+        connection.execute(text("DELETE FROM concerts WHERE concert_id = 'c1'"))
+        insert_concert(connection, "c1", "2022-03-01")
+        assert connection.scalar(text("SELECT COUNT(*) FROM concert_ids")) == 1
+
+
+def test_migrate_adds_the_guard_to_partitioned_tables(db_engine, db_session):
+    partitions.ensure_year_partitions(db_engine, [2021])
+    load_to_db.process_concert(db_session, make_record("c1", date="01-05-2021"),
+                               {"concerts": 0, "updated": 0, "songs": 0, "skipped": 0})
+    db_session.commit()
+    with db_engine.begin() as connection:
+        connection.execute(text("DROP TRIGGER concerts_unique_id ON concerts"))
+        connection.execute(text("DROP TABLE concert_ids"))
+
+    with db_engine.begin() as connection:
+        partitions.migrate(connection)
+
+    with db_engine.connect() as connection:
+        assert connection.scalars(text("SELECT concert_id FROM concert_ids")).all() == ["c1"]
+    with pytest.raises(IntegrityError):
+        with db_engine.begin() as connection:
+            insert_concert(connection, "c1", "2021-06-01")
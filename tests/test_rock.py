@@ -0,0 +1,24 @@
+import os
+import subprocess
+import sys
+
+import rock
+
+ROCK = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "rock.py")
+
+
+def test_every_measured_command_is_a_subcommand():
+    parser = rock.build_parser()
+
+    for command in rock.COMMANDS:
+        assert parser.parse_args([command]).command == command
+    assert parser.parse_args(["init-db"]).func is rock.cmd_init_db
+
+
+def test_subcommands_import_without_settings(tmp_path):
+    # Settings are read when a command runs, so importing needs neither env vars nor .env
+    env = {"PATH": os.environ.get("PATH", ""), "HOME": str(tmp_path)}
+    for command in ("init-db", "collect", "load", "snapshot"):
+        result = subprocess.run([sys.executable, ROCK, "--import-only", command],
+                                cwd=tmp_path, env=env, capture_output=True, text=True)
+        assert result.returncode == 0, result.stderr
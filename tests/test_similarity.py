@@ -0,0 +1,48 @@
+from sqlalchemy import func, select
+
+import similarity
+from models import ConcertSignature, SetlistBucket
+from tests.test_load_to_db import load, make_record
+
+SONGS = [f"Song {i}" for i in range(60)]
+
+
+def test_signature_ignores_order_case_and_spacing():
+    signature = similarity.compute_signature(["One", "Battery", "Master of Puppets"])
+
+    assert len(signature) == similarity.NUM_PERM
+    assert similarity.compute_signature(["master  of puppets", "BATTERY", "one", ""]) == signature
+    assert similarity.compute_signature(["", ""]) is None
+
+
+def test_packed_signature_round_trips():
+    signature = similarity.compute_signature(SONGS)
+
+    assert similarity.unpack_signature(similarity.pack_signature(signature)) == signature
+
+
+def test_estimate_tracks_jaccard_similarity():
+    base = similarity.compute_signature(SONGS[:40])
+
+    assert similarity.estimate_similarity(base, base) == 1.0
+    # 30 shared of 50 distinct songs: Jaccard 0.6
+    assert abs(similarity.estimate_similarity(base, similarity.compute_signature(SONGS[10:50])) - 0.6) < 0.2
+    assert similarity.estimate_similarity(base, similarity.compute_signature(SONGS[40:])) < 0.1
+
+
+def test_similar_setlists_share_buckets():
+    bands = similarity.band_hashes(similarity.compute_signature(SONGS[:40]))
+    near = similarity.band_hashes(similarity.compute_signature(SONGS[:39] + ["Encore"]))
+    far = similarity.band_hashes(similarity.compute_signature(SONGS[40:]))
+
+    assert [band for band, _ in bands] == list(range(similarity.BANDS))
+    assert all(-2 ** 63 <= bucket < 2 ** 63 for _, bucket in bands)
+    assert set(bands) & set(near)
+    assert not set(bands) & set(far)
+
+
+def test_loaded_concerts_are_indexed(db_session):
+    load(db_session, make_record("c1"), make_record("c2", songs=("One", "Battery")), make_record("c3", songs=()))
+
+    assert sorted(db_session.scalars(select(ConcertSignature.concert_id))) == ["c1", "c2"]
+    assert db_session.scalar(select(func.count()).select_from(SetlistBucket)) == 2 * similarity.BANDS
@@ -0,0 +1,110 @@
+import random
+from collections import Counter
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+import sketches
+from sketches import SpaceSaving
+
+
+def zipf_stream(songs=500, length=20000, seed=7):
+    rng = random.Random(seed)
+    names = [f"song-{i}" for i in range(songs)]
+    weights = [1 / (rank + 1) for rank in range(songs)]
+    return rng.choices(names, weights=weights, k=length)
+
+
+def test_add_keeps_the_error_bound():
+    stream = zipf_stream()
+    sketch = SpaceSaving(capacity=50)
+    for song in stream:
+        sketch.add(song)
+
+    true_counts = Counter(stream)
+    assert sketch.total == len(stream)
+    assert len(sketch.counters) == 50
+    for song, (count, error) in sketch.counters.items():
+        assert count - error <= true_counts[song] <= count <= true_counts[song] + sketch.error_bound
+    for song, count in true_counts.items():
+        if count > sketch.error_bound:
+            assert song in sketch.counters
+
+
+def test_eviction_replaces_the_smallest_counter():
+    sketch = SpaceSaving(capacity=3)
+    for song in ["a", "a", "a", "b", "b", "c"]:
+        sketch.add(song)
+    sketch.add("d")
+    sketch.add("b")
+    sketch.add("e")
+
+    assert sketch.counters == {"a": [3, 0], "b": [3, 0], "e": [3, 2]}
+
+
+def test_merge_keeps_the_error_bound():
+    stream = zipf_stream()
+    first, second = SpaceSaving(capacity=50), SpaceSaving(capacity=50)
+    for index, song in enumerate(stream):
+        (first if index % 2 else second).add(song)
+
+    merged = first.merge(second)
+    true_counts = Counter(stream)
+    assert merged.total == len(stream)
+    assert len(merged.counters) <= 50
+    for song, (count, _) in merged.counters.items():
+        assert true_counts[song] <= count <= true_counts[song] + merged.error_bound
+
+
+def test_remove_keeps_monitored_counts_as_upper_bounds():
+    sketch = SpaceSaving(capacity=2)
+    for song in ["a", "a", "a", "b", "b", "c"]:
+        sketch.add(song)
+    sketch.remove("a")
+
+    counts = {song: count for song, (count, _) in sketch.counters.items()}
+    assert counts["a"] >= 2
+    assert sketch.total == 5
+
+
+def test_remove_drops_counters_that_reach_zero():
+    sketch = SpaceSaving(capacity=4)
+    sketch.add("a")
+    sketch.remove("a")
+    sketch.remove("unknown")
+
+    assert sketch.counters == {}
+    assert sketch.total == 0
+
+
+def test_eviction_after_remove_uses_current_counts():
+    sketch = SpaceSaving(capacity=2)
+    for song in ["a", "a", "a", "b", "b", "c"]:
+        sketch.add(song)
+    for _ in range(3):
+        sketch.remove("a")
+    sketch.add("d")
+
+    assert "a" not in sketch.counters
+    assert "d" in sketch.counters
+
+
+def test_concurrent_loaders_write_different_shards(db_engine):
+    rows = [("mbid-a", 2022, "One"), ("mbid-a", 2022, "Battery")]
+    with Session(db_engine) as first, Session(db_engine) as second:
+        for session in (first, second):
+            shard = sketches.claim_shard(session)
+            stored = sketches._load_sketches(session, rows, shard)
+            sketches.feed(stored, rows)
+            sketches.save_sketches(session, stored, shard)
+        first.commit()
+        second.commit()
+
+        global_rows = first.scalars(
+            select(sketches.SongSketch).where(sketches.SongSketch.scope == sketches.GLOBAL_SCOPE)
+        ).all()
+
+    assert sorted(row.shard for row in global_rows) == [0, 1]
+    merged = sketches.merge_all(SpaceSaving.from_row(row) for row in global_rows)
+    assert merged.total == 4
+    assert merged.counters["One"][0] == 2
@@ -0,0 +1,73 @@
+import asyncio
+import fcntl
+
+import api_cache
+import snapshot
+from api_cache import ChangeListener, QueryCache, merge_changes
+
+
+def test_snapshot_round_trip_keeps_version(tmp_path):
+    path = str(tmp_path / "stats.bin")
+    snapshot.write_snapshot(path, {"top-artists": b"[1]", "heatmap": b"[]"}, version=42)
+
+    reader = snapshot.SnapshotReader(path)
+
+    assert bytes(reader.get("top-artists")) == b"[1]"
+    assert bytes(reader.get("heatmap")) == b"[]"
+    assert reader.get("cities") is None
+    assert reader.version == 42
+
+
+def test_missing_snapshot_has_no_version(tmp_path):
+    reader = snapshot.SnapshotReader(str(tmp_path / "missing.bin"))
+
+    assert reader.get("top-artists") is None
+    assert reader.version == -1
+
+
+def test_staleness_counts_from_the_first_change_the_snapshot_lacks(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(api_cache.time, "monotonic", lambda: now[0])
+    listener = ChangeListener(QueryCache())
+
+    listener._observe(5)
+    now[0] = 103.0
+    listener._observe(7)
+    now[0] = 110.0
+
+    assert listener.stale_for(4) == 10.0
+    assert listener.stale_for(5) == 7.0
+    assert listener.stale_for(7) == 0.0
+    listener._observe(6)  # delivered out of order: already covered by 7
+    assert listener.stale_for(7) == 0.0
+
+
+def test_merged_changes_keep_the_newest_seq():
+    assert merge_changes({"seq": 3}, {"artists": ["a1"], "seq": 9})["seq"] == 9
+    assert "seq" not in merge_changes(None, {"artists": ["a1"]})
+
+
+def test_builder_leaves_the_rebuild_to_the_worker_holding_the_lock(tmp_path, monkeypatch):
+    path = str(tmp_path / "stats.bin")
+    built = []
+
+    async def build_async(target):
+        built.append(target)
+        snapshot.write_snapshot(target, {}, version=len(built))
+        return len(built)
+
+    monkeypatch.setattr(snapshot, "build_async", build_async)
+
+    async def run(builder):
+        builder.request(1)
+        await builder._task
+
+    with open(f"{path}.lock", "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        asyncio.run(run(snapshot.SnapshotBuilder(snapshot.SnapshotReader(path), interval=0)))
+        assert built == []
+
+    reader = snapshot.SnapshotReader(path)
+    asyncio.run(run(snapshot.SnapshotBuilder(reader, interval=0)))
+    assert built == [path]
+    assert reader.version == 1
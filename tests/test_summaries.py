@@ -0,0 +1,30 @@
+from sqlalchemy import select, func
+
+import summaries
+from models import ArtistSummary, ArtistSummaryQueue
+from tests.test_load_to_db import load, make_record
+
+
+def test_batches_queue_artists_and_the_load_refreshes_them_once(db_session):
+    load(db_session, make_record("c1"))
+    load(db_session, make_record("c2", date="15-06-2022", songs=("One", "Fuel")))
+
+    assert db_session.scalar(select(func.count()).select_from(ArtistSummary)) == 0
+    assert db_session.scalar(select(func.count()).select_from(ArtistSummaryQueue)) == 2
+
+    assert summaries.refresh_queued(db_session) == 1
+
+    summary = db_session.scalar(select(ArtistSummary))
+    assert (summary.concert_count, summary.songs_played, summary.distinct_songs) == (2, 5, 4)
+    assert summary.top_songs[0] == {"name": "One", "count": 2}
+    assert db_session.scalar(select(func.count()).select_from(ArtistSummaryQueue)) == 0
+
+
+def test_replaced_concerts_queue_their_artist(db_session):
+    load(db_session, make_record(last_updated="2022-06-15T10:00:00.000+0000"))
+    summaries.refresh_queued(db_session)
+    load(db_session, make_record(songs=("Intro",), last_updated="2022-06-16T10:00:00.000+0000"))
+
+    summaries.refresh_queued(db_session)
+
+    assert db_session.scalar(select(ArtistSummary.songs_played)) == 1
@@ -0,0 +1,25 @@
+from collections import Counter
+
+from sqlalchemy import select
+
+import transitions
+from models import SongTransition
+from tests.test_load_to_db import load, make_record
+
+
+def test_count_transitions_stops_at_concert_boundaries():
+    rows = [
+        ("c1", "a1", "Intro"), ("c1", "a1", "One"), ("c1", "a1", "Battery"),
+        ("c2", "a1", "One"), ("c2", "a1", "Battery"),
+    ]
+
+    assert transitions.count_transitions(rows) == Counter({
+        ("a1", "Intro", "One"): 1, ("a1", "One", "Battery"): 2,
+    })
+
+
+def test_loaded_concerts_add_up_edges(db_session):
+    load(db_session, make_record("c1"), make_record("c2", songs=("One", "Battery")))
+
+    edges = db_session.execute(select(SongTransition.from_song, SongTransition.to_song, SongTransition.count))
+    assert sorted(tuple(edge) for edge in edges) == [("Intro", "One", 1), ("One", "Battery", 2)]
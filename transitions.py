@@ -0,0 +1,114 @@
+import logging
+from collections import Counter
+from typing import Iterable, Optional, Sequence, Tuple
+
+from sqlalchemy import select, delete
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+
+from models import Concert, SetlistItem, SongTransition
+
+logger = logging.getLogger(__name__)
+
+def count_transitions(rows: Iterable[Tuple[str, str, str]]) -> Counter:
+    """Count (artist, song A, song B) edges in a single pass.
+
+    `rows` are (concert_id, artist_mbid, song_name) ordered by concert and
+    position in set.
+    """
+    edges: Counter = Counter()
+    prev_concert = None
+    prev_song = None
+
+    for concert_id, artist_mbid, song_name in rows:
+        if concert_id == prev_concert:
+            edges[(artist_mbid, prev_song, song_name)] += 1
+        prev_concert = concert_id
+        prev_song = song_name
+
+    return edges
+
+
+def _setlist_rows(concert_ids: Optional[Sequence[str]] = None):
+    query = (
+        select(SetlistItem.concert_id, Concert.artist_mbid, SetlistItem.song_name)
+        .join(Concert, (Concert.concert_id == SetlistItem.concert_id)
+              & (Concert.concert_date == SetlistItem.concert_date))
+        .order_by(SetlistItem.concert_id, SetlistItem.position_in_set)
+    )
+    if concert_ids is not None:
+        query = query.where(SetlistItem.concert_id.in_(concert_ids))
+    return query
+
+
+def merge_transitions(session: Session, edges: Counter) -> None:
+    """Add edge counts to the stored graph"""
+    if not edges:
+        return
+
+    stmt = insert(SongTransition).values([
+        {"artist_mbid": artist_mbid, "from_song": from_song, "to_song": to_song, "count": count}
+        for (artist_mbid, from_song, to_song), count in edges.items()
+    ])
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[SongTransition.artist_mbid, SongTransition.from_song, SongTransition.to_song],
+        set_={"count": SongTransition.count + stmt.excluded.count}
+    )
+    session.execute(stmt)
+
+
+def update_transitions(session: Session, concert_ids: Sequence[str]) -> int:
+    """Add transitions of newly loaded concerts; runs in the caller's transaction"""
+    if not concert_ids:
+        return 0
+
+    edges = count_transitions(session.execute(_setlist_rows(concert_ids)))
+    merge_transitions(session, edges)
+    return len(edges)
+
+
+def retract_transitions(session: Session, concert_ids: Sequence[str]) -> None:
+    """Subtract the current setlists of concerts about to be replaced (edited upstream)"""
+    if not concert_ids:
+        return
+
+    edges = count_transitions(session.execute(_setlist_rows(concert_ids)))
+    merge_transitions(session, Counter({edge: -count for edge, count in edges.items()}))
+    session.execute(
+        delete(SongTransition).where(
+            SongTransition.artist_mbid.in_({artist_mbid for artist_mbid, _, _ in edges}),
+            SongTransition.count <= 0
+        )
+    )
+
+
+def rebuild_transitions(chunk_size: int = 10000) -> None:
+    """Recompute the whole graph with one ordered pass over setlistitems"""
+    from sqlalchemy.orm import sessionmaker
+    from load_to_db import get_engine
+
+    engine = get_engine()
+    SongTransition.__table__.create(engine, checkfirst=True)
+    SessionLocal = sessionmaker(bind=engine)
+
+    with SessionLocal() as session:
+        session.execute(delete(SongTransition))
+        rows = session.execute(
+            _setlist_rows(), execution_options={"yield_per": chunk_size}
+        )
+        edges = count_transitions(rows)
+        logger.info(f"Counted {len(edges)} distinct transitions")
+
+        items = list(edges.items())
+        for start in range(0, len(items), chunk_size):
+            merge_transitions(session, Counter(dict(items[start:start + chunk_size])))
+        session.commit()
+
+    logger.info("Song transition graph rebuilt")
+
+
+if __name__ == "__main__":
+    from config import setup_logging
+
+    setup_logging()
+    rebuild_transitions()